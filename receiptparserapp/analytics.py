@@ -0,0 +1,77 @@
+# analytics.py (Vectorized Analytics over Columnar Data)
+# NumPy/pandas counterpart of algorithms.py, which is kept as the reference implementation.
+from typing import Any, Dict, List, Mapping, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = (25, 50, 75, 90, 95, 99)
+
+ReceiptData = Union[pd.DataFrame, Mapping[str, Sequence[Any]], List[Dict[str, Any]]]
+
+
+def to_frame(data: ReceiptData) -> pd.DataFrame:
+    """Accepts a DataFrame, a dict of columns, or a list of receipt dicts."""
+    df = data.copy() if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    if "amount" in df:
+        df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
+    if "transaction_date" in df:
+        df["transaction_date"] = pd.to_datetime(df["transaction_date"], errors="coerce")
+    return df
+
+
+def summarize_amounts(amounts: np.ndarray) -> Dict[str, Any]:
+    """Total, mean, median, mode and percentiles of an amount array (NaNs ignored)."""
+    amounts = amounts[~np.isnan(amounts)]
+    if amounts.size == 0:
+        return {"total_spend": 0, "mean": 0, "median": 0, "mode": "N/A", "count": 0,
+                "percentiles": {p: 0 for p in PERCENTILES}}
+
+    total = float(amounts.sum())
+    # One sort serves the median, every percentile and the run-length mode count.
+    ordered = np.sort(amounts)
+    values, counts = np.unique(ordered, return_counts=True)
+    top = counts.max()
+    winners = values[counts == top]
+
+    return {
+        "total_spend": total,
+        "mean": total / amounts.size,
+        "median": float(np.median(ordered)),
+        "mode": float(winners[0]) if winners.size == 1 else "Multiple",
+        "count": int(amounts.size),
+        "percentiles": dict(zip(PERCENTILES, np.percentile(ordered, PERCENTILES).tolist())),
+    }
+
+
+def _rollup(df: pd.DataFrame, column: str) -> Dict[Any, float]:
+    if column not in df: return {}
+    sums = df.groupby(column, dropna=False, sort=True)["amount"].sum()
+    return {(None if pd.isna(key) else key): float(total) for key, total in sums.items()}
+
+
+def _monthly(df: pd.DataFrame) -> Dict[str, float]:
+    if "transaction_date" not in df: return {}
+    dates = df["transaction_date"]
+    valid = dates.notna()
+    # Group on an integer YYYYMM key and only format the (few) resulting keys as strings.
+    keys = (dates[valid].dt.year * 100 + dates[valid].dt.month).astype(int)
+    sums = df.loc[valid, "amount"].groupby(keys).sum().sort_index()
+    return {f"{key // 100:04d}-{key % 100:02d}": float(total) for key, total in sums.items()}
+
+
+def compute_analytics(data: ReceiptData) -> Dict[str, Any]:
+    """
+    Overall statistics plus per-vendor, per-category, per-currency and per-month spend in one go.
+    Results match algorithms.calculate_aggregates, get_vendor_frequency and get_monthly_spend
+    (up to floating-point summation order).
+    """
+    df = to_frame(data)
+    amounts = df["amount"].to_numpy(dtype=float) if "amount" in df else np.array([], dtype=float)
+    return {
+        "overall": summarize_amounts(amounts),
+        "by_vendor": _rollup(df, "vendor"),
+        "by_category": _rollup(df, "category"),
+        "by_currency": _rollup(df, "currency"),
+        "by_month": _monthly(df),
+    }
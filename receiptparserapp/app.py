@@ -1,41 +1,123 @@
 # app.py (Final Polished and Corrected Version)
+import io
+import json
+import os
+import uuid
 import streamlit as st
 import pandas as pd
-from PIL import Image
 from datetime import datetime
 import plotly.express as px
 
 import database as db
-import ocr_utils
 import data_extraction
-from models import Receipt
-import algorithms
+import ocr_utils
+import ingestion
+import analytics
+import categories
+import currencies
+import metrics
+import worker
 
 st.set_page_config(page_title="Receipt Parser Pro", page_icon="🧾", layout="wide")
 
-def process_and_save_file(uploaded_file):
-    """Processes any supported file type, dispatches to the correct parser, and saves."""
-    try:
-        # Step 1: Process file to get either an Image or a string
-        content = ocr_utils.process_file(uploaded_file)
-        
-        if isinstance(content, Image.Image):
-            # Step 2a: If it's an image, use the vision parser
-            parsed_data = data_extraction.parse_receipt_with_vision(content)
-        elif isinstance(content, str):
-            # Step 2b: If it's text, use the text parser
-            parsed_data = data_extraction.parse_receipt_with_text(content)
-        else:
-            st.warning(f"Could not process file '{uploaded_file.name}'. It might be empty or corrupted.")
-            return False
+PAGE_SIZES = [25, 50, 100, 250]
+EXPORT_LABELS = {"csv": "CSV", "jsonl": "JSON Lines", "parquet": "Parquet"}
+EXPORT_MIME_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+JOB_POLL_SECONDS = 2
+# Workers started from the app exit on their own once the queue has been empty this long.
+WORKER_IDLE_TIMEOUT = 120
+
+def reset_editor():
+    """Gives the data editor a fresh key so it drops edits made against the rows previously shown."""
+    st.session_state.editor_version = st.session_state.get('editor_version', 0) + 1
+
+def drop_export():
+    """Frees a prepared export's bytes; Streamlit keeps serving a download for one more run after it's dropped."""
+    st.session_state.pop('export', None)
+
+def queue_files(files: list, options: dict, processes: int, api_key: str, model_name: str) -> int:
+    """Queues files for background ingestion and starts worker processes if fewer than `processes` are running."""
+    batch_id = uuid.uuid4().hex
+    count = db.enqueue_jobs(batch_id, [(f.name, f.getvalue()) for f in files], options)
+    st.session_state.setdefault('job_batches', []).append(batch_id)
+    missing = processes - db.count_active_workers()
+    if missing > 0: worker.spawn(missing, api_key, model_name, idle_timeout=WORKER_IDLE_TIMEOUT)
+    return count
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(processes: int, api_key: str, model_name: str):
+    """Progress of the files this session queued; reruns on its own every few seconds without touching the rest of the page."""
+    batches = st.session_state.get('job_batches')
+    if not batches: return
+    progress = db.get_job_progress(batches)
+    total = sum(progress[status] for status in db.JOB_STATUSES)
+    finished = progress['done'] + progress['failed']
+    st.subheader("Background Processing")
+    st.progress(finished / total if total else 1.0,
+                text=f"{finished}/{total} files processed · {progress['receipts']} receipts saved · {progress['failed']} failed")
+    if finished < total:
+        workers = db.count_active_workers()
+        st.caption(f"{progress['running']} running · {progress['queued']} queued · {workers} worker(s) active · "
+                   f"{progress['mean_seconds']:.1f}s per file")
+        if not workers:
+            st.warning("No worker is running, e.g. because the previous ones went idle and exited.")
+            if st.button("Start Workers", key="start_workers_button"):
+                worker.spawn(processes, api_key, model_name, idle_timeout=WORKER_IDLE_TIMEOUT)
+    failures = db.get_failed_jobs(batches)
+    if failures:
+        with st.expander(f"Failed files ({progress['failed']})"):
+            for job in failures:
+                st.error(f"'{job['name']}' failed at {job['stage'] or 'processing'}: {job['error']}")
+    if finished == total:
+        if st.button("Dismiss", key="dismiss_jobs_button"):
+            db.delete_finished_jobs(batches)
+            del st.session_state.job_batches
+            st.rerun()
+        # Refresh the grid and dashboard once, when the last file lands.
+        if st.session_state.get('jobs_refreshed') != (len(batches), total):
+            st.session_state.jobs_refreshed = (len(batches), total)
+            st.rerun()
 
-        # Step 3: Save the result for manual correction
-        receipt_obj = Receipt(**parsed_data)
-        db.insert_receipt(receipt_obj)
-        return True
-    except Exception as e:
-        st.error(f"Failed to process '{uploaded_file.name}': {e}")
-        return False
+def render_performance():
+    """Stage timings of this app process merged with those published by workers and CLI runs (see metrics.py)."""
+    with st.expander("⏱️ Performance", expanded=False):
+        live = len(db.get_metrics_snapshots(include_retired=False))
+        summary = metrics.summarize(metrics.merge([metrics.snapshot(), *db.get_metrics_snapshots()]))
+        if not summary["timers_ms"]:
+            st.caption("Nothing has been timed yet.")
+            return
+        st.caption(f"This app, {live} running worker/CLI process(es) and earlier runs, since "
+                   f"{datetime.fromtimestamp(summary['started_at']):%Y-%m-%d %H:%M}. Slowest stages in total first.")
+        timers = pd.DataFrame.from_dict(summary["timers_ms"], orient="index").sort_values("total", ascending=False)
+        st.dataframe(timers[["count", "total", "p50", "p95", "p99", "max"]].round(2).add_suffix(" ms").rename(columns={"count ms": "count"}))
+        if summary["values"]:
+            values = pd.DataFrame.from_dict(summary["values"], orient="index")
+            st.dataframe(values[["count", "total", "p50", "p95", "p99"]].round(0))
+        if summary["counters"]:
+            st.dataframe(pd.Series(summary["counters"], name="count"))
+        st.download_button("Download Metrics (JSON)", data=json.dumps(summary, indent=2), file_name="metrics.json",
+                           mime="application/json", key="download_metrics_button")
+        if st.button("Reset Metrics", key="reset_metrics_button"):
+            db.clear_metrics()
+            metrics.reset()
+            st.rerun()
+
+def render_filters() -> dict:
+    """Search & filter controls; returns kwargs in the shape algorithms.filter_receipts takes."""
+    with st.expander("🔎 Search & Filter", expanded=False):
+        f1, f2, f3, f4 = st.columns(4)
+        vendor_keyword = f1.text_input("Vendor contains")
+        if vendor_keyword.strip():
+            suggestions = db.search_vendors(vendor_keyword, limit=5)
+            f1.caption("Did you mean: " + ", ".join(s["name"] for s in suggestions) if suggestions else "No matching vendors.")
+        dates = f2.date_input("Date range", value=())
+        min_amount = f3.number_input("Min amount", min_value=0.0, value=None, step=1.0)
+        max_amount = f4.number_input("Max amount", min_value=0.0, value=None, step=1.0)
+    return {
+        "vendor_keyword": vendor_keyword.strip(),
+        "date_range": tuple(dates) if len(dates) == 2 else (None, None),
+        "amount_range": (min_amount, max_amount)
+    }
 
 def main():
     st.title("🧾 Receipt Parser & Manager")
@@ -69,19 +151,80 @@ def main():
             accept_multiple_files=True, 
             disabled=not ai_is_ready
         )
+        worker_processes = st.slider(
+            "Background worker processes", 1, max(os.cpu_count() or 1, 4), 1,
+            help="Queued files are processed by separate worker processes, so you can keep using the app meanwhile."
+        )
+        max_workers = st.slider("Concurrent requests per worker", 1, 16, ingestion.DEFAULT_MAX_WORKERS)
+        max_per_minute = st.number_input("Max requests per minute (0 = unlimited)", min_value=0, value=0, step=10)
+        batch_size = st.slider(
+            "Receipts per AI request", 1, 16, ingestion.DEFAULT_BATCH_SIZE,
+            help="Packs several receipts into one request, up to the number of concurrent requests."
+        )
+        skip_duplicates = st.checkbox("Skip files that were already imported", value=True)
+        split_pdf_pages = st.checkbox("One receipt per PDF page", value=False)
+        max_long_edge = st.select_slider(
+            "Max image size sent to AI (px, long edge)", options=[800, 1200, 1600, 2400, 3200],
+            value=ocr_utils.VISION_MAX_LONG_EDGE
+        )
+        use_local_ocr = st.checkbox("Try local OCR first (Tesseract)", value=True)
+        min_confidence = st.slider(
+            "Min local OCR confidence", 0.0, 1.0, ingestion.DEFAULT_MIN_CONFIDENCE, 0.05,
+            disabled=not use_local_ocr, help="Receipts scoring below this are sent to the AI model."
+        )
 
+        # Settings stored with each queued file and passed to ingestion.ingest_files by the worker.
+        job_options = dict(
+            max_workers=max_workers, max_per_minute=max_per_minute or None, skip_duplicates=skip_duplicates,
+            min_confidence=min_confidence if use_local_ocr else None, split_pdf_pages=split_pdf_pages,
+            max_long_edge=max_long_edge, batch_size=batch_size
+        )
         if st.button("Process Uploaded Files", disabled=not ai_is_ready):
             if uploaded_files:
-                success_count, fail_count = 0, 0
-                with st.spinner("Analyzing files with AI..."):
-                    for file in uploaded_files:
-                        if process_and_save_file(file): success_count += 1
-                        else: fail_count += 1
-                st.success(f"Processing complete! Success: {success_count}, Failed: {fail_count}.")
-                if success_count > 0: st.rerun()
+                count = queue_files(uploaded_files, job_options, worker_processes, api_key, model_name)
+                st.success(f"Queued {count} file(s) for background processing.")
                     
+        # Workers do the parsing, so cache lookups and circuit-breaker state come from what the running ones publish.
+        counters = metrics.merge(db.get_metrics_snapshots(include_retired=False))["counters"]
+        hits, misses = counters.get("cache.hits", 0), counters.get("cache.misses", 0)
+        if hits or misses:
+            st.caption(f"Parse cache: {hits:.0f} hits / {misses:.0f} misses ({hits / (hits + misses):.0%} hit rate)")
+        if db.count_paused_workers():
+            st.warning("The AI model is failing repeatedly; requests are paused briefly before trying again.")
+
+        dead_letter_count = db.count_dead_letters()
+        if dead_letter_count:
+            st.caption(f"{dead_letter_count} file(s) failed and are waiting to be reprocessed.")
+            if st.button("Retry Failed Files", key="retry_dead_letters_button", disabled=not ai_is_ready):
+                files = []
+                for letter in db.get_dead_letters(include_payload=True):
+                    f = io.BytesIO(letter["payload"])
+                    f.name = letter["name"]
+                    files.append(f)
+                count = queue_files(files, {**job_options, "skip_duplicates": True}, worker_processes, api_key, model_name)
+                st.success(f"Queued {count} file(s) for reprocessing.")
+
         st.markdown("---")
         st.header("Database Actions")
+        if st.button("Rebuild Summary Tables", key="rebuild_summaries_button",
+                     help="Recompute dashboard totals from scratch, e.g. after editing receipts.db outside the app."):
+            db.rebuild_summaries()
+            st.success("Summary tables rebuilt.")
+        rules_file = st.file_uploader("Category rules (CSV: pattern,category)", type=["csv"], key="category_rules_uploader")
+        if rules_file and st.button("Import Category Rules", key="import_category_rules_button"):
+            count = categories.import_rules_file(io.StringIO(rules_file.getvalue().decode("utf-8")))
+            st.success(f"Imported {count} category rules.")
+        rates_file = st.file_uploader("Exchange rates (CSV: date,currency,rate)", type=["csv"], key="exchange_rates_uploader",
+                                      help=f"Units of each currency per 1 {currencies.RATES_BASE} on each date.")
+        if rates_file and st.button("Import Exchange Rates", key="import_exchange_rates_button"):
+            count = currencies.import_rates_file(io.StringIO(rates_file.getvalue().decode("utf-8")))
+            changed = db.renormalize_all()
+            st.success(f"Imported {count} exchange rates and re-converted {changed} receipts.")
+        if st.button("Re-categorize All Receipts", key="recategorize_button",
+                     help="Apply the current category rules, including ones learned from your edits, to every receipt."):
+            changed = categories.recategorize_all()
+            st.success(f"Updated the category of {changed} receipts.")
+            if changed: st.rerun()
         if st.button("Clear All Receipts⚠️", key="clear_all_button"):
             if 'confirm_delete_all' not in st.session_state: st.session_state.confirm_delete_all = True
             else: del st.session_state.confirm_delete_all
@@ -94,25 +237,45 @@ def main():
                 st.success("All receipts have been deleted.")
                 st.rerun()
 
+        st.markdown("---")
+        render_performance()
+
+    render_job_progress(worker_processes, api_key, model_name)
+
     # --- Data Grid for Editing and Deleting ---
     st.header("Manage Your Receipts")
-    receipts_data = db.get_all_receipts()
+    filters = render_filters()
+    s1, s2, s3 = st.columns([2, 1, 1])
+    sort_by = s1.selectbox("Sort by", ["id", "transaction_date", "amount", "vendor", "category", "currency"])
+    descending = s2.toggle("Descending", value=True)
+    page_size = s3.selectbox("Rows per page", PAGE_SIZES, index=1)
 
-    if not receipts_data:
-        st.info("The database is empty. Upload some receipts to get started.")
-        return
+    # Keyset pagination: keep the cursor each visited page starts after; start over when the view changes.
+    view = (repr(filters), sort_by, descending, page_size)
+    if st.session_state.get('grid_view') != view:
+        st.session_state.grid_view = view
+        st.session_state.page_cursors = [None]
+        reset_editor()
+    cursors = st.session_state.page_cursors
 
-    df = pd.DataFrame(receipts_data)
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'], errors='coerce').dt.date
-    df.dropna(subset=['id'], inplace=True)
+    # Fetch one extra row to know whether there is a next page without counting the table.
+    page_rows = db.get_receipts_page(filters, sort_by, descending, cursors[-1], page_size + 1)
+    has_next = len(page_rows) > page_size
+    page_rows = page_rows[:page_size]
 
-    if 'original_df' not in st.session_state:
-        st.session_state.original_df = df.copy()
+    if not page_rows and len(cursors) == 1:
+        if db.count_receipts() == 0:
+            st.info("The database is empty. Upload some receipts to get started.")
+            return
+        st.info("No receipts match the current filters.")
 
+    df = pd.DataFrame(page_rows, columns=["id", "vendor", "transaction_date", "amount", "category", "currency"])
+    df['transaction_date'] = pd.to_datetime(df['transaction_date'], errors='coerce').dt.date
     df.insert(0, "delete", False)
     
-    edited_df = st.data_editor(
-        df, hide_index=True, key="data_editor",
+    editor_key = f"data_editor_{st.session_state.get('editor_version', 0)}"
+    st.data_editor(
+        df, hide_index=True, key=editor_key,
         column_config={
             "delete": st.column_config.CheckboxColumn("Delete"),
             "id": st.column_config.NumberColumn("ID", disabled=True),
@@ -125,71 +288,125 @@ def main():
         }
     )
 
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("◀ Previous", disabled=len(cursors) == 1, key="prev_page_button"):
+        cursors.pop()
+        reset_editor()
+        st.rerun()
+    p2.caption(f"Page {len(cursors)} · unsaved edits are discarded when changing page")
+    if p3.button("Next ▶", disabled=not has_next, key="next_page_button"):
+        cursors.append((page_rows[-1][sort_by], page_rows[-1]['id']))
+        reset_editor()
+        st.rerun()
+
+    # Only the rows the user touched are tracked: {row position: {column: new value}}.
+    updates, to_delete, category_corrections = [], [], []
+    for position, changes in st.session_state[editor_key]["edited_rows"].items():
+        row = df.iloc[int(position)]
+        receipt_id = int(row['id'])
+        changes = dict(changes)
+        if changes.pop('delete', False): to_delete.append(receipt_id)
+        if changes: updates.append((receipt_id, changes))
+        if 'category' in changes: category_corrections.append((changes.get('vendor', row['vendor']), changes['category']))
+
     # --- Action Buttons (Save, Delete, Export) ---
     st.markdown("---")
     col1, col2, col3 = st.columns([1.5, 2, 1.5])
 
     with col1:
-        # FIX: Using a more robust method to check for changes
-        if not edited_df.drop(columns=['delete']).equals(st.session_state.original_df):
-            if st.button("Save Changes", key="save_changes_button"):
-                for idx in edited_df.index:
-                    original_row = st.session_state.original_df.loc[idx]
-                    edited_row = edited_df.loc[idx]
-                    if not original_row.equals(edited_row.drop('delete')):
-                        receipt_id = int(edited_row['id'])
-                        updates = edited_row.drop(['id', 'delete']).to_dict()
-                        db.update_receipt(receipt_id, updates)
+        if updates:
+            if st.button(f"Save Changes ({len(updates)} rows)", key="save_changes_button"):
+                db.update_receipts_bulk(updates)
+                # Category corrections become rules, so the next receipts from these vendors get them too.
+                categories.learn_overrides(category_corrections)
+                reset_editor()
                 st.success("Changes saved!")
-                st.session_state.original_df = edited_df.drop(columns=['delete']).copy()
                 st.rerun()
 
     with col2:
-        selected_to_delete = edited_df[edited_df.delete]
-        if not selected_to_delete.empty:
-            if st.button(f"Delete {len(selected_to_delete)} Selected Receipts🗑️", key="delete_selected_button"):
-                db.delete_receipts_by_ids(selected_to_delete["id"].tolist())
-                st.session_state.original_df = edited_df[~edited_df.delete].drop(columns=['delete']).copy()
+        if to_delete:
+            if st.button(f"Delete {len(to_delete)} Selected Receipts🗑️", key="delete_selected_button"):
+                db.delete_receipts_by_ids(to_delete)
+                reset_editor()
                 st.rerun()
 
     with col3:
-        export_df = edited_df.drop(columns=['delete'])
-        csv = export_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Export View to CSV", data=csv,
-            file_name='receipts_summary.csv', mime='text/csv', key='download_csv_button'
-        )
+        # Exports every receipt matching the filters, not just this page. The rows are streamed from the
+        # database into an in-memory buffer, which is only handed to the download button once it's complete.
+        fmt = st.selectbox("Export format", db.EXPORT_FORMATS, format_func=EXPORT_LABELS.get, key="export_format")
+        export_view = (repr(filters), fmt)
+        if st.button("Prepare Export", key="prepare_export_button"):
+            drop_export()
+            buffer = io.BytesIO()
+            with st.spinner("Exporting receipts..."):
+                if fmt == "parquet":
+                    count = db.export_receipts(buffer, fmt, filters)
+                else:
+                    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+                    count = db.export_receipts(text, fmt, filters)
+                    text.flush()
+                    text.detach()  # keep the buffer open
+            st.session_state.export = (export_view, buffer.getvalue(), count)
+        # The bytes are only held until they're downloaded or the filters or format change.
+        export = st.session_state.get('export')
+        if export and export[0] != export_view:
+            drop_export()
+        elif export:
+            st.download_button(
+                label=f"📥 Download {export[2]} Receipts ({EXPORT_LABELS[fmt]})", data=export[1],
+                file_name=f"receipts.{fmt}", mime=EXPORT_MIME_TYPES[fmt], key='download_export_button',
+                on_click=drop_export
+            )
 
     st.markdown("---")
 
     # --- Analytics Dashboard ---
     st.header("Analytics Dashboard")
-    analytics_df = edited_df.drop(columns=['delete']).copy()
-    analytics_df['amount'] = pd.to_numeric(analytics_df['amount'], errors='coerce').fillna(0)
-    
-    # ... (Analytics logic is now robust and correct)
-    spend_by_currency = analytics_df.groupby('currency')['amount'].sum()
+
+    # Unfiltered views read the trigger-maintained summary tables; filtered ones run as indexed SQL.
+    spend_by_currency = db.get_currency_spend(filters)
     st.subheader("Total Spend by Currency")
-    if not spend_by_currency.empty:
+    if spend_by_currency:
         cols = st.columns(len(spend_by_currency))
         for i, (currency, total) in enumerate(spend_by_currency.items()):
             cols[i].metric(label=f"Total Spend ({currency})", value=f"{total:,.2f}")
     else:
         st.metric("Total Spend", "$0.00")
 
-    records = analytics_df.to_dict('records')
-    st.caption("Charts below aggregate all amounts regardless of currency.")
-    
-    aggregates = algorithms.calculate_aggregates(records)
+    reporting = currencies.REPORTING_CURRENCY
+    money = lambda amount: currencies.format_amount(amount, reporting)
+    totals = db.get_totals(filters)
+    caption = f"Totals and charts below are converted to {reporting} at the rate on each receipt's date."
+    if totals['unconverted']:
+        caption += f" {totals['unconverted']} receipts without an exchange rate for their currency are left out."
+    st.caption(caption)
+
     c1, c2, c3 = st.columns(3)
-    c1.metric("Total Spend (Aggregated)", f"${aggregates['total_spend']:.2f}")
-    c2.metric("Average Spend", f"${aggregates['mean']:.2f}")
-    c3.metric("Receipt Count", len(records))
+    c1.metric(f"Total Spend ({reporting})", money(totals['total_spend']))
+    c2.metric("Average Spend", money(totals['mean']))
+    c3.metric("Receipt Count", totals['count'])
+
+    # Percentiles and category rollups need the filtered amounts themselves, so only load them on request.
+    if st.toggle("Show detailed statistics", key="detailed_stats_toggle"):
+        columns = db.get_receipt_columns(filters, ("amount_normalized", "category"))
+        stats = analytics.compute_analytics({"amount": columns["amount_normalized"], "category": columns["category"]})
+        overall = stats["overall"]
+        d1, d2, d3, d4 = st.columns(4)
+        d1.metric("Median Spend", money(overall['median']))
+        d2.metric("Most Common Amount", overall['mode'] if isinstance(overall['mode'], str) else money(overall['mode']))
+        d3.metric("90th Percentile", money(overall['percentiles'][90]))
+        d4.metric("99th Percentile", money(overall['percentiles'][99]))
+        if stats["by_category"]:
+            category_df = pd.DataFrame(
+                [(category or "Uncategorized", total) for category, total in stats["by_category"].items()],
+                columns=['Category', 'Amount']
+            )
+            st.bar_chart(category_df.set_index('Category'))
 
     chart1, chart2 = st.columns(2)
     with chart1:
         st.subheader("Spend by Vendor")
-        vendor_spend = algorithms.get_vendor_frequency(records)
+        vendor_spend = db.get_vendor_spend(filters)
         if vendor_spend:
             pie_df = pd.DataFrame(list(vendor_spend.items()), columns=['Vendor', 'Amount'])
             fig = px.pie(pie_df, names='Vendor', values='Amount', hole=.3, title="Spending Distribution")
@@ -197,7 +414,7 @@ def main():
 
     with chart2:
         st.subheader("Monthly Spend Trend")
-        monthly_spend = algorithms.get_monthly_spend(records)
+        monthly_spend = db.get_monthly_spend(filters)
         if monthly_spend:
             line_df = pd.DataFrame(list(monthly_spend.items()), columns=['Month', 'Amount'])
             if len(line_df) >= 3:
@@ -0,0 +1,98 @@
+# benchmarks/bench_analytics.py (Vectorized analytics vs. the algorithms.py reference)
+# Run from the receiptparserapp directory:  python -m benchmarks.bench_analytics --rows 1000 100000
+# Every run first checks that analytics.py reproduces algorithms.py on randomized data, then also times the
+# SQL aggregates behind the dashboard with a min-amount filter on the cached bench_data/suite databases.
+import argparse
+import math
+import random
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import algorithms
+import analytics
+import database as db
+from benchmarks import run_all
+from benchmarks.synthetic import VENDORS
+
+CATEGORIES = ["Groceries", "General Merchandise", "Food & Drink", "Other"]
+CURRENCIES = ["USD", "EUR", "GBP", "INR"]
+# Matches most rows, the case where an index that doesn't cover the query loses to a table scan.
+MIN_AMOUNT_FILTER = {"amount_range": (5, None)}
+SQL_AGGREGATES = (db.get_totals, db.get_monthly_spend, db.get_vendor_spend, db.get_category_spend)
+
+
+def random_records(count: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    # A small price grid makes repeated amounts (and therefore single/multiple modes) likely.
+    prices = [round(rng.uniform(1, 200), 2) for _ in range(max(3, count // 20))]
+    return [{
+        "vendor": rng.choice(VENDORS),
+        "transaction_date": (date(2022, 1, 1) + timedelta(days=rng.randint(0, 1000))).isoformat(),
+        "amount": rng.choice(prices),
+        "category": rng.choice(CATEGORIES),
+        "currency": rng.choice(CURRENCIES),
+    } for _ in range(count)]
+
+
+def _same(a: Any, b: Any) -> bool:
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+def _same_dict(a: Dict[Any, Any], b: Dict[Any, Any]) -> bool:
+    return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+
+
+def check_equivalence(trials: int = 50, max_rows: int = 500):
+    """Raises AssertionError if analytics.py disagrees with the reference on any randomized input."""
+    for trial in range(trials):
+        records = random_records(random.Random(trial).randint(0, max_rows), seed=trial)
+        result = analytics.compute_analytics(records)
+        reference = algorithms.calculate_aggregates(records)
+        overall = {k: result["overall"][k] for k in reference}
+        assert _same_dict(overall, reference), (trial, overall, reference)
+        assert _same_dict(result["by_vendor"], algorithms.get_vendor_frequency(records)), trial
+        assert _same_dict(result["by_month"], algorithms.get_monthly_spend(records)), trial
+    print(f"analytics.py matches algorithms.py on {trials} randomized datasets")
+
+
+def time_call(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def reference_pass(records):
+    algorithms.calculate_aggregates(records)
+    algorithms.get_vendor_frequency(records)
+    algorithms.get_monthly_spend(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the vectorized analytics module.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--no-sql", action="store_true", help="Skip the SQL aggregate timings (which build suite databases).")
+    args = parser.parse_args()
+
+    check_equivalence(args.trials)
+    print(f"{'rows':>9} {'reference ms':>13} {'vectorized ms':>14} {'speedup':>8}")
+    for rows in args.rows:
+        records = random_records(rows, seed=rows)
+        columns = {key: [r[key] for r in records] for key in records[0]}
+        ref = time_call(reference_pass, records)
+        vec = time_call(analytics.compute_analytics, columns)
+        print(f"{rows:>9} {ref * 1000:>13.1f} {vec * 1000:>14.1f} {ref / vec:>7.1f}x")
+
+    if args.no_sql: return
+    print(f"\n{'rows':>9} " + " ".join(f"{fn.__name__ + ' ms':>22}" for fn in SQL_AGGREGATES) + "   (amount >= 5)")
+    for rows in args.rows:
+        run_all.use_database(rows)
+        print(f"{rows:>9} " + " ".join(f"{time_call(fn, MIN_AMOUNT_FILTER) * 1000:>22.1f}" for fn in SQL_AGGREGATES))
+        db.close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/bench_batching.py (Throughput and accuracy vs. receipts per model request)
+# Run from the receiptparserapp directory. Without recordings, perfect answers with --latency are synthesized;
+# record single-receipt responses from the real model once to replay realistic answers and latencies:
+#   python -m benchmarks.bench_batching --record --api-key KEY --model gemini-1.5-flash
+#   python -m benchmarks.bench_batching --batch-sizes 1 2 4 8 16 --drop-rate 0.05
+import argparse
+import io
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List
+
+import data_extraction
+import ingestion
+from benchmarks import synthetic
+from benchmarks.bench_image_sizes import field_accuracy
+from benchmarks.fake_client import RecordedModelClient, RecordingModelClient, fingerprint
+
+RECORDINGS_FILE = "bench_data/batching/recorded_responses.json"
+
+
+def make_dataset(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    return [synthetic.random_receipt(rng) for _ in range(count)]
+
+
+def synthesize_recordings(receipts: List[Dict[str, Any]], latency: float) -> Dict[str, Dict[str, Any]]:
+    """What a perfect model taking `latency` seconds per single-receipt call would have recorded."""
+    recordings = {}
+    for receipt in receipts:
+        prompt = data_extraction.TEXT_PROMPT.format(raw_text=synthetic.render_receipt_text(receipt))
+        answer = {k: receipt[k] for k in ("vendor", "transaction_date", "amount", "currency")}
+        recordings[fingerprint(prompt)] = {"text": json.dumps(answer), "latency": latency}
+    return recordings
+
+
+def record(receipts: List[Dict[str, Any]], path: str):
+    client = RecordingModelClient(data_extraction.model)
+    failed = 0
+    for receipt in receipts:
+        try:
+            data_extraction.parse_receipt_with_text(synthetic.render_receipt_text(receipt), client=client)
+        except data_extraction.ModelCallError:
+            failed += 1  # replayed as a failed receipt too, so it counts against accuracy
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    client.save(path)
+    print(f"Saved {len(client.recordings)} responses to {path} ({failed} unusable)")
+
+
+def run(receipts: List[Dict[str, Any]], client: RecordedModelClient, batch_size: int, args: argparse.Namespace):
+    """Ingests the receipts with enough workers to keep `--concurrency` batches of `batch_size` in flight."""
+    files = []
+    for i, receipt in enumerate(receipts):
+        f = io.BytesIO(synthetic.render_receipt_text(receipt).encode("utf-8"))
+        f.name = f"receipt_{i:05d}.txt"
+        files.append(f)
+
+    client.calls = client.batch_calls = 0
+    start = time.perf_counter()
+    results = ingestion.ingest_files(
+        files, client=client, max_workers=args.concurrency * batch_size, max_per_minute=args.rpm, save=False,
+        use_cache=False, min_confidence=None, batch_size=batch_size, batch_wait=args.batch_wait
+    )
+    elapsed = time.perf_counter() - start
+    accuracy = sum(
+        field_accuracy(r.receipts[0].model_dump(), receipt) for r, receipt in zip(results, receipts) if r.ok
+    ) / len(receipts)
+    single_calls = client.calls - client.batch_calls
+    print(f"{batch_size:>6} {client.calls:>9} {single_calls if batch_size > 1 else 0:>10} "
+          f"{elapsed:>9.2f} {len(receipts) / elapsed:>11.1f} {accuracy:>9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the number of receipts packed into one model request.")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--concurrency", type=int, default=4, help="Model requests in flight at once.")
+    parser.add_argument("--rpm", type=float, default=None, help="Max model requests per minute.")
+    parser.add_argument("--batch-wait", type=float, default=ingestion.DEFAULT_BATCH_WAIT)
+    parser.add_argument("--latency", type=float, default=0.5, help="Single-call latency when no recordings exist.")
+    parser.add_argument("--overhead-share", type=float, default=0.7,
+                        help="Share of a single call's latency that is fixed per-request cost.")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Chance the model omits a receipt from a batch.")
+    parser.add_argument("--recordings", default=RECORDINGS_FILE)
+    parser.add_argument("--record", action="store_true", help="Call the real model and save its responses.")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"))
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+
+    receipts = make_dataset(args.count)
+    if args.record:
+        data_extraction.configure_model(args.api_key, args.model)
+        record(receipts, args.recordings)
+
+    client_options = dict(latency_scale=1.0, overhead_share=args.overhead_share, drop_rate=args.drop_rate)
+    if os.path.exists(args.recordings):
+        client = RecordedModelClient.load(args.recordings, **client_options)
+    else:
+        client = RecordedModelClient(synthesize_recordings(receipts, args.latency), **client_options)
+
+    print(f"{'batch':>6} {'requests':>9} {'fallbacks':>10} {'elapsed s':>9} {'receipts/s':>11} {'accuracy':>9}")
+    for batch_size in args.batch_sizes:
+        run(receipts, client, batch_size, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_image_sizes.py (Extraction accuracy and latency vs. image size sent to the vision model)
+# Run from the receiptparserapp directory. Record once against the real model, then replay offline:
+#   python -m benchmarks.bench_image_sizes --dataset bench_data/images --record --api-key KEY --model gemini-1.5-flash
+#   python -m benchmarks.bench_image_sizes --dataset bench_data/images
+import argparse
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+import data_extraction
+import ocr_utils
+from benchmarks import synthetic
+from benchmarks.fake_client import RecordedModelClient, RecordingModelClient
+
+LABELS_FILE = "labels.json"
+RECORDINGS_FILE = "recorded_responses.json"
+
+
+def ensure_dataset(directory: str, count: int, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    """Loads labels.json from `directory`, generating synthetic photos there first if it's missing."""
+    labels_path = os.path.join(directory, LABELS_FILE)
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    labels = {}
+    for i in range(count):
+        receipt = synthetic.random_receipt(rng)
+        file_name = f"receipt_{i:03d}.jpg"
+        synthetic.render_receipt_image(receipt, rotation=rng.uniform(-4, 4)).save(
+            os.path.join(directory, file_name), quality=92
+        )
+        labels[file_name] = {k: receipt[k] for k in ("vendor", "transaction_date", "amount", "currency")}
+    with open(labels_path, "w", encoding="utf-8") as f:
+        json.dump(labels, f, indent=1)
+    return labels
+
+
+def field_accuracy(parsed: Dict[str, Any], label: Dict[str, Any]) -> float:
+    checks = [
+        bool(parsed.get("vendor")) and label["vendor"].lower() in parsed["vendor"].lower(),
+        str(parsed.get("transaction_date")) == label["transaction_date"],
+        parsed.get("amount") is not None and abs(parsed["amount"] - label["amount"]) < 0.01,
+    ]
+    return sum(checks) / len(checks)
+
+
+def run_setting(directory: str, labels: Dict[str, Dict[str, Any]], client: Any, max_long_edge: Optional[int]) -> Dict[str, Any]:
+    totals = {"bytes": 0, "prep_s": 0.0, "model_s": 0.0, "accuracy": 0.0, "failed": 0}
+    for file_name, label in labels.items():
+        path = os.path.join(directory, file_name)
+        image = Image.open(path)
+        start = time.perf_counter()
+        if max_long_edge:
+            image, stats = ocr_utils.prepare_image_for_model(image, os.path.getsize(path), max_long_edge)
+            totals["bytes"] += stats["prepared_bytes"]
+        else:
+            totals["bytes"] += os.path.getsize(path)
+        totals["prep_s"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            parsed = data_extraction.parse_receipt_with_vision(image, client=client)
+        except data_extraction.ModelCallError:
+            parsed = None  # an unusable answer is a miss on every field
+            totals["failed"] += 1
+        totals["model_s"] += getattr(client, "last_latency", None) or time.perf_counter() - start
+        if parsed is not None:
+            totals["accuracy"] += field_accuracy(parsed, label)
+
+    n = len(labels)
+    return {
+        "max_long_edge": max_long_edge or "original",
+        "avg_kb": totals["bytes"] / n / 1000,
+        "avg_prep_ms": totals["prep_s"] / n * 1000,
+        "avg_model_ms": totals["model_s"] / n * 1000,
+        "accuracy": totals["accuracy"] / n,
+        "failed": totals["failed"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vision extraction across image size settings.")
+    parser.add_argument("--dataset", default="bench_data/images", help="Directory of receipt images + labels.json.")
+    parser.add_argument("--count", type=int, default=20, help="Synthetic images to generate if the dataset is empty.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 2400, 1600, 1200, 800], help="0 = original image.")
+    parser.add_argument("--record", action="store_true", help="Call the real model and save its responses.")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"))
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+
+    labels = ensure_dataset(args.dataset, args.count)
+    recordings_path = os.path.join(args.dataset, RECORDINGS_FILE)
+    if args.record:
+        data_extraction.configure_model(args.api_key, args.model)
+        client = RecordingModelClient(data_extraction.model)
+    else:
+        client = RecordedModelClient.load(recordings_path)
+
+    print(f"{'max edge':>9} {'avg KB':>8} {'prep ms':>8} {'model ms':>9} {'accuracy':>9} {'failed':>7}")
+    for size in args.sizes:
+        row = run_setting(args.dataset, labels, client, size or None)
+        print(f"{row['max_long_edge']:>9} {row['avg_kb']:>8.1f} {row['avg_prep_ms']:>8.1f} "
+              f"{row['avg_model_ms']:>9.1f} {row['accuracy']:>9.1%} {row['failed']:>7}")
+
+    if args.record:
+        client.save(recordings_path)
+        print(f"Saved {len(client.recordings)} responses to {recordings_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# benchmarks/bench_ingestion.py (Throughput of the ingestion pipeline against a fake model)
+# Run from the receiptparserapp directory:  python -m benchmarks.bench_ingestion --files 200
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import database as db
+import ingestion
+from benchmarks.fake_client import FakeModelClient
+
+SAMPLE_TEXT = "WALMART SUPERCENTER\n05/01/2024\nMILK 3.50\nBREAD 2.00\nTOTAL 42.50 USD\n"
+
+
+def make_text_files(count: int):
+    files = []
+    for i in range(count):
+        f = io.BytesIO(SAMPLE_TEXT.encode("utf-8"))
+        f.name = f"receipt_{i:05d}.txt"
+        files.append(f)
+    return files
+
+
+def run(file_count: int, workers: int, latency: float, min_confidence=None) -> float:
+    client = FakeModelClient(latency=latency, jitter=latency / 5)
+    files = make_text_files(file_count)
+    start = time.perf_counter()
+    results = ingestion.ingest_files(
+        files, client=client, max_workers=workers, use_cache=False, min_confidence=min_confidence
+    )
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if not r.ok)
+    print(f"workers={workers:>3}  files={file_count}  elapsed={elapsed:7.2f}s  "
+          f"throughput={file_count / elapsed:8.1f} files/s  failed={failed}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline offline.")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated model latency in seconds.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--local-first", type=float, default=None, metavar="MIN_CONFIDENCE",
+                        help="Try rule-based extraction first, escalating below this confidence.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        db.init_db()
+        for workers in args.workers:
+            run(args.files, workers, args.latency, args.local_first)
+        db.close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/compare.py (Compare two benchmarks.run_all result files)
+# Run from the receiptparserapp directory:
+#   python -m benchmarks.compare bench_data/results/BASELINE.json bench_data/results/CANDIDATE.json --threshold 0.2
+# With --fail-on-regression it exits with status 1 when a median time regressed by more than the threshold.
+import argparse
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+# Changes smaller than this are timer noise whatever the ratio.
+MIN_DELTA_MS = 0.05
+
+Key = Tuple[str, str, Any]
+
+
+def load(path: str) -> Tuple[Dict[str, Any], Dict[Key, Dict[str, Any]]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data, {(r["group"], r["name"], r["size"]): r for r in data["results"]}
+
+
+def _label(data: Dict[str, Any]) -> str:
+    commit = (data.get("commit") or "unknown")[:10] + ("+dirty" if data.get("dirty") else "")
+    return f"{commit} @ {data.get('timestamp')}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare benchmark results across commits.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown that counts as a regression.")
+    parser.add_argument("--all", action="store_true", help="Also list benchmarks whose time didn't change significantly.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed.")
+    args = parser.parse_args()
+
+    old_data, old = load(args.baseline)
+    new_data, new = load(args.candidate)
+    print(f"baseline:  {_label(old_data)}\ncandidate: {_label(new_data)}")
+    if old_data.get("platform") != new_data.get("platform"): print("warning: results come from different machines")
+    print(f"\n{'group':<11} {'benchmark':<58} {'rows':>9} {'old p50 ms':>12} {'new p50 ms':>12} {'change':>8} {'peak KB':>15}")
+
+    regressions = 0
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[0], k[2] or 0, k[1])):
+        before, after = old[key], new[key]
+        if before.get("skipped") or before.get("error") or after.get("skipped") or after.get("error"): continue
+        change = after["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0.0
+        significant = abs(after["p50_ms"] - before["p50_ms"]) >= MIN_DELTA_MS and abs(change) > args.threshold
+        if not significant and not args.all: continue
+        mark = ""
+        if significant: mark = "  REGRESSION" if change > 0 else "  faster"
+        regressions += significant and change > 0
+        peak = ""
+        if before.get("peak_kb") is not None and after.get("peak_kb") is not None:
+            peak = f"{before['peak_kb']:.0f}->{after['peak_kb']:.0f}"
+        group, name, size = key
+        print(f"{group:<11} {name:<58} {size or '':>9} {before['p50_ms']:>12.3f} {after['p50_ms']:>12.3f} "
+              f"{change:>+8.0%} {peak:>15}{mark}")
+
+    for label, keys in (("only in baseline", old.keys() - new.keys()), ("only in candidate", new.keys() - old.keys())):
+        for group, name, size in sorted(keys, key=str):
+            print(f"{label}: {group} {name} {size or ''}")
+    print(f"\n{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# benchmarks/fake_client.py (Offline stand-in for the Gemini model)
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import data_extraction
+
+DEFAULT_RESPONSE = {"vendor": "Walmart", "transaction_date": "2024-05-01", "amount": 42.5, "currency": "USD"}
+
+
+@dataclass
+class FakeResponse:
+    text: str
+
+
+class FakeModelClient:
+    """
+    Mimics `genai.GenerativeModel.generate_content` without touching the network.
+    Each call sleeps for `latency` seconds (+/- `jitter`) and returns a JSON receipt,
+    either the fixed `response` dict or whatever `responder(contents)` produces.
+    Without a responder, batch requests get the fixed response once per receipt.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        response: Optional[Dict[str, Any]] = None,
+        responder: Optional[Callable[[Any], Dict[str, Any]]] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.response = response or DEFAULT_RESPONSE
+        self.responder = responder
+        self.model_name = "fake-model"
+        self.calls = 0
+
+    def generate_content(self, contents: Any, **kwargs) -> FakeResponse:
+        self.calls += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.responder:
+            payload = self.responder(contents)
+        elif isinstance(contents, list) and str(contents[0]).startswith(data_extraction.BATCH_PROMPT.split("{")[0]):
+            payload = [{**self.response, "index": index} for index in range((len(contents) - 1) // 2)]
+        else:
+            payload = self.response
+        return FakeResponse("```json\n" + json.dumps(payload) + "\n```")
+
+
+def fingerprint(contents: Any) -> str:
+    """Stable key for a model request: hashes prompt strings and image pixels."""
+    digest = hashlib.sha256()
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, Image.Image):
+            digest.update(f"{part.mode}{part.size}".encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RecordingModelClient:
+    """Wraps a real model client and records each response's text and latency by request fingerprint."""
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.model_name = getattr(client, "model_name", "recorded")
+        self.recordings: Dict[str, Dict[str, Any]] = {}
+
+    def generate_content(self, contents: Any, **kwargs) -> Any:
+        start = time.perf_counter()
+        response = self.client.generate_content(contents, **kwargs)
+        self.recordings[fingerprint(contents)] = {"text": response.text, "latency": time.perf_counter() - start}
+        return response
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "recordings": self.recordings}, f, indent=1)
+
+
+class RecordedModelClient:
+    """
+    Replays responses captured by RecordingModelClient. Requests that weren't recorded raise KeyError.
+    The recorded latency of the last call is kept in `last_latency`; set `latency_scale` > 0 to also sleep for it.
+
+    Batched requests (data_extraction.parse_receipts_batch) are answered from the single-receipt recordings:
+    each receipt's recorded JSON is tagged with its index and returned in one array. Their latency is modelled as
+    mean(single latency) * (overhead_share + (1 - overhead_share) * batch size), i.e. `overhead_share` of a
+    single call is fixed per-request cost. `drop_rate` randomly leaves receipts out of batch responses.
+    """
+
+    def __init__(
+        self,
+        recordings: Dict[str, Dict[str, Any]],
+        model_name: str = "recorded",
+        latency_scale: float = 0.0,
+        overhead_share: float = 0.7,
+        drop_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.recordings = recordings
+        self.model_name = model_name
+        self.latency_scale = latency_scale
+        self.overhead_share = overhead_share
+        self.drop_rate = drop_rate
+        self.last_latency = 0.0
+        self.calls = 0
+        self.batch_calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, latency_scale: float = 0.0, **kwargs) -> "RecordedModelClient":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["recordings"], data.get("model_name", "recorded"), latency_scale, **kwargs)
+
+    def _lookup(self, contents: Any) -> Dict[str, Any]:
+        recording = self.recordings.get(fingerprint(contents))
+        if recording is None:
+            raise KeyError("No recorded response for this request; record it against the real model first.")
+        return recording
+
+    def _answer_batch(self, items: List[Any]) -> Tuple[FakeResponse, float]:
+        answers, latencies = [], []
+        for index, item in enumerate(items):
+            if isinstance(item, Image.Image):
+                single = [data_extraction.VISION_PROMPT, item]
+            else:
+                single = data_extraction.TEXT_PROMPT.format(raw_text=item[len("---\n"):-len("\n---")])
+            recording = self._lookup(single)
+            latencies.append(recording["latency"])
+            with self._lock:
+                dropped = self._rng.random() < self.drop_rate
+            try:
+                answer = json.loads(recording["text"].strip().removeprefix("```json").removesuffix("```"))
+            except ValueError:
+                continue
+            if not dropped and isinstance(answer, dict):
+                answers.append({**answer, "index": index})
+        latency = sum(latencies) / len(latencies) * (self.overhead_share + (1 - self.overhead_share) * len(items))
+        return FakeResponse(json.dumps(answers)), latency
+
+    def generate_content(self, contents: Any, **kwargs) -> FakeResponse:
+        with self._lock:
+            self.calls += 1
+        batch_size = (len(contents) - 1) // 2 if isinstance(contents, list) else 0
+        if batch_size and contents[0] == data_extraction.BATCH_PROMPT.format(count=batch_size):
+            with self._lock:
+                self.batch_calls += 1
+            response, latency = self._answer_batch(contents[2::2])
+        else:
+            recording = self._lookup(contents)
+            response, latency = FakeResponse(recording["text"]), recording["latency"]
+        self.last_latency = latency
+        if self.latency_scale > 0:
+            time.sleep(latency * self.latency_scale)
+        return response
@@ -0,0 +1,375 @@
+# benchmarks/run_all.py (Benchmark suite for the whole pipeline, saved as JSON for comparison across commits)
+# Run from the receiptparserapp directory:
+#   python -m benchmarks.run_all                                   # all groups at 1k/100k/1M rows
+#   python -m benchmarks.run_all --sizes 1000 100000 --groups database algorithms
+#   python -m benchmarks.compare bench_data/results/OLD.json bench_data/results/NEW.json
+# Synthetic databases are built once per size and reused from bench_data/suite/; the database group runs on a
+# scratch copy, so its inserts, updates and re-categorization never change them. Steps needing Tesseract or
+# poppler are recorded as skipped when those aren't installed. Peak memory comes from tracemalloc, so it
+# covers Python allocations only (not SQLite's page cache or OpenCV buffers).
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+import algorithms
+import analytics
+import categories
+import currencies
+import data_extraction
+import database as db
+import ingestion
+import ocr_utils
+from benchmarks import synthetic
+from benchmarks.fake_client import FakeModelClient
+from models import Receipt
+
+DATA_DIR = "bench_data/suite"
+RESULTS_DIR = "bench_data/results"
+# Copy of a suite database that the (writing) database benchmarks run on, replaced for every size.
+SCRATCH_DB = os.path.join(DATA_DIR, "scratch.db")
+# Empty database the OCR and extraction groups categorize against (built-in rules only).
+EMPTY_DB = os.path.join(DATA_DIR, "empty.db")
+GROUPS = ("ocr", "extraction", "database", "algorithms")
+DEFAULT_SIZES = (1000, 100_000, 1_000_000)
+FILTERS = {"vendor_keyword": "walmart", "date_range": (date(2022, 3, 1), date(2023, 9, 30)), "amount_range": (5, 500)}
+DATE_FILTERS = {"date_range": FILTERS["date_range"], "amount_range": FILTERS["amount_range"]}
+
+
+@dataclass
+class Bench:
+    """One measured operation. `setup()` (untimed) returns the arguments for `fn`; `teardown(args)` undoes side effects."""
+    group: str
+    name: str
+    fn: Callable[..., Any]
+    size: Optional[int] = None
+    items: int = 1  # units of work per call, for throughput
+    setup: Optional[Callable[[], tuple]] = None
+    teardown: Optional[Callable[..., None]] = None
+    requires: Optional[str] = None  # external binary that must be on PATH
+
+
+@dataclass
+class Result:
+    group: str
+    name: str
+    size: Optional[int]
+    runs: int = 0
+    mean_ms: float = 0.0
+    min_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    max_ms: float = 0.0
+    items_per_s: float = 0.0
+    peak_kb: Optional[float] = None
+    skipped: Optional[str] = None
+    error: Optional[str] = None
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def _call(bench: Bench) -> float:
+    args = bench.setup() if bench.setup else ()
+    start = time.perf_counter()
+    bench.fn(*args)
+    elapsed = time.perf_counter() - start
+    if bench.teardown: bench.teardown(*args)
+    return elapsed
+
+
+def measure(bench: Bench, min_time: float, max_runs: int, memory: bool) -> Result:
+    """Repeats `bench` until `min_time` seconds of timed work or `max_runs` runs, after one warm-up for fast operations."""
+    result = Result(bench.group, bench.name, bench.size)
+    if bench.requires and not shutil.which(bench.requires):
+        result.skipped = f"{bench.requires} is not installed"
+        return result
+    try:
+        times = [_call(bench)]
+        if times[0] < min_time / 10: times = []  # warm-up only
+        while not times or (sum(times) < min_time and len(times) < max_runs):
+            times.append(_call(bench))
+        if memory:
+            args = bench.setup() if bench.setup else ()
+            tracemalloc.start()
+            try:
+                bench.fn(*args)
+                result.peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            finally:
+                tracemalloc.stop()
+            if bench.teardown: bench.teardown(*args)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+
+    ordered = sorted(times)
+    result.runs = len(times)
+    result.mean_ms = statistics.fmean(times) * 1000
+    result.min_ms, result.max_ms = ordered[0] * 1000, ordered[-1] * 1000
+    result.p50_ms, result.p95_ms = _percentile(ordered, 50) * 1000, _percentile(ordered, 95) * 1000
+    result.items_per_s = bench.items / statistics.fmean(times)
+    return result
+
+
+# --- Datasets ---
+def _named(name: str, data: bytes) -> io.BytesIO:
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+
+def write_rates(path: str, seed: int = 0):
+    """Monthly synthetic EUR/GBP/INR rates over the synthetic date range, so most amounts get converted."""
+    rng = random.Random(seed)
+    base = {"EUR": 0.92, "GBP": 0.79, "INR": 83.0}
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "currency", "rate"])
+        for month in range(36):
+            day = date(2022 + month // 12, month % 12 + 1, 1).isoformat()
+            writer.writerows((day, code, round(rate * rng.uniform(0.95, 1.05), 4)) for code, rate in base.items())
+
+
+def _remove_database(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+
+
+def use_database(rows: int, scratch: bool = False) -> str:
+    """
+    Points `database` at the cached synthetic database with `rows` receipts, building it first if needed.
+    With `scratch`, at a fresh copy of it instead, for benchmarks that write.
+    """
+    path = os.path.join(DATA_DIR, f"receipts_{rows}_v{db.SCHEMA_VERSION}.db")
+    if not os.path.exists(path):
+        print(f"Building a {rows:,}-row database at {path} (reused by later runs)...", flush=True)
+        synthetic.build_database(path + ".tmp", rows)
+        db.close_all_connections()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + ".tmp" + suffix): os.remove(path + ".tmp" + suffix)
+        os.replace(path + ".tmp", path)
+    db.DB_NAME = path
+    db.init_db()
+    if scratch:
+        db.close_all_connections()  # checkpoints the WAL, so the file alone is a complete copy
+        _remove_database(SCRATCH_DB)
+        shutil.copyfile(path, SCRATCH_DB)
+        db.DB_NAME = SCRATCH_DB
+    return db.DB_NAME
+
+
+# --- Benchmark Groups ---
+def ocr_benches(rng: random.Random) -> List[Bench]:
+    receipt = synthetic.random_receipt(rng)
+    text = synthetic.render_receipt_text(receipt).encode("utf-8")
+    photo = synthetic.render_receipt_image(receipt)
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    photo.save(png, format="PNG")
+    photo.save(jpeg, format="JPEG", quality=90)
+    pdf = synthetic.render_receipt_pdf(receipt)
+
+    def process(name: str, data: bytes):
+        content = ocr_utils.process_file(_named(name, data))
+        if hasattr(content, "load"): content.load()  # decode the pixels, as ingestion will
+
+    return [
+        Bench("ocr", "process_file[txt]", process, setup=lambda: ("receipt.txt", text)),
+        Bench("ocr", "process_file[png 3000x4000]", process, setup=lambda: ("receipt.png", png.getvalue())),
+        Bench("ocr", "process_file[jpg 3000x4000]", process, setup=lambda: ("receipt.jpg", jpeg.getvalue())),
+        Bench("ocr", "process_file[pdf]", process, setup=lambda: ("receipt.pdf", pdf), requires="pdftoppm"),
+        Bench("ocr", "crop_to_receipt", ocr_utils.crop_to_receipt, setup=lambda: (photo,)),
+        Bench("ocr", "prepare_image_for_model[jpg]", ocr_utils.prepare_image_for_model,
+              setup=lambda: (Image.open(io.BytesIO(jpeg.getvalue())), len(jpeg.getvalue()))),
+        Bench("ocr", "preprocess_for_ocr", ocr_utils.preprocess_for_ocr, setup=lambda: (photo,)),
+        Bench("ocr", "ocr_image", ocr_utils.ocr_image, setup=lambda: (photo,), requires="tesseract"),
+    ]
+
+
+def extraction_benches(rng: random.Random, latency: float, files: int) -> List[Bench]:
+    receipts = [synthetic.random_receipt(rng) for _ in range(max(files, 8))]
+    texts = [synthetic.render_receipt_text(r) for r in receipts]
+    image = synthetic.render_receipt_image(receipts[0], photo_size=(800, 1000), font_size=16)
+    instant = FakeModelClient(latency=0)
+    response = '```json\n{"vendor": "Walmart", "transaction_date": "2024-05-01", "amount": 42.5, "currency": "USD"}\n```'
+
+    def ingest(batch_size: int):
+        ingestion.ingest_files(
+            [_named(f"r{i}.txt", t.encode("utf-8")) for i, t in enumerate(texts[:files])],
+            client=FakeModelClient(latency=latency), max_workers=8, save=False, use_cache=False,
+            min_confidence=None, batch_size=batch_size
+        )
+
+    return [
+        Bench("extraction", "parse_receipt_with_rules", data_extraction.parse_receipt_with_rules, setup=lambda: (texts[1],)),
+        Bench("extraction", "extract_json", data_extraction.extract_json, setup=lambda: (response,)),
+        Bench("extraction", "parse_receipt_with_text[fake]", data_extraction.parse_receipt_with_text, setup=lambda: (texts[2], instant)),
+        Bench("extraction", "parse_receipt_with_vision[fake]", data_extraction.parse_receipt_with_vision, setup=lambda: (image, instant)),
+        Bench("extraction", "parse_receipts_batch[8, fake]", data_extraction.parse_receipts_batch,
+              setup=lambda: (texts[:8], instant), items=8),
+        Bench("extraction", f"ingest_files[{files} txt, {latency * 1000:.0f}ms model, 8 workers]", ingest,
+              setup=lambda: (1,), items=files),
+        Bench("extraction", f"ingest_files[{files} txt, {latency * 1000:.0f}ms model, 8 workers, batch 4]", ingest,
+              setup=lambda: (4,), items=files),
+    ]
+
+
+def database_benches(rows: int, rng: random.Random) -> List[Bench]:
+    use_database(rows, scratch=True)
+    ids = db.get_receipt_columns(columns=("id",))["id"]
+    new_receipts = [
+        Receipt(vendor="Bench Vendor", transaction_date=date(2023, 1, 1), amount=9.99, currency="EUR",
+                category="Other", raw_text="bench")
+        for _ in range(1000)
+    ]
+    bench_ids = lambda: db.get_receipt_columns({"vendor_keyword": "bench vendor"}, ("id",))["id"]
+    delete_new = lambda *_: db.delete_receipts_by_ids(bench_ids())
+
+    def inserted():
+        db.insert_receipts_bulk(new_receipts)
+        return (bench_ids(),)
+
+    updates = lambda: ([(receipt_id, {"amount": round(rng.uniform(1, 100), 2)}) for receipt_id in rng.sample(ids, 100)],)
+    middle = sorted(ids)[len(ids) // 2]
+    export_path = os.path.join(DATA_DIR, "export.tmp")
+    b = lambda name, fn, **kw: Bench("database", name, fn, size=rows, **kw)
+    return [
+        b("insert_receipts_bulk[1000]", db.insert_receipts_bulk, setup=lambda: (new_receipts,), teardown=delete_new, items=1000),
+        b("update_receipts_bulk[100]", db.update_receipts_bulk, setup=updates, items=100),
+        b("delete_receipts_by_ids[1000]", db.delete_receipts_by_ids, setup=inserted, items=1000),
+        b("count_receipts", db.count_receipts),
+        b("count_receipts[filtered]", db.count_receipts, setup=lambda: (FILTERS,)),
+        b("get_totals", db.get_totals),
+        b("get_totals[filtered]", db.get_totals, setup=lambda: (FILTERS,)),
+        b("get_totals[date+amount]", db.get_totals, setup=lambda: (DATE_FILTERS,)),
+        b("get_receipts_page[first, by amount]", db.get_receipts_page, setup=lambda: (None, "amount", True, None, 50)),
+        b("get_receipts_page[middle, by id]", db.get_receipts_page, setup=lambda: (None, "id", True, (middle, middle), 50)),
+        b("query_receipts[filtered, 100]", db.query_receipts, setup=lambda: (FILTERS, 100)),
+        b("get_receipt_columns[filtered]", db.get_receipt_columns, setup=lambda: (FILTERS, ("amount_normalized", "category"))),
+        b("get_aggregates", db.get_aggregates),
+        b("get_aggregates[filtered]", db.get_aggregates, setup=lambda: (FILTERS,)),
+        b("get_monthly_spend", db.get_monthly_spend),
+        b("get_monthly_spend[date+amount]", db.get_monthly_spend, setup=lambda: (DATE_FILTERS,)),
+        b("get_vendor_spend", db.get_vendor_spend),
+        b("get_vendor_spend[filtered]", db.get_vendor_spend, setup=lambda: (FILTERS,)),
+        b("get_currency_spend", db.get_currency_spend),
+        b("get_category_spend[date+amount]", db.get_category_spend, setup=lambda: (DATE_FILTERS,)),
+        b("search_vendors", db.search_vendors, setup=lambda: ("walmrt",)),
+        b("export_receipts[csv]", db.export_receipts, setup=lambda: (export_path, "csv"), items=rows,
+          teardown=lambda *_: os.remove(export_path)),
+        b("get_all_receipts", db.get_all_receipts, items=rows),
+        b("recategorize_all", categories.recategorize_all, items=rows),
+        b("renormalize_all", db.renormalize_all, items=rows),
+        b("rebuild_summaries", db.rebuild_summaries, items=rows),
+    ]
+
+
+def algorithm_benches(rows: int) -> List[Bench]:
+    use_database(rows)
+    records = db.get_all_receipts()
+    columns = db.get_receipt_columns()
+    b = lambda name, fn, args: Bench("algorithms", name, fn, size=rows, setup=lambda: args, items=rows)
+    return [
+        b("filter_receipts[vendor]", algorithms.filter_receipts, (records, FILTERS["vendor_keyword"])),
+        b("filter_receipts[date+amount]", algorithms.filter_receipts, (records, "", *DATE_FILTERS.values())),
+        b("calculate_aggregates", algorithms.calculate_aggregates, (records,)),
+        b("get_monthly_spend", algorithms.get_monthly_spend, (records,)),
+        b("get_vendor_frequency", algorithms.get_vendor_frequency, (records,)),
+        b("analytics.compute_analytics", analytics.compute_analytics, (columns,)),
+    ]
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    commit = _git("rev-parse", "HEAD")
+    return {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")) if commit else None,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def report(result: Result):
+    if result.skipped or result.error:
+        print(f"{result.group:<11} {result.name:<58} {result.size or '':>9}  {result.skipped or result.error}", flush=True)
+        return
+    peak = f"{result.peak_kb:>10.0f} KB" if result.peak_kb is not None else ""
+    print(f"{result.group:<11} {result.name:<58} {result.size or '':>9} {result.p50_ms:>11.3f} ms "
+          f"{result.p95_ms:>11.3f} ms {result.items_per_s:>12.0f}/s {peak}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR, extraction, database and algorithms; save the results as JSON.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Database sizes in rows.")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model latency for the ingestion runs (s).")
+    parser.add_argument("--files", type=int, default=64, help="Files per ingestion run.")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds of timed work per benchmark.")
+    parser.add_argument("--max-runs", type=int, default=50)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the extra tracemalloc run per benchmark.")
+    parser.add_argument("--output", default=None, help=f"Results file (default: {RESULTS_DIR}/<time>-<commit>.json).")
+    args = parser.parse_args()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Set before anything categorizes a receipt: loading the rules would otherwise create receipts.db here.
+    db.DB_NAME = EMPTY_DB
+    db.init_db()
+    info = environment()
+    rng = random.Random(0)
+    # Conversions use synthetic rates, not whatever exchange_rates.csv is in the working directory.
+    currencies.RATES_FILE = os.path.join(DATA_DIR, "rates.csv")
+    write_rates(currencies.RATES_FILE)
+    currencies.reload()
+
+    benches: List[Callable[[], List[Bench]]] = []
+    if "ocr" in args.groups: benches.append(lambda: ocr_benches(rng))
+    if "extraction" in args.groups: benches.append(lambda: extraction_benches(rng, args.latency, args.files))
+    for rows in args.sizes:
+        if "database" in args.groups: benches.append(lambda rows=rows: database_benches(rows, rng))
+        if "algorithms" in args.groups: benches.append(lambda rows=rows: algorithm_benches(rows))
+
+    print(f"{'group':<11} {'benchmark':<58} {'rows':>9} {'p50':>14} {'p95':>14} {'throughput':>14} {'peak':>13}")
+    results = []
+    for make in benches:
+        for bench in make():
+            result = measure(bench, args.min_time, args.max_runs, not args.no_memory)
+            report(result)
+            results.append(result)
+        db.close_all_connections()
+    _remove_database(SCRATCH_DB)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{(info['commit'] or 'nogit')[:8]}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({**info, "args": vars(args), "results": [asdict(r) for r in results]}, f, indent=1)
+    print(f"Saved {len(results)} results to {output}")
+
+
+if __name__ == "__main__":
+    main()
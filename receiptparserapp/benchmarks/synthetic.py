@@ -0,0 +1,106 @@
+# benchmarks/synthetic.py (Synthetic receipts with known ground truth)
+import io
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+from PIL import Image, ImageDraw, ImageFont
+
+import categories
+import database as db
+from models import Receipt
+
+VENDORS = ["Walmart", "Target", "Starbucks", "Costco", "Whole Foods", "Shell", "CVS Pharmacy", "Home Depot"]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "GBP", "INR"]
+SYLLABLES = ["ka", "lo", "mi", "ren", "ta", "vo", "zu", "bel", "cor", "dan", "fi", "gra", "hol", "ix", "jun"]
+KINDS = ["Market", "Cafe", "Store", "Outlet", "Pharmacy", "Grill", "Bakery", "Hardware"]
+ITEMS = ["MILK", "BREAD", "EGGS", "COFFEE", "BANANAS", "SOAP", "BATTERIES", "PAPER TOWELS", "CHEESE", "WATER"]
+
+
+def random_receipt(rng: random.Random) -> Dict[str, Any]:
+    """Ground-truth fields plus line items for one synthetic receipt."""
+    items = [(rng.choice(ITEMS), round(rng.uniform(0.5, 40), 2)) for _ in range(rng.randint(2, 12))]
+    return {
+        "vendor": rng.choice(VENDORS),
+        "transaction_date": (date(2023, 1, 1) + timedelta(days=rng.randint(0, 730))).isoformat(),
+        "amount": round(sum(price for _, price in items), 2),
+        "currency": "USD",
+        "store_number": rng.randint(100, 9999),
+        "items": items,
+    }
+
+
+def receipt_lines(receipt: Dict[str, Any]) -> List[str]:
+    d = date.fromisoformat(receipt["transaction_date"])
+    lines = [receipt["vendor"].upper(), f"Store #{receipt['store_number']}", d.strftime("%m/%d/%Y"), ""]
+    lines += [f"{name:<16}{price:>8.2f}" for name, price in receipt["items"]]
+    lines += ["", f"{'TOTAL':<16}{receipt['amount']:>8.2f}", f"{'CURRENCY':<16}{receipt['currency']:>8}"]
+    return lines
+
+
+def render_receipt_text(receipt: Dict[str, Any]) -> str:
+    return "\n".join(receipt_lines(receipt)) + "\n"
+
+
+def render_receipt_image(
+    receipt: Dict[str, Any],
+    photo_size: tuple = (3000, 4000),
+    font_size: int = 56,
+    rotation: float = 0.0
+) -> Image.Image:
+    """Draws the receipt on paper and places it on a darker 'table' background, like a phone photo."""
+    lines = receipt_lines(receipt)
+    font = ImageFont.load_default(size=font_size)
+    line_height = int(font_size * 1.4)
+    paper = Image.new("RGB", (font_size * 16, line_height * (len(lines) + 4)), (246, 244, 238))
+    draw = ImageDraw.Draw(paper)
+    for i, line in enumerate(lines):
+        draw.text((font_size, line_height * (i + 2)), line, fill=(20, 20, 20), font=font)
+    if rotation:
+        paper = paper.rotate(rotation, expand=True, fillcolor=(70, 60, 50))
+
+    photo = Image.new("RGB", photo_size, (70, 60, 50))
+    paper.thumbnail((int(photo_size[0] * 0.8), int(photo_size[1] * 0.9)))
+    photo.paste(paper, ((photo_size[0] - paper.width) // 2, (photo_size[1] - paper.height) // 2))
+    return photo
+
+
+def render_receipt_pdf(receipt: Dict[str, Any], **image_options) -> bytes:
+    """A one-page scanned-style PDF (the rendered image, no text layer), so reading it needs rasterizing."""
+    buffer = io.BytesIO()
+    render_receipt_image(receipt, **image_options).save(buffer, format="PDF", resolution=150)
+    return buffer.getvalue()
+
+
+def vendor_pool(count: int, rng: random.Random) -> List[str]:
+    """The well-known VENDORS plus made-up names, so larger databases have a realistic number of distinct vendors."""
+    names = set(VENDORS)
+    while len(names) < count:
+        stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+        names.add(f"{stem} {rng.choice(KINDS)}")
+    return sorted(names)
+
+
+def build_database(path: str, rows: int, seed: int = 0, chunk_size: int = 50_000):
+    """
+    Fills a new database at `path` with `rows` complete receipts (every field set) through the normal
+    write path, so derived columns, summaries and the vendor index are all populated.
+    """
+    rng = random.Random(seed)
+    vendors = vendor_pool(max(len(VENDORS), min(rows // 20, 5000)), rng)
+    db.DB_NAME = path
+    db.init_db()
+    start = date(2022, 1, 1)
+    for offset in range(0, rows, chunk_size):
+        names = [
+            f"{rng.choice(vendors)} #{rng.randint(1, 999)}" if rng.random() < 0.3 else rng.choice(vendors)
+            for _ in range(min(chunk_size, rows - offset))
+        ]
+        db.insert_receipts_bulk([
+            Receipt(
+                vendor=name, transaction_date=start + timedelta(days=rng.randint(0, 1094)),
+                amount=round(rng.lognormvariate(3, 1), 2) + 0.01, category=categories.categorize(name),
+                currency=rng.choice(CURRENCIES), raw_text="synthetic"
+            )
+            for name in names
+        ])
@@ -0,0 +1,106 @@
+# cache.py (Persistent Parse-Result Cache)
+import hashlib
+import json
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, Optional
+
+import database as db
+import data_extraction
+import metrics
+
+DEFAULT_MAX_ENTRIES = 10000
+EVICTION_SLACK = 0.1  # the table may grow this share past max_entries before it's trimmed back in one DELETE
+LAST_USED_RESOLUTION = 600  # seconds; hits on an entry used more recently than this don't write to the database
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def model_name_for(client: Any = None) -> str:
+    """Name of the model that will parse the receipt; part of the cache key."""
+    return getattr(client or data_extraction.model, "model_name", None) or "unknown"
+
+
+class ParseCache:
+    """
+    Maps (file hash, model name, prompt version) to the parsed receipt dict, stored in the
+    `parse_cache` table so results survive restarts. Once the table grows EVICTION_SLACK past
+    `max_entries`, the least recently used entries are evicted down to `max_entries`.
+
+    Lookups only refresh `last_used` when it is older than LAST_USED_RESOLUTION, and inserts are
+    counted in memory between exact counts, so neither takes the write lock or scans the table each time.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.high_water = max_entries + max(1, int(max_entries * EVICTION_SLACK))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._estimated_count: Optional[int] = None  # rows at the last count + this process's inserts since
+
+    @staticmethod
+    def _key(file_hash: str, model_name: str) -> str:
+        return f"{file_hash}:{model_name}:{data_extraction.PROMPT_VERSION}"
+
+    def get(self, file_hash: str, model_name: str) -> Optional[Dict[str, Any]]:
+        key = self._key(file_hash, model_name)
+        with db.get_db_connection() as conn:
+            row = conn.execute("SELECT parsed_json, last_used FROM parse_cache WHERE cache_key = ?", (key,)).fetchone()
+            now = time.time()
+            if row and now - row["last_used"] > LAST_USED_RESOLUTION:
+                conn.execute("UPDATE parse_cache SET last_used = ? WHERE cache_key = ?", (now, key))
+
+        with self._lock:
+            if row: self.hits += 1
+            else: self.misses += 1
+        # Also counted in the metrics snapshot, which workers publish for the app's sidebar.
+        metrics.increment("cache.hits" if row else "cache.misses")
+        if not row: return None
+
+        parsed = json.loads(row["parsed_json"])
+        if parsed.get("transaction_date"):
+            parsed["transaction_date"] = date.fromisoformat(parsed["transaction_date"])
+        return parsed
+
+    def put(self, file_hash: str, model_name: str, parsed: Dict[str, Any]):
+        payload = json.dumps(parsed, default=lambda v: v.isoformat() if isinstance(v, date) else str(v))
+        with db.get_db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO parse_cache (cache_key, parsed_json, last_used) VALUES (?, ?, ?)",
+                (self._key(file_hash, model_name), payload, time.time())
+            )
+            with self._lock:
+                if self._estimated_count is not None and self._estimated_count < self.high_water:
+                    self._estimated_count += 1
+                    return
+                # Other processes share the table, so the estimate is only trusted until it reaches the mark.
+                count = conn.execute("SELECT COUNT(*) FROM parse_cache").fetchone()[0]
+                if count > self.high_water:
+                    conn.execute(
+                        "DELETE FROM parse_cache WHERE cache_key IN "
+                        "(SELECT cache_key FROM parse_cache ORDER BY last_used LIMIT ?)", (count - self.max_entries,)
+                    )
+                    count = self.max_entries
+                self._estimated_count = count
+
+    def clear(self):
+        with db.get_db_connection() as conn:
+            conn.execute("DELETE FROM parse_cache")
+        with self._lock:
+            self.hits = self.misses = 0
+            self._estimated_count = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,150 @@
+# categories.py (Vendor Category Classification Engine)
+import csv
+import functools
+import sqlite3
+import threading
+from collections import deque
+from typing import IO, Dict, Iterable, List, Optional, Tuple
+
+import database as db
+import vendors
+
+DEFAULT_CATEGORY = "Other"
+MEMO_SIZE = 100_000
+# Rules from later sources win when several match: user overrides > rules file > built-ins.
+SOURCE_PRIORITY = {"builtin": 0, "file": 1, "user": 2}
+BUILTIN_RULES = {
+    "walmart": "Groceries", "wal mart": "Groceries", "costco": "Groceries", "whole foods": "Groceries",
+    "kroger": "Groceries", "aldi": "Groceries", "trader joes": "Groceries",
+    "target": "General Merchandise", "amazon": "General Merchandise",
+    "starbucks": "Food & Drink", "mcdonalds": "Food & Drink", "subway": "Food & Drink", "cafe": "Food & Drink",
+    "shell": "Fuel", "chevron": "Fuel", "exxon": "Fuel",
+    "cvs": "Health", "walgreens": "Health", "pharmacy": "Health",
+    "home depot": "Home Improvement", "lowes": "Home Improvement",
+}
+
+Rule = Tuple[str, str, str]  # (pattern, category, source)
+
+
+class CategoryEngine:
+    """
+    Matches every rule pattern against a vendor name in one pass with an Aho–Corasick automaton.
+    Patterns and names are normalized with vendors.normalize_vendor and only match whole words
+    ("co" does not match "costco"). Among matching rules the highest-priority source wins,
+    then the longest pattern. Results are memoized per normalized vendor.
+    """
+
+    def __init__(self, rules: Iterable[Rule], default: str = DEFAULT_CATEGORY):
+        self.default = default
+        self.rule_count = 0
+        # Trie as parallel lists: goto[state] = {char: state}, fail[state], out[state] = [(rank, category)].
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[Tuple[int, int], str]]] = [[]]
+        for pattern, category, source in rules:
+            normalized = vendors.normalize_vendor(pattern)
+            if normalized: self._add(f" {normalized} ", (SOURCE_PRIORITY[source], len(normalized)), category)
+        self._build_failure_links()
+        self.classify_normalized = functools.lru_cache(maxsize=MEMO_SIZE)(self._classify_normalized)
+
+    def _add(self, pattern: str, rank: Tuple[int, int], category: str):
+        state = 0
+        for ch in pattern:
+            if ch not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][ch] = len(self._goto) - 1
+            state = self._goto[state][ch]
+        self._out[state].append((rank, category))
+        self.rule_count += 1
+
+    def _build_failure_links(self):
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, child in self._goto[state].items():
+                pending.append(child)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _classify_normalized(self, normalized: Optional[str]) -> str:
+        if not normalized: return self.default
+        best = None
+        state = 0
+        for ch in f" {normalized} ":
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for match in self._out[state]:
+                if best is None or match[0] > best[0]: best = match
+        return best[1] if best else self.default
+
+    def classify(self, vendor: Optional[str]) -> str:
+        return self.classify_normalized(vendors.normalize_vendor(vendor))
+
+
+_engine: Optional[CategoryEngine] = None
+_engine_lock = threading.Lock()
+
+
+def load_rules() -> List[Rule]:
+    """Built-in rules plus the file and user rules stored in the `category_rules` table."""
+    builtin = [(pattern, category, "builtin") for pattern, category in BUILTIN_RULES.items()]
+    try:
+        return builtin + db.get_category_rules()
+    except sqlite3.OperationalError:
+        return builtin  # database not initialized yet
+
+
+def get_engine() -> CategoryEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None: _engine = CategoryEngine(load_rules())
+        return _engine
+
+
+def reload():
+    """Rebuilds the automaton after the stored rules change (drops the memo too)."""
+    global _engine
+    engine = CategoryEngine(load_rules())
+    with _engine_lock:
+        _engine = engine
+
+
+def categorize(vendor: Optional[str]) -> str:
+    return get_engine().classify(vendor)
+
+
+def import_rules_file(f: IO[str]) -> int:
+    """Replaces the file rules with an open CSV of `pattern,category` rows (a header row is optional)."""
+    rows = [row for row in csv.reader(f) if len(row) >= 2 and row[0].strip()]
+    if rows and [c.strip().lower() for c in rows[0][:2]] == ["pattern", "category"]: rows = rows[1:]
+    db.replace_category_rules("file", [(row[0].strip(), row[1].strip()) for row in rows])
+    reload()
+    return len(rows)
+
+
+def learn_overrides(corrections: Iterable[Tuple[Optional[str], Optional[str]]]) -> int:
+    """
+    Records (vendor, category) pairs corrected by the user as top-priority rules, so future receipts
+    from the same vendor get that category. Returns the number of rules stored.
+    """
+    rules = {}
+    for vendor, category in corrections:
+        normalized = vendors.normalize_vendor(vendor)
+        if normalized and category and category.strip(): rules[normalized] = category.strip()
+    if not rules: return 0
+    db.upsert_category_rules("user", list(rules.items()))
+    reload()
+    return len(rules)
+
+
+def recategorize_all() -> int:
+    """Re-applies the current rules to every stored receipt; returns how many receipts changed category."""
+    engine = get_engine()
+    assignments = {normalized: engine.classify_normalized(normalized) for normalized in db.get_normalized_vendors()}
+    return db.recategorize(assignments, engine.default)
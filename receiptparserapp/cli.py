@@ -0,0 +1,311 @@
+# cli.py (Headless Bulk Ingestion)
+# Usage, from the receiptparserapp directory:
+#   python cli.py ingest /path/to/receipts            # a directory, .zip, .tar, .tar.gz or .tgz
+#   python cli.py ingest receipts.zip --workers 16 --rpm 600 --db receipts.db
+#   python cli.py retry-dead-letters                   # reprocess files that failed earlier
+#   python cli.py import-category-rules rules.csv     # then: python cli.py recategorize
+#   python cli.py import-exchange-rates rates.csv      # date,currency,rate rows; re-converts stored amounts
+#   python cli.py rebuild-summaries
+#   python cli.py export receipts.parquet --vendor walmart --from 2024-01-01 --to 2024-12-31
+#   python cli.py metrics --output metrics.json         # per-stage timings recorded by ingestion runs
+import argparse
+import io
+import logging
+import os
+import socket
+import sys
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cache
+import categories
+import currencies
+import data_extraction
+import database as db
+import ingestion
+import metrics
+import ocr_utils
+
+SUPPORTED_EXTENSIONS = {"jpg", "jpeg", "png", "pdf", "txt"}
+DEFAULT_CHUNK_SIZE = 100
+EXPORT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+
+
+@dataclass
+class IngestStats:
+    files_seen: int = 0
+    skipped: int = 0
+    processed: int = 0
+    failed: int = 0
+    receipts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Processed files per second (resumed/skipped files excluded)."""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (f"seen={self.files_seen} skipped={self.skipped} processed={self.processed} "
+                f"failed={self.failed} receipts={self.receipts} "
+                f"elapsed={self.elapsed:.1f}s throughput={self.throughput:.2f} files/s")
+
+
+def _supported(name: str) -> bool:
+    return ocr_utils.file_extension(name) in SUPPORTED_EXTENSIONS and not os.path.basename(name).startswith(".")
+
+
+def iter_source_files(path: str) -> Iterator[Tuple[str, bytes]]:
+    """Yields (name, bytes) for every supported file in a directory tree, zip or tar archive, one at a time."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                full_path = os.path.join(root, file_name)
+                if _supported(file_name):
+                    with open(full_path, "rb") as f:
+                        yield os.path.relpath(full_path, path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _supported(info.filename):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and _supported(member.name):
+                    yield member.name, archive.extractfile(member).read()
+    elif _supported(path):
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+    else:
+        raise ValueError(f"'{path}' is not a directory, archive or supported receipt file.")
+
+
+def _named_file(name: str, data: bytes) -> io.BytesIO:
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+
+def _chunks(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+
+def _ingest_chunk(todo: List[Tuple[str, bytes, str]], stats: IngestStats, client: Any, ingest_options: Dict[str, Any]):
+    """Ingests (name, bytes, hash) triples and records the outcome of each file."""
+    results = ingestion.ingest_files([_named_file(name, data) for name, data, _ in todo], client=client, **ingest_options)
+    db.record_ingested_files([
+        (h, name, "done" if result.ok else "failed", len(result.receipts), result.error)
+        for (name, _, h), result in zip(todo, results)
+    ])
+    stats.processed += len(results)
+    stats.failed += sum(1 for r in results if not r.ok)
+    stats.receipts += sum(len(r.receipts) for r in results)
+
+
+def ingest_path(
+    path: str,
+    client: Any = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    resume: bool = True,
+    progress: Optional[Callable[[IngestStats], None]] = None,
+    **ingest_options: Any
+) -> IngestStats:
+    """
+    Streams every receipt under `path` through the ingestion pipeline, `chunk_size` files at a time.
+    Each chunk's receipts are written in one transaction and its file hashes recorded in `ingested_files`,
+    so with `resume` a restarted run skips files that already succeeded (failed files are retried).
+    Receipts are inserted with skip_duplicates, which keeps a crash between the two writes harmless.
+    Files that fail are also queued in the dead-letter table (see retry_dead_letters).
+    `ingest_options` are passed to ingestion.ingest_files (max_workers, max_per_minute, min_confidence, ...).
+    """
+    ingest_options.setdefault("skip_duplicates", True)
+    stats = IngestStats()
+    start = time.perf_counter()
+
+    for chunk in _chunks(iter_source_files(path), chunk_size):
+        stats.files_seen += len(chunk)
+        hashes = [cache.content_hash(data) for _, data in chunk]
+        done = db.get_ingested_hashes(hashes) if resume else set()
+        todo = [(name, data, h) for (name, data), h in zip(chunk, hashes) if h not in done]
+        stats.skipped += len(chunk) - len(todo)
+
+        if todo: _ingest_chunk(todo, stats, client, ingest_options)
+
+        stats.elapsed = time.perf_counter() - start
+        if progress: progress(stats)
+    return stats
+
+
+def retry_dead_letters(
+    client: Any = None,
+    limit: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Callable[[IngestStats], None]] = None,
+    **ingest_options: Any
+) -> IngestStats:
+    """Reprocesses up to `limit` queued failures, oldest first. Files that now succeed leave the queue."""
+    ingest_options.setdefault("skip_duplicates", True)
+    stats = IngestStats()
+    start = time.perf_counter()
+    letters = db.get_dead_letters(limit, include_payload=True)
+    for chunk in _chunks(iter(letters), chunk_size):
+        stats.files_seen += len(chunk)
+        _ingest_chunk([(row["name"], row["payload"], row["content_hash"]) for row in chunk], stats, client, ingest_options)
+        stats.elapsed = time.perf_counter() - start
+        if progress: progress(stats)
+    return stats
+
+
+def export_receipts(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    fmt = args.format or EXPORT_EXTENSIONS.get(os.path.splitext(args.output)[1].lower(), "csv")
+    if (args.date_from is None) != (args.date_to is None): parser.error("--from and --to must be given together.")
+    if args.output == "-" and fmt == "parquet": parser.error("Parquet can't be written to stdout.")
+    filters = dict(
+        vendor_keyword=args.vendor, date_range=(args.date_from, args.date_to),
+        amount_range=(args.min_amount, args.max_amount)
+    )
+    count = db.export_receipts(sys.stdout if args.output == "-" else args.output, fmt, filters)
+    print(f"Exported {count} receipts as {fmt}.", file=sys.stderr)
+    return 0
+
+
+def format_metrics(summary: Dict[str, Any]) -> str:
+    """Plain-text table of a metrics.summarize() result."""
+    lines = [f"{'timer':<28} {'count':>8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}"]
+    for name, s in summary["timers_ms"].items():
+        lines.append(f"{name:<28} {s['count']:>8} {s['mean']:>10.2f} {s['p50']:>10.2f} {s['p95']:>10.2f} {s['p99']:>10.2f} {s['max']:>10.2f}")
+    if summary["values"]:
+        lines.append(f"\n{'value':<28} {'count':>8} {'total':>12} {'p50':>10} {'p95':>10} {'p99':>10}")
+        for name, s in summary["values"].items():
+            lines.append(f"{name:<28} {s['count']:>8} {s['total']:>12.0f} {s['p50']:>10.0f} {s['p95']:>10.0f} {s['p99']:>10.0f}")
+    if summary["counters"]:
+        lines.append("")
+        lines += [f"{name:<28} {value:>8g}" for name, value in summary["counters"].items()]
+    return "\n".join(lines)
+
+
+def show_metrics(args: argparse.Namespace) -> int:
+    merged = metrics.merge(db.get_metrics_snapshots())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            metrics.export_json(f, merged)
+        print(f"Wrote metrics to {args.output}.")
+    elif merged["started_at"] is None:
+        print("No metrics recorded yet.")
+    else:
+        print(format_metrics(metrics.summarize(merged)))
+    if args.reset: db.clear_metrics()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Receipt Parser command-line tools.")
+    parser.add_argument("--db", default=db.DB_NAME, help="Path to the SQLite database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    processing = argparse.ArgumentParser(add_help=False)
+    processing.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"),
+                            help="Gemini API key (default: $GEMINI_API_KEY). Without one only local OCR is used.")
+    processing.add_argument("--model", default="gemini-1.5-flash")
+    processing.add_argument("--workers", type=int, default=ingestion.DEFAULT_MAX_WORKERS)
+    processing.add_argument("--rpm", type=float, default=None, help="Max model requests per minute.")
+    processing.add_argument("--batch-size", type=int, default=ingestion.DEFAULT_BATCH_SIZE,
+                            help="Receipts per model request (capped at --workers).")
+    processing.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    processing.add_argument("--min-confidence", type=float, default=ingestion.DEFAULT_MIN_CONFIDENCE)
+    processing.add_argument("--no-local-ocr", action="store_true", help="Send every receipt to the AI model.")
+    processing.add_argument("--split-pdf-pages", action="store_true")
+    processing.add_argument("--max-long-edge", type=int, default=ocr_utils.VISION_MAX_LONG_EDGE)
+    processing.add_argument("--log-metrics", action="store_true",
+                            help="Log every stage timing as a JSON line on stderr, and the summary at the end.")
+
+    ingest = commands.add_parser("ingest", parents=[processing], help="Bulk-ingest a directory or archive of receipts.")
+    ingest.add_argument("path")
+    ingest.add_argument("--no-resume", action="store_true", help="Reprocess files that were already ingested.")
+    retry = commands.add_parser("retry-dead-letters", parents=[processing], help="Reprocess files that failed before.")
+    retry.add_argument("--limit", type=int, default=None)
+    rules = commands.add_parser("import-category-rules", help="Replace the file category rules with a CSV.")
+    rules.add_argument("csv_file", help="CSV of pattern,category rows.")
+    commands.add_parser("recategorize", help="Apply the current category rules to every receipt.")
+    rates = commands.add_parser("import-exchange-rates", help="Replace the exchange-rate table and re-convert receipts.")
+    rates.add_argument("csv_file", help=f"CSV of date,currency,rate rows (units per 1 {currencies.RATES_BASE}).")
+    commands.add_parser("renormalize", help=f"Re-convert every amount to {currencies.REPORTING_CURRENCY} with the current rates.")
+    commands.add_parser("rebuild-summaries", help="Recompute the dashboard summary tables.")
+    export = commands.add_parser("export", help="Stream the (filtered) receipts to a CSV, JSON Lines or Parquet file.")
+    export.add_argument("output", help="Output file; '-' writes CSV or JSON Lines to stdout.")
+    export.add_argument("--format", choices=db.EXPORT_FORMATS, default=None,
+                        help="Default: inferred from the output file extension, else csv.")
+    export.add_argument("--vendor", default="", help="Vendor keyword, as in the app's filter.")
+    export.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+    export.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+    export.add_argument("--min-amount", type=float, default=None)
+    export.add_argument("--max-amount", type=float, default=None)
+    metrics_command = commands.add_parser("metrics", help="Show the stage timings recorded by workers and CLI runs.")
+    metrics_command.add_argument("--output", default=None, help="Write the summary as JSON instead of printing a table.")
+    metrics_command.add_argument("--reset", action="store_true", help="Clear the recorded metrics afterwards.")
+    args = parser.parse_args(argv)
+
+    db.DB_NAME = args.db
+    db.init_db()
+
+    if args.command == "rebuild-summaries":
+        db.rebuild_summaries()
+        print("Summary tables rebuilt.")
+        return 0
+    if args.command == "import-category-rules":
+        with open(args.csv_file, newline="", encoding="utf-8") as f:
+            print(f"Imported {categories.import_rules_file(f)} category rules.")
+        return 0
+    if args.command == "recategorize":
+        print(f"Updated the category of {categories.recategorize_all()} receipts.")
+        return 0
+    if args.command == "import-exchange-rates":
+        with open(args.csv_file, newline="", encoding="utf-8") as f:
+            print(f"Imported {currencies.import_rates_file(f)} exchange rates.")
+    if args.command in ("import-exchange-rates", "renormalize"):
+        print(f"Re-converted {db.renormalize_all()} receipts to {currencies.REPORTING_CURRENCY}.")
+        return 0
+    if args.command == "export":
+        return export_receipts(parser, args)
+    if args.command == "metrics":
+        return show_metrics(args)
+    if args.log_metrics:
+        logging.basicConfig(format="%(message)s")
+        metrics.logger.setLevel(logging.DEBUG)
+
+    if args.api_key:
+        data_extraction.configure_model(args.api_key, args.model)
+    elif args.no_local_ocr:
+        parser.error("--no-local-ocr requires an API key.")
+
+    options = dict(
+        chunk_size=args.chunk_size, progress=lambda s: print(s.summary(), flush=True),
+        max_workers=args.workers, max_per_minute=args.rpm,
+        min_confidence=None if args.no_local_ocr else args.min_confidence,
+        split_pdf_pages=args.split_pdf_pages, max_long_edge=args.max_long_edge,
+        batch_size=args.batch_size
+    )
+    if args.command == "retry-dead-letters":
+        stats = retry_dead_letters(limit=args.limit, **options)
+    else:
+        stats = ingest_path(args.path, resume=not args.no_resume, **options)
+    db.retire_metrics(f"cli:{socket.gethostname()}:{os.getpid()}", metrics.snapshot())
+    metrics.log_summary()
+    print(f"Done. {stats.summary()} dead_letters={db.count_dead_letters()}")
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# currencies.py (Currency Codes and Exchange-Rate Conversion)
+import bisect
+import csv
+import functools
+import os
+import re
+import threading
+from datetime import date
+from typing import IO, Dict, Iterable, List, Optional, Tuple, Union
+
+# Dashboard totals are converted into this currency. Run `python cli.py renormalize` after changing it.
+REPORTING_CURRENCY = "USD"
+# Local CSV of `date,currency,rate` rows: how many units of `currency` one unit of RATES_BASE bought that day.
+RATES_FILE = "exchange_rates.csv"
+RATES_BASE = "USD"
+MEMO_SIZE = 100_000
+
+ISO_CODE_RE = re.compile(r"[A-Z]{3}")
+# Symbols and names the model or OCR return instead of ISO 4217 codes (matched case-insensitively).
+ALIASES = {
+    "$": "USD", "us$": "USD", "usd$": "USD", "dollar": "USD", "dollars": "USD",
+    "€": "EUR", "euro": "EUR", "euros": "EUR",
+    "£": "GBP", "pound": "GBP", "pounds": "GBP",
+    "¥": "JPY", "yen": "JPY", "円": "JPY",
+    "₹": "INR", "rs": "INR", "rs.": "INR", "rupee": "INR", "rupees": "INR",
+    "c$": "CAD", "ca$": "CAD", "a$": "AUD", "au$": "AUD", "nz$": "NZD", "s$": "SGD", "hk$": "HKD",
+    "r$": "BRL", "元": "CNY", "rmb": "CNY", "₩": "KRW", "₽": "RUB", "₺": "TRY", "₫": "VND",
+    "฿": "THB", "₱": "PHP", "₦": "NGN", "₪": "ILS", "zł": "PLN", "kč": "CZK",
+}
+# Symbols used when displaying amounts; other currencies are shown with their code.
+DISPLAY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "INR": "₹"}
+
+
+def canonicalize(currency: Optional[str]) -> Optional[str]:
+    """ISO 4217 code for a code, symbol or name ("$" -> "USD", "eur" -> "EUR"). Unrecognized values are kept, uppercased."""
+    if currency is None: return None
+    text = " ".join(currency.split())
+    if not text: return None
+    alias = ALIASES.get(text.casefold())
+    if alias: return alias
+    return text.upper()
+
+
+def format_amount(amount: float, currency: str) -> str:
+    symbol = DISPLAY_SYMBOLS.get(currency)
+    return f"{symbol}{amount:,.2f}" if symbol else f"{amount:,.2f} {currency}"
+
+
+class RateTable:
+    """
+    Exchange rates by currency and day, all quoted against one base currency. A rate applies from its
+    date until the next one for that currency; days before the first rate use the first, undated
+    amounts use the latest. Conversion factors are memoized per (from, to, day).
+    """
+
+    def __init__(self, rates: Iterable[Tuple[str, str, float]], base: str = RATES_BASE):
+        self.base = base
+        series: Dict[str, List[Tuple[str, float]]] = {}
+        for day, currency, rate in rates:
+            series.setdefault(currency, []).append((day, rate))
+        # ISO date strings sort chronologically, so days are compared as text.
+        self._days = {currency: [day for day, _ in sorted(points)] for currency, points in series.items()}
+        self._rates = {currency: [rate for _, rate in sorted(points)] for currency, points in series.items()}
+        self.rate_count = sum(len(days) for days in self._days.values())
+        self.factor = functools.lru_cache(maxsize=MEMO_SIZE)(self._factor)
+
+    def rate(self, currency: str, day: Optional[str]) -> Optional[float]:
+        """Units of `currency` per unit of the base currency on `day` ('YYYY-MM-DD' or None)."""
+        if currency == self.base: return 1.0
+        days = self._days.get(currency)
+        if not days: return None
+        if day is None: return self._rates[currency][-1]
+        return self._rates[currency][max(bisect.bisect_right(days, day) - 1, 0)]
+
+    def _factor(self, source: str, target: str, day: Optional[str]) -> Optional[float]:
+        if source == target: return 1.0
+        source_rate, target_rate = self.rate(source, day), self.rate(target, day)
+        if not source_rate or target_rate is None: return None
+        return target_rate / source_rate
+
+    def convert(
+        self,
+        amount: Optional[float],
+        currency: Optional[str],
+        day: Union[date, str, None] = None,
+        target: Optional[str] = None
+    ) -> Optional[float]:
+        """`amount` in `target` (default REPORTING_CURRENCY), or None if the amount or a rate is missing."""
+        source = canonicalize(currency)
+        if amount is None or source is None: return None
+        factor = self.factor(source, target or REPORTING_CURRENCY, str(day)[:10] if day else None)
+        return amount * factor if factor is not None else None
+
+
+_table: Optional[RateTable] = None
+_table_lock = threading.Lock()
+
+
+def _read_rates(f: IO[str]) -> List[Tuple[str, str, float]]:
+    """Parses `date,currency,rate` rows (a header row is optional); rows that don't parse are skipped."""
+    rates = []
+    for row in csv.reader(f):
+        if len(row) < 3: continue
+        try:
+            day = date.fromisoformat(row[0].strip()).isoformat()
+            rate = float(row[2])
+        except ValueError:
+            continue
+        currency = canonicalize(row[1])
+        if currency and ISO_CODE_RE.fullmatch(currency) and rate > 0: rates.append((day, currency, rate))
+    return rates
+
+
+def load_rates(path: Optional[str] = None) -> List[Tuple[str, str, float]]:
+    path = path or RATES_FILE
+    if not os.path.exists(path): return []  # same-currency amounts still convert
+    with open(path, newline="", encoding="utf-8") as f:
+        return _read_rates(f)
+
+
+def get_rate_table() -> RateTable:
+    global _table
+    with _table_lock:
+        if _table is None: _table = RateTable(load_rates())
+        return _table
+
+
+def reload():
+    """Re-reads RATES_FILE (drops the memo too)."""
+    global _table
+    table = RateTable(load_rates())
+    with _table_lock:
+        _table = table
+
+
+def convert(amount: Optional[float], currency: Optional[str], day: Union[date, str, None] = None) -> Optional[float]:
+    return get_rate_table().convert(amount, currency, day)
+
+
+def import_rates_file(f: IO[str]) -> int:
+    """
+    Replaces RATES_FILE with the valid rows of an open `date,currency,rate` CSV and reloads it.
+    Stored receipts keep their old converted amounts until database.renormalize_all() runs.
+    """
+    rates = _read_rates(f)
+    with open(RATES_FILE, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["date", "currency", "rate"])
+        writer.writerows(rates)
+    reload()
+    return len(rates)
@@ -1,13 +1,23 @@
 # data_extraction.py (Dual AI Capability: Vision and Text)
 
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from PIL import Image
 import json
-from typing import Dict, Any, Optional
+import random
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
 from datetime import datetime
 
+import categories
+import currencies
+import metrics
+
 model = None
-VENDOR_CATEGORIES = {"walmart": "Groceries", "target": "General Merchandise", "starbucks": "Food & Drink"}
+# Bump whenever a prompt changes so cached parse results from the old prompt are not reused.
+PROMPT_VERSION = "2"
 
 # --- Prompt for Vision Model (Image Input) ---
 VISION_PROMPT = """
@@ -23,21 +33,166 @@ Here is the text:
 ---
 """
 
+# --- Prompt for Batched Requests (several images and/or texts per call) ---
+BATCH_PROMPT = """
+Below are {count} receipts. Each one starts with a line "RECEIPT <index>" followed by either its image or its raw text.
+For every receipt extract: "vendor", "transaction_date" (YYYY-MM-DD), "amount" (final total), and "currency" (3-letter code like USD, or symbol).
+Return ONLY a valid JSON array with one object per receipt, each also containing its "index". If a value is missing, it should be null.
+"""
+
+# --- Structured Output ---
+# Constrains the model to the JSON shape the prompts ask for, so responses parse without guesswork.
+RECEIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vendor": {"type": "string", "nullable": True},
+        "transaction_date": {"type": "string", "nullable": True},
+        "amount": {"type": "number", "nullable": True},
+        "currency": {"type": "string", "nullable": True},
+    },
+}
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {**RECEIPT_SCHEMA, "properties": {"index": {"type": "integer"}, **RECEIPT_SCHEMA["properties"]}, "required": ["index"]},
+}
+
+# --- Retries & Circuit Breaker ---
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0   # seconds; doubles on every retry
+BACKOFF_MAX = 30.0
+# Rate limits, overload and timeouts are worth retrying; bad requests and auth errors are not.
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded, google_exceptions.GatewayTimeout,
+    ConnectionError, TimeoutError,
+)
+
+
+class ModelCallError(RuntimeError):
+    """The model could not produce a usable answer for a receipt."""
+
+
+class CircuitOpenError(ModelCallError):
+    """Raised without calling the model while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing endpoint: after `failure_threshold` consecutive transient failures the circuit
+    opens and calls fail fast for `reset_timeout` seconds, then a single trial call decides whether it closes.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None: return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None: return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                raise CircuitOpenError("AI model is failing repeatedly; pausing requests.")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def reset(self):
+        self.record_success()
+
+
+circuit_breaker = CircuitBreaker()
+
+
 def configure_model(api_key: str, model_name: str):
     global model
     try:
         genai.configure(api_key=api_key)
         model = genai.GenerativeModel(model_name)
         model.generate_content("test", generation_config={"max_output_tokens": 10})
+        circuit_breaker.reset()
     except Exception as e:
         raise RuntimeError(f"Failed to configure Gemini model. Check API key/model. Error: {e}")
 
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so parallel workers don't retry in lockstep."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _record_usage(contents: Any, response: Any, text: str):
+    """Request/response sizes for the metrics panel. Images are counted when prepared (image.upload_bytes)."""
+    parts = contents if isinstance(contents, list) else [contents]
+    metrics.observe("model.request_text_bytes", sum(len(part.encode("utf-8")) for part in parts if isinstance(part, str)))
+    metrics.observe("model.response_bytes", len(text.encode("utf-8")))
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None: return
+    for field, name in (("prompt_token_count", "model.prompt_tokens"), ("candidates_token_count", "model.output_tokens")):
+        count = getattr(usage, field, None)
+        if count is not None: metrics.observe(name, count)
+
+def _generate(client: Any, contents: Any, schema: Dict[str, Any]) -> str:
+    """Calls the model through the circuit breaker, retrying transient errors. Returns the response text."""
+    generation_config = {"response_mime_type": "application/json", "response_schema": schema}
+    for attempt in range(MAX_RETRIES + 1):
+        circuit_breaker.before_call()
+        try:
+            with metrics.timed("model.call"):
+                response = client.generate_content(contents, generation_config=generation_config)
+                text = response.text
+        except RETRYABLE_ERRORS as e:
+            circuit_breaker.record_failure()
+            if attempt == MAX_RETRIES: raise ModelCallError(f"AI model unavailable after {attempt + 1} attempts: {e}") from e
+            metrics.increment("model.retries")
+            time.sleep(_backoff_delay(attempt))
+            continue
+        except Exception as e:
+            # The endpoint answered; the request itself is at fault, so don't count it against the circuit.
+            circuit_breaker.record_success()
+            raise ModelCallError(f"AI model request failed: {e}") from e
+        circuit_breaker.record_success()
+        _record_usage(contents, response, text)
+        return text
+
+def extract_json(text: str) -> Any:
+    """
+    Parses the first JSON object or array in a model response, tolerating code fences
+    and chatter around it. Raises ValueError when there is none.
+    """
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    if fenced: text = fenced.group(1)
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[\[{]", text):
+        try:
+            return decoder.raw_decode(text, match.start())[0]
+        except json.JSONDecodeError:
+            continue
+    raise ValueError(f"No JSON found in model response: {text[:200]!r}")
+
 def _process_parsed_json(parsed_json: dict, raw_text_placeholder: str) -> dict:
     """A helper function to process the JSON returned by the AI, avoiding code duplication."""
     date_val = parsed_json.get("transaction_date")
     amount_val = parsed_json.get("amount")
     vendor = parsed_json.get("vendor")
-    currency = parsed_json.get("currency", "USD")
+    currency = currencies.canonicalize(parsed_json.get("currency", "USD"))
 
     return {
         "vendor": vendor,
@@ -49,32 +204,153 @@ def _process_parsed_json(parsed_json: dict, raw_text_placeholder: str) -> dict:
     }
 
 def map_category(vendor: Optional[str]) -> Optional[str]:
-    if not vendor: return "Other"
-    for known_vendor, category in VENDOR_CATEGORIES.items():
-        if known_vendor in vendor.lower(): return category
-    return "Other"
-
-def parse_receipt_with_vision(image: Image.Image) -> Dict[str, Any]:
-    """Parses an image using the Gemini Vision model."""
-    if not model: raise RuntimeError("AI model not configured.")
+    """Category for a vendor name from the rule engine in categories.py ("Other" when no rule matches)."""
+    return categories.categorize(vendor)
+
+def _parse_single(client: Any, contents: Any, raw_text: Optional[str]) -> Dict[str, Any]:
+    client = client or model
+    if not client: raise RuntimeError("AI model not configured.")
+    text = _generate(client, contents, RECEIPT_SCHEMA)
     try:
-        response = model.generate_content([VISION_PROMPT, image])
-        json_str = response.text.strip().lstrip("```json").rstrip("```").strip()
-        parsed_json = json.loads(json_str)
-        return _process_parsed_json(parsed_json, f"Parsed from image of {parsed_json.get('vendor') or 'unknown'}")
-    except Exception as e:
-        print(f"Vision AI parsing failed: {e}")
-        return {"raw_text": "AI vision parsing failed."}
+        with metrics.timed("parse.json"):
+            parsed_json = extract_json(text)
+        if not isinstance(parsed_json, dict): raise ValueError("Expected a JSON object.")
+        return _process_parsed_json(parsed_json, raw_text or f"Parsed from image of {parsed_json.get('vendor') or 'unknown'}")
+    except (TypeError, ValueError) as e:
+        raise ModelCallError(f"Unusable AI response: {e}") from e
+
+def parse_receipt_with_vision(image: Image.Image, client: Any = None) -> Dict[str, Any]:
+    """
+    Parses an image using the Gemini Vision model.
+    `client` can be any object with a `generate_content` method; defaults to the configured model.
+    Raises ModelCallError when no usable result could be obtained.
+    """
+    return _parse_single(client, [VISION_PROMPT, image], None)
+
+def parse_receipt_with_text(text: str, client: Any = None) -> Dict[str, Any]:
+    """Parses a raw text string using the Gemini model (or the given `client`). Raises ModelCallError on failure."""
+    return _parse_single(client, TEXT_PROMPT.format(raw_text=text), text)
+
+def parse_receipts_batch(items: List[Union[Image.Image, str]], client: Any = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Parses several receipts (images and/or raw texts) with a single model request.
+    Results are matched back to `items` by index; receipts the model skipped or garbled come back as None
+    so the caller can retry them one at a time. Raises ModelCallError if the request itself fails.
+    """
+    client = client or model
+    if not client: raise RuntimeError("AI model not configured.")
+    contents = [BATCH_PROMPT.format(count=len(items))]
+    for index, item in enumerate(items):
+        contents += [f"RECEIPT {index}", item if isinstance(item, Image.Image) else f"---\n{item}\n---"]
 
-def parse_receipt_with_text(text: str) -> Dict[str, Any]:
-    """Parses a raw text string using the Gemini model."""
-    if not model: raise RuntimeError("AI model not configured.")
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    text = _generate(client, contents, BATCH_SCHEMA)
     try:
-        prompt = TEXT_PROMPT.format(raw_text=text)
-        response = model.generate_content(prompt)
-        json_str = response.text.strip().lstrip("```json").rstrip("```").strip()
-        parsed_json = json.loads(json_str)
-        return _process_parsed_json(parsed_json, text)
-    except Exception as e:
-        print(f"Text AI parsing failed: {e}")
-        return {"raw_text": "AI text parsing failed."}
\ No newline at end of file
+        with metrics.timed("parse.json"):
+            parsed_list = extract_json(text)
+    except ValueError:
+        metrics.increment("model.unusable_batches")
+        return results
+
+    for parsed_json in parsed_list if isinstance(parsed_list, list) else []:
+        try:
+            index = int(parsed_json["index"])
+            if not 0 <= index < len(items) or results[index] is not None: continue
+            item = items[index]
+            raw_text = item if isinstance(item, str) else f"Parsed from image of {parsed_json.get('vendor') or 'unknown'}"
+            results[index] = _process_parsed_json(parsed_json, raw_text)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return results
+
+# --- Rule-Based Extraction (Local Fast Path) ---
+AMOUNT_RE = re.compile(r"(\d{1,3}(?:[,.]\d{3})*[.,]\d{2}|\d+[.,]\d{2})(?!\d)")
+TOTAL_KEYWORDS = ("grand total", "amount due", "balance due", "total due", "total")
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "₹": "INR", "¥": "JPY"}
+CURRENCY_CODE_RE = re.compile(r"\b(USD|EUR|GBP|INR|JPY|CAD|AUD|CHF|CNY|SGD)\b")
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4}-\d{2}-\d{2})\b"), ("%Y-%m-%d",)),
+    (re.compile(r"\b(\d{1,2}/\d{1,2}/\d{4})\b"), ("%m/%d/%Y", "%d/%m/%Y")),
+    (re.compile(r"\b(\d{1,2}/\d{1,2}/\d{2})\b"), ("%m/%d/%y", "%d/%m/%y")),
+    (re.compile(r"\b(\d{1,2}[.-]\d{1,2}[.-]\d{4})\b"), ("%d.%m.%Y", "%d-%m-%Y")),
+    (re.compile(r"\b([A-Za-z]{3,9}\.? \d{1,2},? \d{4})\b"), ("%b %d %Y", "%B %d %Y", "%b. %d %Y")),
+    (re.compile(r"\b(\d{1,2} [A-Za-z]{3,9},? \d{4})\b"), ("%d %b %Y", "%d %B %Y")),
+]
+# Weights of each extracted field in the rule-based confidence score; they sum to 1.
+FIELD_WEIGHTS = {"vendor": 0.2, "transaction_date": 0.25, "amount": 0.4, "currency": 0.15}
+# Score ceiling when the total had to be guessed (no TOTAL line, e.g. it may be the cash tendered) or no
+# currency was found. Kept below the default threshold so such receipts go to the model instead.
+UNCERTAIN_MAX_CONFIDENCE = 0.5
+
+def _parse_amount(token: str) -> Optional[float]:
+    # "1,234.56" and "1.234,56" both become 1234.56
+    cleaned = re.sub(r"[.,](?=\d{3}(?:[.,]|$))", "", token).replace(",", ".")
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def _extract_date(text: str) -> Optional[datetime]:
+    for pattern, formats in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            candidate = match.group(1).replace(",", "")
+            for fmt in formats:
+                try:
+                    return datetime.strptime(candidate, fmt)
+                except ValueError:
+                    continue
+    return None
+
+def _extract_total(lines: list) -> Tuple[Optional[float], bool]:
+    """Returns (amount, found_on_total_line). Falls back to the largest amount on the receipt."""
+    for keyword in TOTAL_KEYWORDS:
+        for line in reversed(lines):
+            lowered = line.lower()
+            if keyword in lowered and "subtotal" not in lowered and "sub total" not in lowered:
+                amounts = [a for a in map(_parse_amount, AMOUNT_RE.findall(line)) if a]
+                if amounts: return amounts[-1], True
+    amounts = [a for line in lines for a in map(_parse_amount, AMOUNT_RE.findall(line)) if a]
+    return (max(amounts), False) if amounts else (None, False)
+
+def _extract_vendor(lines: list) -> Optional[str]:
+    for line in lines[:5]:
+        letters = sum(c.isalpha() for c in line)
+        if letters >= 3 and letters >= len(line.replace(" ", "")) / 2:
+            return line.strip().title()
+    return None
+
+def _extract_currency(text: str) -> Optional[str]:
+    match = CURRENCY_CODE_RE.search(text.upper())
+    if match: return match.group(1)
+    for symbol, code in CURRENCY_SYMBOLS.items():
+        if symbol in text: return code
+    return None
+
+def parse_receipt_with_rules(text: str, ocr_confidence: float = 100.0) -> Tuple[Dict[str, Any], float]:
+    """
+    Extracts vendor, date, total and currency from receipt text with regexes and heuristics.
+    Returns the parsed dict (same shape as the AI parsers) and a 0-1 confidence score that
+    weighs which fields were found and scales by the OCR engine's own confidence.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    vendor = _extract_vendor(lines)
+    date_obj = _extract_date(text)
+    amount, on_total_line = _extract_total(lines)
+    currency = _extract_currency(text)
+
+    score = 0.0
+    if vendor: score += FIELD_WEIGHTS["vendor"]
+    if date_obj: score += FIELD_WEIGHTS["transaction_date"]
+    if amount: score += FIELD_WEIGHTS["amount"] if on_total_line else FIELD_WEIGHTS["amount"] / 2
+    if currency: score += FIELD_WEIGHTS["currency"]
+    if not on_total_line or not currency: score = min(score, UNCERTAIN_MAX_CONFIDENCE)
+
+    parsed = {
+        "vendor": vendor,
+        "transaction_date": date_obj.date() if date_obj else None,
+        "amount": amount,
+        "raw_text": text,
+        "category": map_category(vendor),
+        "currency": currency
+    }
+    return parsed, score * max(0.0, min(ocr_confidence, 100.0)) / 100
@@ -1,73 +1,1139 @@
 # database.py (Final Cleaned Version)
+import csv
+import json
+import queue
 import sqlite3
-from typing import List, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, List, Dict, Any, Iterator, Tuple, Optional, Union
 from models import Receipt
+import currencies
+import metrics
+import vendors
 
 DB_NAME = "receipts.db"
+POOL_SIZE = 8
+# Seconds a connection waits for another process's write lock before raising "database is locked"
+# (sqlite3 applies it as the busy timeout, so it isn't repeated in PRAGMAS).
+BUSY_TIMEOUT = 30
+# WAL lets readers run alongside a writer; synchronous=NORMAL is durable under WAL
+# except for the last transactions before a power loss, and avoids an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",
+)
+UPDATABLE_COLUMNS = {"vendor", "transaction_date", "amount", "category", "raw_text", "currency"}
+SORTABLE_COLUMNS = {"id", "vendor", "transaction_date", "amount", "category", "currency"}
+# Computed from other columns on every write; never set directly by callers.
+DERIVED_COLUMNS = {"vendor_normalized", "amount_normalized"}
+# Changing any of these re-converts amount_normalized into the reporting currency.
+CONVERSION_INPUTS = {"amount", "currency", "transaction_date"}
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+class ConnectionPool:
+    """Thread-safe pool of open connections to one database file, created lazily up to `size`."""
 
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction: conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def _get_pool() -> ConnectionPool:
+    # Keyed by DB_NAME so benchmarks and tools can point the module at another file.
+    with _pools_lock:
+        if DB_NAME not in _pools:
+            _pools[DB_NAME] = ConnectionPool(DB_NAME)
+        return _pools[DB_NAME]
+
+@contextmanager
+def get_db_connection() -> Iterator[sqlite3.Connection]:
+    """Borrows a pooled connection for one transaction: commits on success, rolls back on error."""
+    pool = _get_pool()
+    with metrics.timed("db.acquire"):
+        conn = pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+def close_all_connections():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def _ensure_column(cursor, table: str, column: str, declaration: str):
+    """Adds a column to an existing table if an older database doesn't have it yet."""
+    columns = {row["name"] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+@metrics.timed("db.init_db")
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, vendor TEXT, transaction_date DATE,
+                amount REAL, category TEXT, raw_text TEXT NOT NULL,
+                currency TEXT DEFAULT 'USD', content_hash TEXT, vendor_normalized TEXT,
+                amount_normalized REAL
+            );
+        """)
+        _ensure_column(cursor, "receipts", "content_hash", "TEXT")
+        _ensure_column(cursor, "receipts", "vendor_normalized", "TEXT")
+        _ensure_column(cursor, "receipts", "amount_normalized", "REAL")
+        _backfill_vendor_normalized(cursor)
+        # Composite indexes cover the filter + aggregate queries below without touching the table rows.
+        cursor.execute("DROP INDEX IF EXISTS idx_vendor;")
+        cursor.execute("DROP INDEX IF EXISTS idx_date;")
+        cursor.execute("DROP INDEX IF EXISTS idx_vendor_amount;")
+        cursor.execute("DROP INDEX IF EXISTS idx_date_amount;")
+        cursor.execute("DROP INDEX IF EXISTS idx_vendor_normalized_amount;")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_date_amounts ON receipts (transaction_date, amount, amount_normalized);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vendor_amounts ON receipts (vendor_normalized, amount, amount_normalized);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_currency_amount ON receipts (currency, amount);")
+        # Amount-range filters search this index; it carries every column the aggregates read, since a lookup
+        # into the table per matching row is slower than scanning the table outright.
+        cursor.execute("DROP INDEX IF EXISTS idx_amount;")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_amount_covering ON receipts "
+            "(amount, amount_normalized, transaction_date, vendor_normalized, currency, category);"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_hash ON receipts (content_hash);")
+        # Keyset pagination in the grid reads ORDER BY <column>, id straight from these (id and amount use the above).
+        for column in ("transaction_date", "vendor", "category", "currency"):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_sort_{column} ON receipts ({column}, id);")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS parse_cache (
+                cache_key TEXT PRIMARY KEY, parsed_json TEXT NOT NULL, last_used REAL NOT NULL
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON parse_cache (last_used);")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingested_files (
+                content_hash TEXT PRIMARY KEY, source TEXT, status TEXT NOT NULL,
+                receipt_count INTEGER NOT NULL DEFAULT 0, error TEXT, ingested_at REAL NOT NULL
+            );
+        """)
+        # Files that failed ingestion, kept with their bytes so they can be reprocessed later.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                content_hash TEXT PRIMARY KEY, name TEXT, stage TEXT, error TEXT, payload BLOB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL, updated_at REAL NOT NULL
+            );
+        """)
+        # Background ingestion: files queued for worker.py, and the worker processes currently alive.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT NOT NULL, name TEXT NOT NULL, payload BLOB,
+                options TEXT NOT NULL DEFAULT '{}', status TEXT NOT NULL DEFAULT 'queued', worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0, receipt_count INTEGER NOT NULL DEFAULT 0, stage TEXT, error TEXT,
+                created_at REAL NOT NULL, started_at REAL, finished_at REAL
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, status);")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY, pid INTEGER, started_at REAL NOT NULL, last_seen REAL NOT NULL,
+                jobs_done INTEGER NOT NULL DEFAULT 0, circuit TEXT NOT NULL DEFAULT 'closed'
+            );
+        """)
+        _ensure_column(cursor, "workers", "circuit", "TEXT NOT NULL DEFAULT 'closed'")
+        # Latest metrics snapshot of each process that ran ingestion (see metrics.py), merged for display.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS metrics (
+                source TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL
+            );
+        """)
+        # One row per normalized vendor name, with a trigram full-text index for substring and fuzzy search.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vendors (
+                id INTEGER PRIMARY KEY, normalized TEXT NOT NULL UNIQUE, name TEXT,
+                receipt_count INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS vendor_fts
+            USING fts5(normalized, content='vendors', content_rowid='id', tokenize='trigram');
+        """)
+        # Category rules loaded from a file or learned from user edits (built-ins live in categories.py).
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS category_rules (
+                pattern TEXT NOT NULL, source TEXT NOT NULL, category TEXT NOT NULL,
+                updated_at REAL NOT NULL, PRIMARY KEY (pattern, source)
+            ) WITHOUT ROWID;
+        """)
+        _init_summaries(cursor)
+
+def _backfill_vendor_normalized(cursor):
+    """Fills vendor_normalized for rows written before the column existed (or by other tools)."""
+    rows = cursor.execute(
+        "SELECT id, vendor FROM receipts WHERE vendor IS NOT NULL AND vendor_normalized IS NULL"
+    ).fetchall()
+    cursor.executemany(
+        "UPDATE receipts SET vendor_normalized = ? WHERE id = ?",
+        [(vendors.normalize_vendor(row["vendor"]), row["id"]) for row in rows]
+    )
+
+RENORMALIZE_CHUNK = 10000
+
+def _renormalize_rows(cursor, rows) -> int:
+    table = currencies.get_rate_table()
+    changes = []
+    for row in rows:
+        currency = currencies.canonicalize(row["currency"])
+        converted = table.convert(row["amount"], currency, row["transaction_date"])
+        if currency != row["currency"] or converted != row["amount_normalized"]:
+            changes.append((currency, converted, row["id"]))
+    cursor.executemany("UPDATE receipts SET currency = ?, amount_normalized = ? WHERE id = ?", changes)
+    return len(changes)
+
+def _renormalize(cursor, ids: Optional[List[int]] = None) -> int:
+    """
+    Canonicalizes the currency codes and recomputes amount_normalized with the current rates, for the
+    receipts in `ids` or all of them. Only rows that change are written; returns how many did.
+    """
+    select = "SELECT id, amount, currency, transaction_date, amount_normalized FROM receipts"
+    changed = 0
+    if ids is not None:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = cursor.execute(f"{select} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk).fetchall()
+            changed += _renormalize_rows(cursor, rows)
+        return changed
+    last_id = 0
+    while True:
+        rows = cursor.execute(f"{select} WHERE id > ? ORDER BY id LIMIT ?", (last_id, RENORMALIZE_CHUNK)).fetchall()
+        if not rows: return changed
+        changed += _renormalize_rows(cursor, rows)
+        last_id = rows[-1]["id"]
+
+@metrics.timed("db.renormalize_all")
+def renormalize_all() -> int:
+    """Re-converts every receipt after the exchange rates or the reporting currency change; returns the rows updated."""
+    with get_db_connection() as conn:
+        return _renormalize(conn.cursor())
+
+# --- Materialized Summaries ---
+# Spend per month/vendor/currency/category, kept current by triggers on `receipts` so the
+# unfiltered dashboard reads a handful of rows no matter how large the history is.
+# `total` sums amounts as written; `total_normalized` sums them converted to the reporting currency.
+# Maps each summary table to its key expression over a receipts row ({row} is NEW, OLD or receipts).
+# NULL keys are stored as '' because upserts can't conflict on NULL; undated receipts have no month.
+SUMMARY_TABLES = {
+    "summary_monthly": "substr({row}.transaction_date, 1, 7)",
+    "summary_vendor": "COALESCE({row}.vendor_normalized, '')",
+    "summary_currency": "COALESCE({row}.currency, '')",
+    "summary_category": "COALESCE({row}.category, '')",
+}
+# Bump whenever the summary tables or triggers change: init_db then recreates the triggers and rebuilds.
+SCHEMA_VERSION = 3
+
+def _summary_delta_sql(table: str, row: str, sign: str) -> str:
+    """Adds (sign '') or subtracts (sign '-') one receipts row to/from a summary table."""
+    key = SUMMARY_TABLES[table].format(row=row)
+    return f"""
+        INSERT INTO {table} (key, total, total_normalized, receipt_count, amount_count, normalized_count)
+        SELECT {key}, {sign}COALESCE({row}.amount, 0), {sign}COALESCE({row}.amount_normalized, 0),
+               {sign}1, {sign}({row}.amount IS NOT NULL), {sign}({row}.amount_normalized IS NOT NULL)
+        WHERE {key} IS NOT NULL
+        ON CONFLICT(key) DO UPDATE SET
+            total = total + excluded.total,
+            total_normalized = total_normalized + excluded.total_normalized,
+            receipt_count = receipt_count + excluded.receipt_count,
+            amount_count = amount_count + excluded.amount_count,
+            normalized_count = normalized_count + excluded.normalized_count;
+    """
+
+def _summary_cleanup_sql(table: str) -> str:
+    return f"DELETE FROM {table} WHERE key = {SUMMARY_TABLES[table].format(row='OLD')} AND receipt_count <= 0;"
+
+def _vendor_delta_sql(row: str, sign: str) -> str:
+    """Counts a receipts row in (sign '+') or out of (sign '-') the vendors table, adding/removing vendors as needed."""
+    if sign == "+":
+        return f"""
+            INSERT OR IGNORE INTO vendors (normalized, name) SELECT {row}.vendor_normalized, {row}.vendor
+            WHERE {row}.vendor_normalized IS NOT NULL;
+            UPDATE vendors SET receipt_count = receipt_count + 1 WHERE normalized = {row}.vendor_normalized;
+        """
+    return f"""
+        UPDATE vendors SET receipt_count = receipt_count - 1 WHERE normalized = {row}.vendor_normalized;
+        DELETE FROM vendors WHERE normalized = {row}.vendor_normalized AND receipt_count <= 0;
+    """
+
+def _summary_triggers() -> Dict[str, str]:
+    """Name and body of every trigger that keeps the summary tables, `vendors` and `vendor_fts` in step with `receipts`."""
+    add_new = "".join(_summary_delta_sql(t, "NEW", "") for t in SUMMARY_TABLES)
+    remove_old = "".join(_summary_delta_sql(t, "OLD", "-") + _summary_cleanup_sql(t) for t in SUMMARY_TABLES)
+    add_vendor, remove_vendor = _vendor_delta_sql("NEW", "+"), _vendor_delta_sql("OLD", "-")
+    return {
+        "trg_receipts_summary_insert": f"AFTER INSERT ON receipts BEGIN {add_new} {add_vendor} END",
+        "trg_receipts_summary_delete": f"AFTER DELETE ON receipts BEGIN {remove_old} {remove_vendor} END",
+        "trg_receipts_summary_update": (
+            "AFTER UPDATE OF vendor_normalized, transaction_date, amount, amount_normalized, category, currency ON receipts "
+            f"BEGIN {remove_old} {add_new} END"
+        ),
+        "trg_receipts_vendor_update": (
+            "AFTER UPDATE OF vendor_normalized ON receipts "
+            f"WHEN OLD.vendor_normalized IS NOT NEW.vendor_normalized BEGIN {add_vendor} {remove_vendor} END"
+        ),
+        # Keep the external-content FTS index in step with `vendors` (normalized names never change in place).
+        "trg_vendors_fts_insert": (
+            "AFTER INSERT ON vendors BEGIN "
+            "INSERT INTO vendor_fts (rowid, normalized) VALUES (NEW.id, NEW.normalized); END"
+        ),
+        "trg_vendors_fts_delete": (
+            "AFTER DELETE ON vendors BEGIN "
+            "INSERT INTO vendor_fts (vendor_fts, rowid, normalized) VALUES ('delete', OLD.id, OLD.normalized); END"
+        ),
+    }
+
+def _init_summaries(cursor):
+    if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION: return
+    for table in SUMMARY_TABLES:
+        # Rebuilt below from `receipts`, so an older layout is simply replaced.
+        cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        cursor.execute(f"""
+            CREATE TABLE {table} (
+                key TEXT PRIMARY KEY, total REAL NOT NULL DEFAULT 0, total_normalized REAL NOT NULL DEFAULT 0,
+                receipt_count INTEGER NOT NULL DEFAULT 0, amount_count INTEGER NOT NULL DEFAULT 0,
+                normalized_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+        """)
+
+    triggers = _summary_triggers()
+    for name in triggers:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name};")
+    # Without triggers in place the backfill doesn't maintain the summaries row by row; they're rebuilt next.
+    _renormalize(cursor)
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER {name} {body};")
+    _rebuild_summaries(cursor)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _rebuild_summaries(cursor):
+    for table, key in SUMMARY_TABLES.items():
+        key_sql = key.format(row="receipts")
+        cursor.execute(f"DELETE FROM {table};")
+        cursor.execute(f"""
+            INSERT INTO {table} (key, total, total_normalized, receipt_count, amount_count, normalized_count)
+            SELECT {key_sql} AS summary_key, SUM(COALESCE(amount, 0)), SUM(COALESCE(amount_normalized, 0)),
+                   COUNT(*), COUNT(amount), COUNT(amount_normalized)
+            FROM receipts WHERE summary_key IS NOT NULL GROUP BY summary_key;
+        """)
+    cursor.execute("DELETE FROM vendors;")
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS receipts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, vendor TEXT, transaction_date DATE,
-            amount REAL, category TEXT, raw_text TEXT NOT NULL,
-            currency TEXT DEFAULT 'USD'
-        );
+        INSERT INTO vendors (normalized, name, receipt_count)
+        SELECT vendor_normalized, MIN(vendor), COUNT(*) FROM receipts
+        WHERE vendor_normalized IS NOT NULL GROUP BY vendor_normalized;
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vendor ON receipts (vendor);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_date ON receipts (transaction_date);")
-    conn.commit()
-    conn.close()
+    cursor.execute("INSERT INTO vendor_fts (vendor_fts) VALUES ('rebuild');")
+
+@metrics.timed("db.rebuild_summaries")
+def rebuild_summaries():
+    """Recomputes every summary table and the vendor index from scratch, e.g. after editing the database outside the app."""
+    with get_db_connection() as conn:
+        _rebuild_summaries(conn.cursor())
 
+INSERT_RECEIPT_SQL = (
+    "INSERT INTO receipts (vendor, transaction_date, amount, category, raw_text, currency, content_hash, "
+    "vendor_normalized, amount_normalized) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+def _receipt_values(r: Receipt) -> tuple:
+    currency = currencies.canonicalize(r.currency)
+    return (r.vendor, r.transaction_date, r.amount, r.category, r.raw_text, currency, r.content_hash,
+            vendors.normalize_vendor(r.vendor), currencies.convert(r.amount, currency, r.transaction_date))
+
+@metrics.timed("db.insert_receipt")
 def insert_receipt(receipt: Receipt):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO receipts (vendor, transaction_date, amount, category, raw_text, currency) VALUES (?, ?, ?, ?, ?,?)",
-        (receipt.vendor, receipt.transaction_date, receipt.amount, receipt.category, receipt.raw_text, receipt.currency)
-    )
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute(INSERT_RECEIPT_SQL, _receipt_values(receipt))
+
+def _existing_hashes(cursor, hashes: List[str]) -> set:
+    found = set()
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        placeholders = ', '.join('?' for _ in chunk)
+        cursor.execute(f"SELECT content_hash FROM receipts WHERE content_hash IN ({placeholders})", chunk)
+        found.update(row["content_hash"] for row in cursor.fetchall())
+    return found
+
+@metrics.timed("db.insert_receipts_bulk")
+def insert_receipts_bulk(receipts: List[Receipt], skip_duplicates: bool = False) -> int:
+    """
+    Inserts many receipts with a single executemany and one commit.
+    With `skip_duplicates`, receipts whose content_hash is already stored (or repeated in the batch) are dropped.
+    Returns the number of rows inserted.
+    """
+    if not receipts: return 0
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if skip_duplicates:
+            seen = _existing_hashes(cursor, [r.content_hash for r in receipts if r.content_hash])
+            unique = []
+            for r in receipts:
+                if r.content_hash:
+                    if r.content_hash in seen: continue
+                    seen.add(r.content_hash)
+                unique.append(r)
+            receipts = unique
+        cursor.executemany(INSERT_RECEIPT_SQL, [_receipt_values(r) for r in receipts])
+    return len(receipts)
+
+# --- Bulk ingestion bookkeeping (lets cli.py resume after a crash) ---
+@metrics.timed("db.get_ingested_hashes")
+def get_ingested_hashes(hashes: List[str]) -> set:
+    """Which of these file hashes were already ingested successfully."""
+    found = set()
+    with get_db_connection() as conn:
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            rows = conn.execute(
+                f"SELECT content_hash FROM ingested_files WHERE status = 'done' AND content_hash IN ({placeholders})", chunk
+            )
+            found.update(row["content_hash"] for row in rows)
+    return found
+
+@metrics.timed("db.record_ingested_files")
+def record_ingested_files(entries: List[Tuple[str, str, str, int, Optional[str]]]):
+    """Upserts (content_hash, source, status, receipt_count, error) rows in one transaction."""
+    if not entries: return
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO ingested_files (content_hash, source, status, receipt_count, error, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))", entries
+        )
+
+# --- Dead-Letter Queue ---
+@metrics.timed("db.add_dead_letters")
+def add_dead_letters(entries: List[Tuple[str, str, Optional[str], Optional[str], bytes]]):
+    """Queues (content_hash, name, stage, error, payload) rows; a file failing again bumps its attempt count."""
+    if not entries: return
+    with get_db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO dead_letters (content_hash, name, stage, error, payload, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'), strftime('%s', 'now'))
+            ON CONFLICT (content_hash) DO UPDATE SET
+                name = excluded.name, stage = excluded.stage, error = excluded.error,
+                attempts = attempts + 1, updated_at = excluded.updated_at
+        """, entries)
+
+@metrics.timed("db.get_dead_letters")
+def get_dead_letters(limit: Optional[int] = None, include_payload: bool = False) -> List[Dict[str, Any]]:
+    """Oldest failures first. Payloads are only loaded when asked for."""
+    columns = "content_hash, name, stage, error, attempts, created_at, updated_at" + (", payload" if include_payload else "")
+    with get_db_connection() as conn:
+        rows = conn.execute(f"SELECT {columns} FROM dead_letters ORDER BY created_at LIMIT ?", (-1 if limit is None else limit,))
+        return [dict(row) for row in rows]
+
+@metrics.timed("db.count_dead_letters")
+def count_dead_letters() -> int:
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+@metrics.timed("db.delete_dead_letters")
+def delete_dead_letters(hashes: List[str]):
+    if not hashes: return
+    with get_db_connection() as conn:
+        conn.executemany("DELETE FROM dead_letters WHERE content_hash = ?", [(h,) for h in hashes])
+
+# --- Job Queue ---
+# Files waiting for a worker process (worker.py): queued -> running -> done | failed. `options` holds, as JSON,
+# the ingestion settings chosen when the file was queued. Workers refresh `workers.last_seen` while alive;
+# running jobs of a worker that stopped doing so are queued again.
+JOB_STATUSES = ("queued", "running", "done", "failed")
+WORKER_TIMEOUT = 60
+
+@metrics.timed("db.enqueue_jobs")
+def enqueue_jobs(batch_id: str, files: List[Tuple[str, bytes]], options: Dict[str, Any]) -> int:
+    """Queues (name, payload) files as one batch sharing the given ingestion options."""
+    if not files: return 0
+    encoded, now = json.dumps(options), time.time()
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO jobs (batch_id, name, payload, options, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(batch_id, name, payload, encoded, now) for name, payload in files]
+        )
+    return len(files)
+
+@metrics.timed("db.claim_jobs")
+def claim_jobs(worker: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Marks up to `limit` of the oldest queued jobs as running for `worker` and returns them with their
+    payloads. A single UPDATE takes the write lock, so two workers never claim the same job. Jobs claimed
+    together come from one batch and therefore share their options.
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute("""
+            UPDATE jobs SET status = 'running', worker = ?, started_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM jobs WHERE status = 'queued'
+                AND batch_id = (SELECT batch_id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, batch_id, name, payload, options
+        """, (worker, time.time(), limit)).fetchall()
+    return sorted((dict(row) for row in rows), key=lambda job: job["id"])
+
+@metrics.timed("db.finish_jobs")
+def finish_jobs(worker: str, outcomes: List[Tuple[int, str, int, Optional[str], Optional[str], float]]):
+    """
+    Records the (job_id, status, receipt_count, stage, error, finished_at) outcomes of `worker`'s jobs and
+    drops their payloads (files that failed keep theirs in the dead-letter table).
+    """
+    if not outcomes: return
+    with get_db_connection() as conn:
+        conn.executemany(
+            "UPDATE jobs SET status = ?, receipt_count = ?, stage = ?, error = ?, finished_at = ?, payload = NULL "
+            "WHERE id = ?", [(status, count, stage, error, finished, job_id) for job_id, status, count, stage, error, finished in outcomes]
+        )
+        conn.execute("UPDATE workers SET jobs_done = jobs_done + ? WHERE id = ?", (len(outcomes), worker))
+
+@metrics.timed("db.requeue_orphaned_jobs")
+def requeue_orphaned_jobs(max_attempts: int) -> int:
+    """
+    Puts back the running jobs of workers not seen for WORKER_TIMEOUT seconds (crashed or killed);
+    jobs that already had `max_attempts` tries fail instead. Returns how many jobs were affected.
+    """
+    cutoff = time.time() - WORKER_TIMEOUT
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM workers WHERE last_seen < ?", (cutoff,))
+        return conn.execute("""
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                error = CASE WHEN attempts >= ? THEN 'The worker processing this file stopped.' ELSE error END,
+                finished_at = CASE WHEN attempts >= ? THEN ? END, worker = NULL
+            WHERE status = 'running' AND worker NOT IN (SELECT id FROM workers)
+        """, (max_attempts, max_attempts, max_attempts, time.time())).rowcount
+
+@metrics.timed("db.register_worker")
+def register_worker(worker: str, pid: int):
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO workers (id, pid, started_at, last_seen) VALUES (?, ?, ?, ?)", (worker, pid, now, now))
+
+@metrics.timed("db.heartbeat_worker")
+def heartbeat_worker(worker: str, circuit: str = "closed"):
+    """Marks the worker alive and records its AI circuit-breaker state ('closed', 'open' or 'half-open')."""
+    with get_db_connection() as conn:
+        conn.execute("UPDATE workers SET last_seen = ?, circuit = ? WHERE id = ?", (time.time(), circuit, worker))
+
+@metrics.timed("db.unregister_worker")
+def unregister_worker(worker: str):
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM workers WHERE id = ?", (worker,))
+
+@metrics.timed("db.count_active_workers")
+def count_active_workers() -> int:
+    with get_db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM workers WHERE last_seen >= ?", (time.time() - WORKER_TIMEOUT,)).fetchone()[0]
+
+@metrics.timed("db.count_paused_workers")
+def count_paused_workers() -> int:
+    """Active workers whose circuit breaker has stopped them calling the AI model."""
+    with get_db_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM workers WHERE last_seen >= ? AND circuit != 'closed'", (time.time() - WORKER_TIMEOUT,)
+        ).fetchone()[0]
+
+def _batch_condition(batch_ids: Optional[List[str]]) -> Tuple[str, list]:
+    if batch_ids is None: return "", []
+    return f" WHERE batch_id IN ({', '.join('?' for _ in batch_ids) or 'NULL'})", list(batch_ids)
+
+@metrics.timed("db.get_job_progress")
+def get_job_progress(batch_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Job counts per status, receipts saved and mean seconds per finished job, for the given batches or all jobs."""
+    where, params = _batch_condition(batch_ids)
+    with get_db_connection() as conn:
+        counts = dict(conn.execute(f"SELECT status, COUNT(*) FROM jobs{where} GROUP BY status", params).fetchall())
+        receipts, mean_seconds = conn.execute(
+            f"SELECT SUM(receipt_count), AVG(finished_at - started_at) FROM jobs{where}", params
+        ).fetchone()
+    progress = {status: counts.get(status, 0) for status in JOB_STATUSES}
+    progress.update(receipts=receipts or 0, mean_seconds=mean_seconds or 0)
+    return progress
+
+@metrics.timed("db.get_failed_jobs")
+def get_failed_jobs(batch_ids: Optional[List[str]] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    where, params = _batch_condition(batch_ids)
+    where += (" AND" if where else " WHERE") + " status = 'failed'"
+    with get_db_connection() as conn:
+        rows = conn.execute(f"SELECT id, name, stage, error, attempts FROM jobs{where} ORDER BY id LIMIT ?", params + [limit])
+        return [dict(row) for row in rows]
+
+@metrics.timed("db.delete_finished_jobs")
+def delete_finished_jobs(batch_ids: Optional[List[str]] = None) -> int:
+    where, params = _batch_condition(batch_ids)
+    where += (" AND" if where else " WHERE") + " status IN ('done', 'failed')"
+    with get_db_connection() as conn:
+        return conn.execute(f"DELETE FROM jobs{where}", params).rowcount
 
+# --- Category Rules ---
+@metrics.timed("db.get_category_rules")
+def get_category_rules() -> List[Tuple[str, str, str]]:
+    """Stored (pattern, category, source) rules."""
+    with get_db_connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT pattern, category, source FROM category_rules")]
+
+@metrics.timed("db.get_category_rules_version")
+def get_category_rules_version() -> Tuple[int, Optional[float]]:
+    """Changes whenever rules are added, replaced or removed, so long-running processes know to reload them."""
+    with get_db_connection() as conn:
+        return tuple(conn.execute("SELECT COUNT(*), MAX(CAST(updated_at AS REAL)) FROM category_rules").fetchone())
+
+@metrics.timed("db.upsert_category_rules")
+def upsert_category_rules(source: str, rules: List[Tuple[str, str]]):
+    """Adds or replaces (pattern, category) rules of one source."""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO category_rules (pattern, source, category, updated_at) "
+            "VALUES (?, ?, ?, ?)", [(pattern, source, category, now) for pattern, category in rules]
+        )
+
+@metrics.timed("db.replace_category_rules")
+def replace_category_rules(source: str, rules: List[Tuple[str, str]]):
+    """Swaps all rules of one source for `rules` in a single transaction."""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM category_rules WHERE source = ?", (source,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO category_rules (pattern, source, category, updated_at) "
+            "VALUES (?, ?, ?, ?)", [(pattern, source, category, now) for pattern, category in rules]
+        )
+
+@metrics.timed("db.get_normalized_vendors")
+def get_normalized_vendors() -> List[str]:
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT normalized FROM vendors")]
+
+@metrics.timed("db.recategorize")
+def recategorize(assignments: Dict[str, str], default: str) -> int:
+    """
+    Sets the category of every receipt from its normalized vendor ({normalized: category}); receipts
+    without a vendor get `default`. Only rows whose category changes are written. Returns that count.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE receipts SET category = ? WHERE vendor_normalized = ? AND category IS NOT ?",
+            [(category, normalized, category) for normalized, category in assignments.items()]
+        )
+        changed = cursor.rowcount
+        cursor.execute("UPDATE receipts SET category = ? WHERE vendor_normalized IS NULL AND category IS NOT ?", (default, default))
+        return changed + cursor.rowcount
+
+@metrics.timed("db.get_all_receipts")
 def get_all_receipts() -> List[Dict[str, Any]]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, vendor, transaction_date, amount, category, currency FROM receipts ORDER BY id DESC")
-    receipts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return receipts
+    with get_db_connection() as conn:
+        cursor = conn.execute("SELECT id, vendor, transaction_date, amount, category, currency FROM receipts ORDER BY id DESC")
+        return [dict(row) for row in cursor.fetchall()]
+
+def _update_sql(columns: Tuple[str, ...]) -> str:
+    unknown = set(columns) - UPDATABLE_COLUMNS - DERIVED_COLUMNS
+    if unknown: raise ValueError(f"Cannot update column(s): {', '.join(sorted(unknown))}")
+    set_clause = ", ".join([f"{key} = ?" for key in columns])
+    return f"UPDATE receipts SET {set_clause} WHERE id = ?"
 
+@metrics.timed("db.update_receipt")
 def update_receipt(receipt_id: int, updates: Dict[str, Any]):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
-    values = list(updates.values())
-    values.append(receipt_id)
-    query = f"UPDATE receipts SET {set_clause} WHERE id = ?"
-    cursor.execute(query, values)
-    conn.commit()
-    conn.close()
+    update_receipts_bulk([(receipt_id, updates)])
 
+@metrics.timed("db.update_receipts_bulk")
+def update_receipts_bulk(updates: List[Tuple[int, Dict[str, Any]]]):
+    """
+    Applies many (receipt_id, {column: value}) updates in one transaction.
+    Rows that change the same set of columns share one executemany.
+    """
+    grouped: Dict[Tuple[str, ...], List[list]] = {}
+    to_convert = []
+    for receipt_id, changes in updates:
+        if not changes: continue
+        derived = DERIVED_COLUMNS & set(changes)
+        if derived: raise ValueError(f"{', '.join(sorted(derived))} cannot be set directly; it is computed on write.")
+        if "vendor" in changes: changes = {**changes, "vendor_normalized": vendors.normalize_vendor(changes["vendor"])}
+        if "currency" in changes: changes = {**changes, "currency": currencies.canonicalize(changes["currency"])}
+        if CONVERSION_INPUTS & set(changes): to_convert.append(receipt_id)
+        columns = tuple(sorted(changes))
+        grouped.setdefault(columns, []).append([changes[c] for c in columns] + [receipt_id])
+    if not grouped: return
+
+    with get_db_connection() as conn:
+        for columns, rows in grouped.items():
+            conn.executemany(_update_sql(columns), rows)
+        # The converted amount also depends on columns this update may not touch, so it's read back per row.
+        if to_convert: _renormalize(conn.cursor(), to_convert)
+
+@metrics.timed("db.delete_receipts_by_ids")
 def delete_receipts_by_ids(ids: List[int]):
     if not ids: return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    placeholders = ', '.join('?' for _ in ids)
-    query = f"DELETE FROM receipts WHERE id IN ({placeholders})"
-    cursor.execute(query, ids)
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        placeholders = ', '.join('?' for _ in ids)
+        query = f"DELETE FROM receipts WHERE id IN ({placeholders})"
+        conn.execute(query, ids)
 
+@metrics.timed("db.delete_all_receipts")
 def delete_all_receipts():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM receipts")
-    cursor.execute("DELETE FROM sqlite_sequence WHERE name='receipts';")
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    # Row-by-row triggers would update the summaries once per receipt; with them dropped for the duration of the
+    # transaction SQLite truncates the tables instead. Other connections never see the triggers missing.
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # sqlite3 would run the DDL below outside a transaction, so open one explicitly.
+        cursor.execute("BEGIN IMMEDIATE")
+        triggers = _summary_triggers()
+        for name in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name};")
+        cursor.execute("DELETE FROM receipts")
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name='receipts';")
+        _rebuild_summaries(cursor)
+        for name, body in triggers.items():
+            cursor.execute(f"CREATE TRIGGER {name} {body};")
+
+# --- Query Layer: filters and aggregates executed in SQL ---
+# `filters` accepts the same keys as algorithms.filter_receipts: vendor_keyword, date_range, amount_range.
+# vendor_keyword is matched against normalized vendor names, so case, punctuation and store numbers don't matter.
+Filters = Optional[Dict[str, Any]]
+# Trigram FTS needs at least 3 characters; shorter terms scan the vendors table instead.
+MIN_FTS_TERM = 3
+FUZZY_CANDIDATES = 50
+MIN_FUZZY_SIMILARITY = 0.2
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def _vendor_match(term: str) -> Tuple[str, list]:
+    """SQL selecting the normalized names of vendors containing `term` (already normalized)."""
+    if len(term) < MIN_FTS_TERM:
+        return "SELECT normalized FROM vendors WHERE instr(normalized, ?) > 0", [term]
+    return "SELECT normalized FROM vendors WHERE id IN (SELECT rowid FROM vendor_fts WHERE vendor_fts MATCH ?)", [_fts_phrase(term)]
+
+@metrics.timed("db.search_vendors")
+def search_vendors(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Ranked vendor suggestions for search-as-you-type: vendors containing the query (prefix matches first,
+    then by receipt count), topped up with the closest fuzzy matches by trigram similarity when there are
+    fewer than `limit`, so typos still find something. Each result has name, normalized and receipt_count.
+    """
+    term = vendors.normalize_vendor(query)
+    if not term: return []
+    match_sql, params = _vendor_match(term)
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT name, normalized, receipt_count FROM vendors WHERE normalized IN ({match_sql}) "
+            "ORDER BY substr(normalized, 1, ?) = ? DESC, receipt_count DESC LIMIT ?",
+            params + [len(term), term, limit]
+        ).fetchall()
+        results = [dict(row) for row in rows]
+        if len(results) >= limit or len(term) < MIN_FTS_TERM: return results
+
+        # Fuzzy top-up: any shared trigram makes a candidate; bm25 shortlists, Jaccard similarity ranks.
+        query_grams = vendors.trigrams(term)
+        candidates = conn.execute(
+            "SELECT v.name, v.normalized, v.receipt_count FROM vendor_fts JOIN vendors v ON v.id = vendor_fts.rowid "
+            "WHERE vendor_fts MATCH ? ORDER BY bm25(vendor_fts) LIMIT ?",
+            (" OR ".join(_fts_phrase(gram) for gram in sorted(query_grams)), FUZZY_CANDIDATES)
+        ).fetchall()
+    found = {r["normalized"] for r in results}
+    scored = []
+    for row in candidates:
+        if row["normalized"] in found: continue
+        grams = vendors.trigrams(row["normalized"])
+        similarity = len(query_grams & grams) / len(query_grams | grams)
+        if similarity >= MIN_FUZZY_SIMILARITY: scored.append((similarity, dict(row)))
+    scored.sort(key=lambda item: (-item[0], -item[1]["receipt_count"]))
+    return results + [row for _, row in scored[:limit - len(results)]]
+
+def _filter_clause(
+    vendor_keyword: str = "",
+    date_range: tuple = (None, None),
+    amount_range: tuple = (None, None)
+) -> Tuple[str, list]:
+    """Builds a WHERE clause (with leading space, or empty) and its parameters."""
+    conditions, params = [], []
+    term = vendors.normalize_vendor(vendor_keyword)
+    if term:
+        # Resolve the keyword against the (small) vendors table, then fetch receipts through the index.
+        match_sql, match_params = _vendor_match(term)
+        conditions.append(f"vendor_normalized IN ({match_sql})")
+        params += match_params
+    if date_range and date_range[0] and date_range[1]:
+        conditions.append("transaction_date BETWEEN ? AND ?")
+        params += [str(date_range[0]), str(date_range[1])]
+    min_amount, max_amount = amount_range or (None, None)
+    if min_amount is not None:
+        conditions.append("amount >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append("amount <= ?")
+        params.append(max_amount)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+def _where(filters: Filters, *extra: str) -> Tuple[str, list]:
+    clause, params = _filter_clause(**(filters or {}))
+    for condition in extra:
+        clause += (" AND " if clause else " WHERE ") + condition
+    return clause, params
+
+@metrics.timed("db.query_receipts")
+def query_receipts(filters: Filters = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """SQL equivalent of algorithms.filter_receipts over the whole table."""
+    where, params = _where(filters)
+    sql = f"SELECT id, vendor, transaction_date, amount, category, currency FROM receipts{where} ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with get_db_connection() as conn:
+        return [dict(row) for row in conn.execute(sql, params)]
+
+@metrics.timed("db.get_receipt_columns")
+def get_receipt_columns(
+    filters: Filters = None,
+    columns: Tuple[str, ...] = ("vendor", "transaction_date", "amount", "category", "currency")
+) -> Dict[str, list]:
+    """Filtered receipts as {column: values} for the vectorized analytics module."""
+    unknown = set(columns) - SORTABLE_COLUMNS - DERIVED_COLUMNS
+    if unknown: raise ValueError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+    where, params = _where(filters)
+    with get_db_connection() as conn:
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM receipts{where}", params).fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {column: list(column_values) for column, column_values in zip(columns, values)}
+
+def _is_unfiltered(filters: Filters) -> bool:
+    return not _filter_clause(**(filters or {}))[0]
+
+def _read_summary(table: str, column: str = "total_normalized") -> Dict[Any, float]:
+    with get_db_connection() as conn:
+        rows = conn.execute(f"SELECT key, {column} AS total FROM {table} ORDER BY key").fetchall()
+    return {(row["key"] if row["key"] != "" else None): row["total"] for row in rows}
+
+@metrics.timed("db.count_receipts")
+def count_receipts(filters: Filters = None) -> int:
+    if _is_unfiltered(filters):
+        sql, params = "SELECT COALESCE(SUM(receipt_count), 0) FROM summary_currency", []
+    else:
+        where, params = _where(filters)
+        sql = f"SELECT COUNT(*) FROM receipts{where}"
+    with get_db_connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+@metrics.timed("db.get_totals")
+def get_totals(filters: Filters = None) -> Dict[str, Any]:
+    """
+    Total and mean spend in the reporting currency and the count of receipts with an amount; constant
+    time when unfiltered. "unconverted" counts amounts left out of the total for lack of an exchange rate.
+    """
+    if _is_unfiltered(filters):
+        sql, params = "SELECT SUM(total_normalized), SUM(normalized_count), SUM(amount_count) FROM summary_currency", []
+    else:
+        where, params = _where(filters)
+        sql = f"SELECT SUM(amount_normalized), COUNT(amount_normalized), COUNT(amount) FROM receipts{where}"
+    with get_db_connection() as conn:
+        total, converted, count = conn.execute(sql, params).fetchone()
+    if not count:
+        return {"total_spend": 0, "mean": 0, "count": 0, "unconverted": 0}
+    return {"total_spend": total or 0, "mean": total / converted if converted else 0, "count": count,
+            "unconverted": count - converted}
+
+def _keyset_condition(sort_by: str, descending: bool, after: Tuple[Any, int], nullable: bool = True) -> Tuple[str, list]:
+    """
+    Rows strictly after `after` = (sort value, id) in ORDER BY sort_by, id.
+    SQLite sorts NULLs first ascending and last descending, so NULL sort values need their own branch.
+    Pass `nullable=False` when the filters already exclude NULLs: descending pages then need no OR branch
+    for them, which would make SQLite combine several index searches and sort all their rows.
+    """
+    value, last_id = after
+    op = "<" if descending else ">"
+    if sort_by == "id":
+        return f"id {op} ?", [last_id]
+    if value is None:
+        if descending:
+            return f"({sort_by} IS NULL AND id < ?)", [last_id]
+        return f"(({sort_by} IS NULL AND id > ?) OR {sort_by} IS NOT NULL)", [last_id]
+    if descending and nullable:
+        return f"({sort_by} < ? OR ({sort_by} = ? AND id < ?) OR {sort_by} IS NULL)", [value, value, last_id]
+    # A row value is one range over the (sort_by, id) index, even beside a filter on the same column.
+    return f"({sort_by}, id) {op} (?, ?)", [value, last_id]
+
+@metrics.timed("db.get_receipts_page")
+def get_receipts_page(
+    filters: Filters = None,
+    sort_by: str = "id",
+    descending: bool = True,
+    after: Optional[Tuple[Any, int]] = None,
+    limit: int = 50
+) -> List[Dict[str, Any]]:
+    """
+    One page of receipts using keyset pagination: pass the (sort value, id) of the previous page's
+    last row as `after`. Unlike OFFSET, the cost of a page doesn't grow with how deep into the table it is.
+    """
+    if sort_by not in SORTABLE_COLUMNS: raise ValueError(f"Cannot sort by '{sort_by}'")
+    filters = filters or {}
+    # Range filters on the sort column already drop its NULLs.
+    nullable = not (
+        (sort_by == "amount" and any(bound is not None for bound in filters.get("amount_range") or ()))
+        or (sort_by == "transaction_date" and all(filters.get("date_range") or (None,)))
+    )
+    extra, extra_params = _keyset_condition(sort_by, descending, after, nullable) if after else ("", [])
+    where, params = _where(filters, *([extra] if extra else []))
+    direction = "DESC" if descending else "ASC"
+    order = "id " + direction if sort_by == "id" else f"{sort_by} {direction}, id {direction}"
+    sql = (f"SELECT id, vendor, transaction_date, amount, category, currency FROM receipts{where} "
+           f"ORDER BY {order} LIMIT ?")
+    with get_db_connection() as conn:
+        return [dict(row) for row in conn.execute(sql, params + extra_params + [limit])]
+
+@metrics.timed("db.get_aggregates")
+def get_aggregates(filters: Filters = None) -> Dict[str, Any]:
+    """
+    Same result as algorithms.calculate_aggregates (plus "count"), computed in SQL.
+    The median is read with a single ORDER BY ... LIMIT/OFFSET walk of idx_amount_covering.
+    """
+    where, params = _where(filters, "amount IS NOT NULL")
+    with get_db_connection() as conn:
+        count, total = conn.execute(f"SELECT COUNT(*), SUM(amount) FROM receipts{where}", params).fetchone()
+        if not count:
+            return {"total_spend": 0, "mean": 0, "median": 0, "mode": "N/A", "count": 0}
+
+        middle = conn.execute(
+            f"SELECT amount FROM receipts{where} ORDER BY amount LIMIT ? OFFSET ?",
+            params + [2 - count % 2, (count - 1) // 2]
+        ).fetchall()
+        median = sum(row[0] for row in middle) / len(middle)
+
+        top = conn.execute(
+            f"SELECT amount, COUNT(*) AS freq FROM receipts{where} GROUP BY amount ORDER BY freq DESC LIMIT 2", params
+        ).fetchall()
+        mode = top[0]["amount"] if len(top) == 1 or top[0]["freq"] > top[1]["freq"] else "Multiple"
+
+    return {"total_spend": total, "mean": total / count, "median": median, "mode": mode, "count": count}
+
+def _grouped_sum(key_sql: str, filters: Filters, *extra: str, value: str = "amount_normalized") -> Dict[Any, float]:
+    where, params = _where(filters, *extra)
+    sql = f"SELECT {key_sql} AS key, SUM({value}) AS total FROM receipts{where} GROUP BY key ORDER BY key"
+    with get_db_connection() as conn:
+        return {row["key"]: row["total"] or 0 for row in conn.execute(sql, params)}
+
+# Unfiltered rollups come straight from the summary tables; filtered ones are computed in SQL.
+# Spend is in the reporting currency, except per currency, where each total stays in its own currency.
+@metrics.timed("db.get_monthly_spend")
+def get_monthly_spend(filters: Filters = None) -> Dict[str, float]:
+    """Total spend per 'YYYY-MM', in month order."""
+    if _is_unfiltered(filters): return _read_summary("summary_monthly")
+    return _grouped_sum("substr(transaction_date, 1, 7)", filters, "transaction_date IS NOT NULL")
+
+@metrics.timed("db.get_vendor_spend")
+def get_vendor_spend(filters: Filters = None) -> Dict[str, float]:
+    """
+    Total spend per vendor, like algorithms.get_vendor_frequency except that spellings with the same
+    normalized name ("WALMART #12", "Walmart") are grouped under one of them.
+    """
+    if _is_unfiltered(filters):
+        sql, params = ("SELECT s.key, v.name, s.total_normalized AS total FROM summary_vendor s "
+                       "LEFT JOIN vendors v ON v.normalized = s.key ORDER BY s.key"), []
+    else:
+        where, params = _where(filters)
+        sql = (f"SELECT vendor_normalized AS key, (SELECT name FROM vendors WHERE normalized = vendor_normalized) AS name, "
+               f"SUM(amount_normalized) AS total FROM receipts{where} GROUP BY vendor_normalized ORDER BY key")
+    with get_db_connection() as conn:
+        return {(row["name"] or row["key"] or None): row["total"] or 0 for row in conn.execute(sql, params)}
+
+@metrics.timed("db.get_currency_spend")
+def get_currency_spend(filters: Filters = None) -> Dict[str, float]:
+    if _is_unfiltered(filters): return _read_summary("summary_currency", "total")
+    return _grouped_sum("currency", filters, value="amount")
+
+@metrics.timed("db.get_category_spend")
+def get_category_spend(filters: Filters = None) -> Dict[str, float]:
+    if _is_unfiltered(filters): return _read_summary("summary_category")
+    return _grouped_sum("category", filters)
+
+# --- Streaming Export ---
+# Rows go from a cursor to the file `EXPORT_CHUNK_SIZE` at a time, so memory stays flat however large the table is.
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_COLUMNS = ("id", "vendor", "transaction_date", "amount", "category", "currency")
+EXPORT_CHUNK_SIZE = 10000
+
+def iter_receipts(
+    filters: Filters = None,
+    columns: Tuple[str, ...] = EXPORT_COLUMNS,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[List[tuple]]:
+    """Yields filtered receipts in id order as lists of up to `chunk_size` row tuples."""
+    unknown = set(columns) - SORTABLE_COLUMNS - {"raw_text"}
+    if unknown: raise ValueError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+    where, params = _where(filters)
+    with get_db_connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM receipts{where} ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows: return
+            yield [tuple(row) for row in rows]
+
+def _export_csv(chunks: Iterator[List[tuple]], columns: Tuple[str, ...], f: IO[str]) -> int:
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+def _export_jsonl(chunks: Iterator[List[tuple]], columns: Tuple[str, ...], f: IO[str]) -> int:
+    count = 0
+    for rows in chunks:
+        f.write("".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows))
+        count += len(rows)
+    return count
+
+def _export_parquet(chunks: Iterator[List[tuple]], columns: Tuple[str, ...], target: Union[str, IO[bytes]]) -> int:
+    """One row group per chunk. pyarrow ships with Streamlit, so it's imported only when needed."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    types = {"id": pa.int64(), "amount": pa.float64(), "transaction_date": pa.date32()}
+    schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+    count = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        for rows in chunks:
+            arrays = [
+                pa.array(values, field.type) if field.type != pa.date32()
+                # Dates are stored as 'YYYY-MM-DD' text; anything unparseable becomes null rather than failing the export.
+                else pc.strptime(pa.array(values, pa.string()), format="%Y-%m-%d", unit="s", error_is_null=True).cast(pa.date32())
+                for values, field in zip(zip(*rows), schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+@metrics.timed("db.export_receipts")
+def export_receipts(
+    target: Union[str, IO],
+    fmt: str = "csv",
+    filters: Filters = None,
+    columns: Tuple[str, ...] = EXPORT_COLUMNS,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> int:
+    """
+    Streams the filtered receipts to `target` (a path, or an open file: text for csv/jsonl, binary
+    for parquet) as CSV, JSON Lines or Parquet. Returns the number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS: raise ValueError(f"Unsupported export format '{fmt}'; use one of {', '.join(EXPORT_FORMATS)}.")
+    chunks = iter_receipts(filters, columns, chunk_size)
+    if fmt == "parquet": return _export_parquet(chunks, columns, target)
+    write = _export_csv if fmt == "csv" else _export_jsonl
+    if not isinstance(target, str): return write(chunks, columns, target)
+    with open(target, "w", newline="", encoding="utf-8") as f:
+        return write(chunks, columns, f)
+
+# --- Metrics ---
+# Not timed themselves, so saving a snapshot doesn't change it. Live processes keep one row each; finished ones
+# are folded into the RETIRED_METRICS row, so the table (and every read of it) stays small.
+RETIRED_METRICS = "retired"
+
+def save_metrics(source: str, snapshot: Dict[str, Any]):
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO metrics (source, snapshot, updated_at) VALUES (?, ?, ?)",
+            (source, json.dumps(snapshot), snapshot["updated_at"])
+        )
+
+def _retire_snapshots(conn: sqlite3.Connection, where: str, params: list, final: Optional[Dict[str, Any]] = None) -> int:
+    """Folds the matching rows (or, for one exiting process, its `final` snapshot) into the retired row."""
+    conn.execute("BEGIN IMMEDIATE")  # read-modify-write: another process must not retire the same rows
+    rows = conn.execute(f"SELECT source, snapshot FROM metrics WHERE source != ? AND {where}", [RETIRED_METRICS, *params]).fetchall()
+    retired = conn.execute("SELECT snapshot FROM metrics WHERE source = ?", (RETIRED_METRICS,)).fetchone()
+    snapshots = [final] if final is not None else [json.loads(row["snapshot"]) for row in rows]
+    merged = metrics.merge(([json.loads(retired[0])] if retired else []) + snapshots)
+    if merged["started_at"] is not None:
+        conn.execute(
+            "INSERT OR REPLACE INTO metrics (source, snapshot, updated_at) VALUES (?, ?, ?)",
+            (RETIRED_METRICS, json.dumps(merged), merged["updated_at"])
+        )
+    conn.executemany("DELETE FROM metrics WHERE source = ?", [(row["source"],) for row in rows])
+    return len(rows)
+
+def retire_metrics(source: str, snapshot: Dict[str, Any]):
+    """Folds the final snapshot of a process that is exiting into the retired totals."""
+    with get_db_connection() as conn:
+        _retire_snapshots(conn, "source = ?", [source], final=snapshot)
+
+def retire_stale_metrics() -> int:
+    """Retires the rows of processes that stopped publishing without retiring (e.g. killed workers)."""
+    cutoff = time.time() - WORKER_TIMEOUT
+    with get_db_connection() as conn:
+        # Checked first without the write lock, since workers call this on every poll.
+        stale = conn.execute("SELECT 1 FROM metrics WHERE source != ? AND updated_at < ? LIMIT 1", (RETIRED_METRICS, cutoff))
+        if stale.fetchone() is None: return 0
+        return _retire_snapshots(conn, "updated_at < ?", [cutoff])
+
+def get_metrics_snapshots(include_retired: bool = True) -> List[Dict[str, Any]]:
+    """Snapshots of live processes, plus (by default) the merged snapshot of all finished ones."""
+    sql, params = "SELECT snapshot FROM metrics", []
+    if not include_retired:
+        sql, params = sql + " WHERE source != ? AND updated_at >= ?", [RETIRED_METRICS, time.time() - WORKER_TIMEOUT]
+    with get_db_connection() as conn:
+        return [json.loads(row[0]) for row in conn.execute(sql + " ORDER BY updated_at", params)]
+
+def clear_metrics():
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM metrics")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Receipt database maintenance.")
+    parser.add_argument("command", choices=["init", "rebuild-summaries"])
+    parser.add_argument("--db", default=DB_NAME, help="Path to the SQLite database.")
+    args = parser.parse_args()
+    DB_NAME = args.db
+    init_db()
+    if args.command == "rebuild-summaries":
+        rebuild_summaries()
+        print("Summary tables rebuilt.")
@@ -0,0 +1,333 @@
+# ingestion.py (Concurrent Batch Ingestion Pipeline)
+import functools
+import io
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from PIL import Image
+from pydantic import ValidationError
+
+import database as db
+import metrics
+import ocr_utils
+import cache
+import data_extraction
+from models import Receipt
+
+DEFAULT_MAX_WORKERS = 4
+# Local OCR results scoring below this are escalated to the AI model.
+DEFAULT_MIN_CONFIDENCE = 0.8
+# Receipts per model request; 1 sends each receipt on its own.
+DEFAULT_BATCH_SIZE = 1
+# How long a partial batch waits for more receipts before it is sent anyway.
+DEFAULT_BATCH_WAIT = 0.5
+
+
+@dataclass
+class IngestResult:
+    """Outcome of pushing a single file through decode -> model call -> validate."""
+    name: str
+    receipts: List[Receipt] = field(default_factory=list)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    bytes_saved: int = 0
+    content_hash: Optional[str] = None
+    stage: Optional[str] = None  # where a failed file gave up: decode, parse or validate
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.receipts)
+
+
+def parse_locally(content: Union[Image.Image, str], min_confidence: float) -> Optional[Dict[str, Any]]:
+    """Tesseract + rule-based extraction. Returns None when the result should go to the AI model."""
+    if isinstance(content, Image.Image):
+        with metrics.timed("ocr.tesseract"):
+            ocr_result = ocr_utils.ocr_image(content)
+        if ocr_result is None: return None
+        text, ocr_confidence = ocr_result
+    else:
+        text, ocr_confidence = content, 100.0
+    with metrics.timed("parse.rules"):
+        parsed, confidence = data_extraction.parse_receipt_with_rules(text, ocr_confidence)
+    if confidence < min_confidence:
+        metrics.increment("parse.rules.escalated")
+        return None
+    return parsed
+
+
+class RateLimiter:
+    """Spaces out model calls so that at most `max_per_minute` start in any minute."""
+
+    def __init__(self, max_per_minute: Optional[float] = None):
+        self.interval = 60.0 / max_per_minute if max_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval: return
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _call_model(content: Union[Image.Image, str], client: Any, rate_limiter: Optional[RateLimiter]) -> Dict[str, Any]:
+    if rate_limiter: rate_limiter.wait()
+    if isinstance(content, Image.Image):
+        return data_extraction.parse_receipt_with_vision(content, client=client)
+    return data_extraction.parse_receipt_with_text(content, client=client)
+
+
+def _is_valid(parsed_data: Dict[str, Any]) -> bool:
+    try:
+        Receipt(**parsed_data)
+        return True
+    except ValidationError:
+        return False
+
+
+class ModelBatcher:
+    """
+    Gathers model requests from the worker threads and sends them `batch_size` at a time through
+    data_extraction.parse_receipts_batch. A partial batch goes out once a waiting request has waited
+    `max_wait` seconds, so batches can only fill up when there are at least `batch_size` workers.
+    Receipts missing from a batch response or failing validation are retried with a single-item call.
+    """
+
+    def __init__(
+        self,
+        client: Any = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_wait: float = DEFAULT_BATCH_WAIT,
+        rate_limiter: Optional[RateLimiter] = None
+    ):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.rate_limiter = rate_limiter
+        self.batches = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[Union[Image.Image, str], Future]] = []
+
+    def _take(self, future: Optional[Future] = None) -> List[Tuple[Union[Image.Image, str], Future]]:
+        """Empties the queue; with `future`, only if that request hasn't been sent by another thread yet."""
+        with self._lock:
+            if future is not None and all(f is not future for _, f in self._pending): return []
+            if future is None and len(self._pending) < self.batch_size: return []
+            batch, self._pending = self._pending, []
+            if batch: self.batches += 1
+            return batch
+
+    def _send(self, batch: List[Tuple[Union[Image.Image, str], Future]]):
+        if not batch: return
+        try:
+            if self.rate_limiter: self.rate_limiter.wait()
+            metrics.observe("model.batch_size", len(batch))
+            results = data_extraction.parse_receipts_batch([content for content, _ in batch], client=self.client)
+        except data_extraction.ModelCallError as e:
+            # Retries are exhausted or the circuit is open; single-item fallbacks would fail the same way.
+            for _, future in batch: future.set_exception(e)
+            return
+        except Exception:
+            results = [None] * len(batch)
+        for (_, future), parsed_data in zip(batch, results):
+            future.set_result(parsed_data if parsed_data is not None and _is_valid(parsed_data) else None)
+
+    def parse(self, content: Union[Image.Image, str]) -> Dict[str, Any]:
+        """Blocks until `content` has been parsed as part of a batch (or on its own, as a fallback)."""
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((content, future))
+        self._send(self._take())
+        try:
+            parsed_data = future.result(timeout=self.max_wait)
+        except FutureTimeoutError:
+            self._send(self._take(future))
+            parsed_data = future.result()
+
+        if parsed_data is None:
+            with self._lock:
+                self.fallbacks += 1
+            metrics.increment("model.batch_fallbacks")
+            parsed_data = _call_model(content, self.client, self.rate_limiter)
+        return parsed_data
+
+
+def _parse_content(
+    content: Union[Image.Image, str],
+    client: Any,
+    rate_limiter: Optional[RateLimiter],
+    min_confidence: Optional[float],
+    max_long_edge: Optional[int],
+    source: Optional[bytes] = None,
+    batcher: Optional[ModelBatcher] = None
+) -> Tuple[Dict[str, Any], int, bool]:
+    """
+    Returns the parsed dict, the upload bytes saved by shrinking the image, and whether the model parsed it.
+    `source` is the uploaded file when `content` is the whole file (not a PDF page).
+    """
+    parsed_data = parse_locally(content, min_confidence) if min_confidence is not None else None
+    if parsed_data is not None: return parsed_data, 0, False
+    bytes_saved = 0
+    if isinstance(content, Image.Image) and max_long_edge:
+        if source is not None and min_confidence is not None:
+            # Local OCR decoded the full-size pixels; a freshly opened image lets the JPEG decoder downscale instead.
+            content = Image.open(io.BytesIO(source))
+        with metrics.timed("image.prepare"):
+            content, stats = ocr_utils.prepare_image_for_model(
+                content, len(source) if source is not None else None, max_long_edge
+            )
+        bytes_saved = stats["bytes_saved"]
+        metrics.observe("image.upload_bytes", stats["prepared_bytes"])
+    with metrics.timed("ingest.model"):
+        parsed_data = batcher.parse(content) if batcher else _call_model(content, client, rate_limiter)
+    return parsed_data, bytes_saved, True
+
+
+def process_one(
+    uploaded_file: IO,
+    client: Any = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    parse_cache: Optional[cache.ParseCache] = None,
+    min_confidence: Optional[float] = DEFAULT_MIN_CONFIDENCE,
+    split_pdf_pages: bool = False,
+    max_long_edge: Optional[int] = ocr_utils.VISION_MAX_LONG_EDGE,
+    batcher: Optional[ModelBatcher] = None
+) -> IngestResult:
+    """
+    Runs one file through the decode, model call and validation stages. Never raises; a failed result
+    records the stage it failed in.
+    When a `parse_cache` is given, files (or PDF pages) the model parsed before skip decoding and the model call entirely.
+    Unless `min_confidence` is None, local OCR is tried first and only low-confidence receipts reach the model.
+    With `split_pdf_pages`, every page of a PDF becomes its own receipt.
+    Images bound for the vision model are shrunk to `max_long_edge` first (None sends them as-is).
+    With a `batcher`, model calls are grouped with those of other workers instead of sent one by one.
+    """
+    name = getattr(uploaded_file, "name", "<unnamed>")
+    start = time.perf_counter()
+    file_hash, stage = None, "decode"
+    try:
+        with metrics.timed("ingest.read"):
+            data = ocr_utils.read_bytes(uploaded_file)
+            file_hash = cache.content_hash(data)
+        metrics.observe("ingest.file_bytes", len(data))
+        model_name = cache.model_name_for(client)
+
+        # One cache/dedupe key per receipt: the file hash, or file hash + page for split PDFs.
+        if split_pdf_pages and ocr_utils.file_extension(name) == "pdf":
+            keys = {page: f"{file_hash}:p{page}" for page in range(1, ocr_utils.pdf_page_count(data) + 1)}
+        else:
+            keys = {None: file_hash}
+        with metrics.timed("ingest.cache_lookup"):
+            parsed = {page: parse_cache.get(key, model_name) if parse_cache else None for page, key in keys.items()}
+        missing = [page for page, parsed_data in parsed.items() if parsed_data is None]
+
+        if missing == [None]:
+            with metrics.timed("ingest.decode"):
+                fresh = [(None, ocr_utils.process_file(uploaded_file))]
+        else:
+            # Pages are decoded lazily as the loop below asks for them; see the pdf.* timers.
+            fresh = ocr_utils.iter_pdf_pages(data, pages=missing) if missing else []
+
+        receipts = {}
+        bytes_saved = 0
+        for page, content in fresh:
+            if content is None:
+                return IngestResult(name, error="File might be empty or corrupted.", elapsed=time.perf_counter() - start,
+                                    content_hash=file_hash, stage=stage)
+            stage = "parse"
+            parsed_data, saved, from_model = _parse_content(
+                content, client, rate_limiter, min_confidence, max_long_edge,
+                source=data if page is None else None, batcher=batcher
+            )
+            bytes_saved += saved
+            stage = "validate"
+            with metrics.timed("ingest.validate"):
+                receipts[page] = Receipt(**parsed_data, content_hash=keys[page])
+            # Only model results are cached: the key names the model, and a local OCR parse shouldn't be
+            # served back to a later run that asks for the model.
+            if parse_cache and from_model: parse_cache.put(keys[page], model_name, parsed_data)
+            stage = "decode"
+
+        for page, parsed_data in parsed.items():
+            if parsed_data is not None:
+                # Category rules may have changed since the result was cached.
+                parsed_data["category"] = data_extraction.map_category(parsed_data.get("vendor"))
+                receipts[page] = Receipt(**parsed_data, content_hash=keys[page])
+
+        if not receipts:
+            return IngestResult(name, error="File might be empty or corrupted.", elapsed=time.perf_counter() - start,
+                                content_hash=file_hash, stage=stage)
+        return IngestResult(
+            name, receipts=[receipts[page] for page in keys],
+            elapsed=time.perf_counter() - start, bytes_saved=bytes_saved, content_hash=file_hash
+        )
+    except Exception as e:
+        return IngestResult(name, error=str(e), elapsed=time.perf_counter() - start, content_hash=file_hash, stage=stage)
+
+
+def ingest_files(
+    files: Iterable[IO],
+    client: Any = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    max_per_minute: Optional[float] = None,
+    progress_callback: Optional[Callable[[int, int, IngestResult], None]] = None,
+    save: bool = True,
+    use_cache: bool = True,
+    skip_duplicates: bool = False,
+    min_confidence: Optional[float] = DEFAULT_MIN_CONFIDENCE,
+    split_pdf_pages: bool = False,
+    max_long_edge: Optional[int] = ocr_utils.VISION_MAX_LONG_EDGE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_wait: float = DEFAULT_BATCH_WAIT
+) -> List[IngestResult]:
+    """
+    Processes files on a bounded thread pool and persists all valid receipts in one transaction.
+    `progress_callback(done, total, result)` is invoked from the calling thread as each file finishes,
+    so it is safe to update Streamlit widgets from it. Results are returned in input order.
+    With `skip_duplicates`, files whose exact bytes are already in the database are not inserted again.
+    Pass `min_confidence=None` to send every file to the AI model.
+    With `batch_size` > 1, up to that many receipts share one model request (see ModelBatcher). A batch only
+    fills from files in flight at once, so it is capped at `max_workers` (and the number of files).
+    When saving, failed files are queued in the dead-letter table and successful ones removed from it.
+    """
+    files = list(files)
+    results: List[Optional[IngestResult]] = [None] * len(files)
+    rate_limiter = RateLimiter(max_per_minute)
+    # Larger batches could never fill and would each wait out `batch_wait`.
+    batch_size = min(batch_size, max(1, max_workers), max(1, len(files)))
+    batcher = ModelBatcher(client, batch_size, batch_wait, rate_limiter) if batch_size > 1 else None
+    process = functools.partial(
+        process_one, client=client, rate_limiter=rate_limiter,
+        parse_cache=cache.parse_cache if use_cache else None,
+        min_confidence=min_confidence, split_pdf_pages=split_pdf_pages, max_long_edge=max_long_edge,
+        batcher=batcher
+    )
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(process, f): i for i, f in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+            metrics.record_time("ingest.file", result.elapsed * 1000)
+            metrics.increment("ingest.files" if result.ok else f"ingest.failed.{result.stage}")
+            if progress_callback: progress_callback(done, len(files), result)
+
+    if save:
+        with metrics.timed("ingest.save"):
+            receipts = [receipt for r in results for receipt in r.receipts]
+            db.insert_receipts_bulk(receipts, skip_duplicates=skip_duplicates)
+            db.add_dead_letters([
+                (r.content_hash, r.name, r.stage, r.error, ocr_utils.read_bytes(f))
+                for f, r in zip(files, results) if not r.ok and r.content_hash
+            ])
+            db.delete_dead_letters([r.content_hash for r in results if r.ok])
+    return results
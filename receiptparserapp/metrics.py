@@ -0,0 +1,212 @@
+# metrics.py (Lightweight Timing and Counter Instrumentation)
+# Stage timings, sizes and event counts recorded in-process, summarized as p50/p95/p99. Worker processes store
+# their snapshots in the database (database.save_metrics, folded into one row by database.retire_metrics when
+# they exit) so the app and `python cli.py metrics` see all of them.
+# Each timing is also logged as a JSON line on the "receiptparser.metrics" logger at DEBUG level.
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger("receiptparser.metrics")
+
+# Set to False to make instrumentation a no-op (e.g. when benchmarking without it).
+ENABLED = True
+# Histogram buckets are powers of this factor, so percentiles are within about 2% of the true value
+# while any number of snapshots can be merged exactly.
+BUCKET_GROWTH = 1.04
+PERCENTILES = (50, 95, 99)
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+_MIN_VALUE = 1e-6
+
+
+class Histogram:
+    """Count, sum, min, max and log-spaced bucket counts of observed values."""
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+        index = math.floor(math.log(max(value, _MIN_VALUE)) / _LOG_GROWTH)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "Histogram"):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def percentile(self, p: float) -> float:
+        if not self.count: return 0.0
+        rank, seen = p / 100 * self.count, 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Geometric middle of the bucket, kept within the values actually seen.
+                return min(max(BUCKET_GROWTH ** (index + 0.5), self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count, "total": self.total, "mean": self.total / self.count if self.count else 0.0,
+            **{f"p{p}": self.percentile(p) for p in PERCENTILES}, "max": self.max if self.count else 0.0,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "buckets": {str(index): count for index, count in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        histogram = cls()
+        histogram.count, histogram.total = data["count"], data["total"]
+        histogram.min, histogram.max = data["min"], data["max"]
+        histogram.buckets = {int(index): count for index, count in data["buckets"].items()}
+        return histogram
+
+
+class Registry:
+    """
+    Thread-safe store of timers (milliseconds), value histograms (bytes, tokens, batch sizes) and counters.
+    Snapshots are plain JSON-serializable dicts that can be merged across threads, processes and runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._timers: Dict[str, Histogram] = {}
+            self._values: Dict[str, Histogram] = {}
+            self._counters: Dict[str, float] = {}
+
+    def record_time(self, name: str, ms: float):
+        with self._lock:
+            histogram = self._timers.get(name)
+            if histogram is None: histogram = self._timers[name] = Histogram()
+            histogram.add(ms)
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self._values.get(name)
+            if histogram is None: histogram = self._values[name] = Histogram()
+            histogram.add(value)
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started_at": self.started_at, "updated_at": time.time(),
+                "timers": {name: h.to_dict() for name, h in self._timers.items()},
+                "values": {name: h.to_dict() for name, h in self._values.items()},
+                "counters": dict(self._counters),
+            }
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Records the wall time of a block (or, used as a decorator, of every call) under `name`, in milliseconds.
+    Blocks that raise are timed too, and also counted as `<name>.errors`.
+    """
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.increment(f"{name}.errors")
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        registry.record_time(name, ms)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({"metric": name, "ms": round(ms, 3), "ts": time.time()}))
+
+
+def record_time(name: str, ms: float):
+    """Adds a duration measured elsewhere (e.g. a result's own elapsed time) to the `name` timer."""
+    if ENABLED: registry.record_time(name, ms)
+
+
+def observe(name: str, value: float):
+    """Adds one sample (e.g. a request's byte or token count) to the `name` histogram."""
+    if ENABLED: registry.observe(name, value)
+
+
+def increment(name: str, value: float = 1):
+    if ENABLED: registry.increment(name, value)
+
+
+def snapshot() -> Dict[str, Any]:
+    return registry.snapshot()
+
+
+def reset():
+    registry.reset()
+
+
+def merge(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combines snapshots (e.g. this process's and each worker's) into one."""
+    timers: Dict[str, Histogram] = {}
+    values: Dict[str, Histogram] = {}
+    counters: Dict[str, float] = {}
+    started_at, updated_at = math.inf, 0.0
+    for snap in snapshots:
+        started_at, updated_at = min(started_at, snap["started_at"]), max(updated_at, snap["updated_at"])
+        for merged, part in ((timers, snap["timers"]), (values, snap["values"])):
+            for name, data in part.items():
+                merged.setdefault(name, Histogram()).merge(Histogram.from_dict(data))
+        for name, value in snap["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+    return {
+        "started_at": started_at if timers or values or counters else None, "updated_at": updated_at or None,
+        "timers": {name: h.to_dict() for name, h in timers.items()},
+        "values": {name: h.to_dict() for name, h in values.items()},
+        "counters": counters,
+    }
+
+
+def summarize(snap: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Count, total, mean, p50/p95/p99 and max of every timer and value histogram, plus the counters."""
+    snap = snap or snapshot()
+    return {
+        "started_at": snap["started_at"], "updated_at": snap["updated_at"],
+        "timers_ms": {name: Histogram.from_dict(data).summary() for name, data in sorted(snap["timers"].items())},
+        "values": {name: Histogram.from_dict(data).summary() for name, data in sorted(snap["values"].items())},
+        "counters": dict(sorted(snap["counters"].items())),
+    }
+
+
+def export_json(f: IO[str], snap: Optional[Dict[str, Any]] = None):
+    """Writes the summary of `snap` (default: this process) as JSON."""
+    json.dump(summarize(snap), f, indent=2)
+    f.write("\n")
+
+
+def log_summary(snap: Optional[Dict[str, Any]] = None, level: int = logging.INFO):
+    """Logs the summary as a single JSON line, for log-based metric collection."""
+    if logger.isEnabledFor(level): logger.log(level, json.dumps({"metrics": summarize(snap)}))
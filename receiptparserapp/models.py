@@ -14,6 +14,7 @@ class Receipt(BaseModel):
     category: Optional[str] = None
     raw_text: str
     currency: Optional[str] = "USD"
+    content_hash: Optional[str] = None
 
     @field_validator('amount')
     @classmethod
@@ -1,33 +1,249 @@
 # ocr_utils.py (Universal File Processor)
 
-from PIL import Image
-from pdf2image import convert_from_bytes
-from typing import IO, Union, List
+import functools
+import io
+import subprocess
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+from typing import IO, Union, List, Optional, Tuple, Iterator, Iterable, Dict, Any
+
+import metrics
+
+# Skew below this many degrees isn't worth the interpolation blur of a rotation.
+MIN_DESKEW_ANGLE = 0.5
+# Photos are downscaled to this long edge before OCR; Tesseract reads receipts fine at this size,
+# while deskewing and thresholding a full 12 MP photo takes seconds.
+OCR_MAX_LONG_EDGE = 2000
+
+# Receipts are legible well below poppler's 200 DPI default, at a fraction of the pixels.
+PDF_DPI = 150
+PDF_THREADS = 4
+# Pages with less embedded text than this are treated as scans and rasterized.
+MIN_EMBEDDED_TEXT_CHARS = 20
+
+# Images sent to the vision model are downscaled and re-encoded with these defaults.
+VISION_MAX_LONG_EDGE = 1600
+VISION_JPEG_QUALITY = 80
+VISION_GRAYSCALE = True
+# Only crop when the detected receipt is a meaningful, but not near-total, part of the photo.
+CROP_MIN_AREA_RATIO = 0.2
+CROP_MAX_AREA_RATIO = 0.95
+
+def read_bytes(uploaded_file: IO) -> bytes:
+    """Returns the raw bytes of an uploaded file (from the start) and rewinds it so it can be processed again."""
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return data
+
+def file_extension(file_name: str) -> str:
+    return file_name.split('.')[-1].lower()
+
+@metrics.timed("pdf.info")
+def pdf_page_count(data: bytes) -> int:
+    return int(pdfinfo_from_bytes(data)["Pages"])
+
+@metrics.timed("pdf.text")
+def extract_pdf_text(data: bytes, first_page: int, last_page: int) -> List[str]:
+    """
+    Embedded text of each page in the range using poppler's pdftotext (no rasterization).
+    Scanned pages come back as empty strings.
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-f", str(first_page), "-l", str(last_page), "-", "-"],
+            input=data, capture_output=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return [""] * (last_page - first_page + 1)
+    # pdftotext separates pages with form feeds
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    pages += [""] * (last_page - first_page + 1 - len(pages))
+    return [page.strip() for page in pages[:last_page - first_page + 1]]
+
+def _contiguous_runs(pages: List[int]) -> Iterator[List[int]]:
+    run: List[int] = []
+    for page in pages:
+        if run and page != run[-1] + 1:
+            yield run
+            run = []
+        run.append(page)
+    if run: yield run
+
+def iter_pdf_pages(
+    data: bytes,
+    pages: Optional[Iterable[int]] = None,
+    dpi: int = PDF_DPI,
+    thread_count: int = PDF_THREADS
+) -> Iterator[Tuple[int, Union[Image.Image, str]]]:
+    """
+    Lazily yields (page_number, content) for the requested 1-based pages (all pages by default).
+    Pages with embedded text are returned as strings without being rasterized; scanned pages are
+    rasterized `thread_count` at a time, each window in one multi-threaded poppler call, so only a
+    window's worth of images is ever held in memory.
+    """
+    pages = sorted(pages) if pages is not None else list(range(1, pdf_page_count(data) + 1))
+    for start in range(0, len(pages), thread_count):
+        window = pages[start:start + thread_count]
+        texts = dict(zip(range(window[0], window[-1] + 1), extract_pdf_text(data, window[0], window[-1])))
+        contents = {page: texts[page] for page in window if len(texts[page]) >= MIN_EMBEDDED_TEXT_CHARS}
+
+        scanned = [page for page in window if page not in contents]
+        for run in _contiguous_runs(scanned):
+            with metrics.timed("pdf.rasterize"):
+                images = convert_from_bytes(
+                    data, dpi=dpi, first_page=run[0], last_page=run[-1], thread_count=min(len(run), thread_count)
+                )
+            metrics.increment("pdf.rasterized_pages", len(run))
+            contents.update(zip(run, images))
+
+        for page in window:
+            yield page, contents.pop(page)
 
 def process_file(uploaded_file: IO) -> Union[Image.Image, str, None]:
     """
     Processes an uploaded file and returns either an Image object or a text string.
+    For PDFs only the first page is used: its embedded text if it has any, otherwise a rasterized image.
     """
     file_name = uploaded_file.name
-    file_extension = file_name.split('.')[-1].lower()
+    extension = file_extension(file_name)
     
-    if file_extension in ['jpg', 'jpeg', 'png']:
+    if extension in ['jpg', 'jpeg', 'png']:
         return Image.open(uploaded_file)
         
-    elif file_extension == 'pdf':
+    elif extension == 'pdf':
         try:
-            # Convert PDF to a list of images
-            images = convert_from_bytes(uploaded_file.read())
-            # Return the first page as an image for Vision AI processing
-            if images:
-                return images[0]
-            return None # Handle empty PDFs
+            data = uploaded_file.read()
+            if pdf_page_count(data) == 0:
+                return None # Handle empty PDFs
+            return next(iter_pdf_pages(data, pages=[1]))[1]
         except Exception as e:
             raise RuntimeError(f"Could not process PDF '{file_name}'. Ensure 'poppler' is installed. Error: {e}")
 
-    elif file_extension == 'txt':
+    elif extension == 'txt':
         # Read the text file and return its content as a string
         return uploaded_file.read().decode('utf-8')
         
     else:
-        raise ValueError(f"Unsupported file type: {file_extension}")
\ No newline at end of file
+        raise ValueError(f"Unsupported file type: {extension}")
+
+def _deskew(gray: np.ndarray) -> np.ndarray:
+    """Rotates a grayscale image so its text lines are horizontal."""
+    _, inverted = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(inverted)
+    if coords is None: return gray
+    # minAreaRect's angle convention differs across OpenCV versions; fold it into (-45, 45].
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45: angle -= 90
+    elif angle <= -45: angle += 90
+    if abs(angle) < MIN_DESKEW_ANGLE: return gray
+
+    h, w = gray.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(gray, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+def preprocess_for_ocr(image: Image.Image) -> np.ndarray:
+    """Grayscale, downscale to OCR_MAX_LONG_EDGE, deskew and binarize a receipt image for Tesseract."""
+    gray = np.array(image.convert("L"))
+    scale = OCR_MAX_LONG_EDGE / max(gray.shape)
+    if scale < 1: gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = _deskew(gray)
+    gray = cv2.medianBlur(gray, 3)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+@functools.lru_cache(maxsize=None)
+def tesseract_available() -> bool:
+    """Whether the Tesseract binary can be run; checked once per process."""
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+def ocr_image(image: Image.Image) -> Optional[Tuple[str, float]]:
+    """
+    Runs Tesseract locally and returns (text, mean word confidence 0-100).
+    Returns None when the Tesseract binary isn't installed so callers can fall back to the AI model.
+    """
+    if not tesseract_available(): return None
+    try:
+        data = pytesseract.image_to_data(preprocess_for_ocr(image), output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractNotFoundError:
+        return None
+
+    lines: dict = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        if not word.strip(): continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        conf = float(data["conf"][i])
+        if conf >= 0: confidences.append(conf)
+
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+def crop_to_receipt(image: Image.Image) -> Image.Image:
+    """Crops a photo to the largest bright region (the receipt paper), if one stands out from the background."""
+    gray = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    # Work on a small copy; contour finding doesn't need full resolution.
+    scale = min(1.0, 800 / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, mask = cv2.threshold(cv2.GaussianBlur(small, (5, 5), 0), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return image
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    area_ratio = (w * h) / (small.shape[0] * small.shape[1])
+    if not CROP_MIN_AREA_RATIO <= area_ratio <= CROP_MAX_AREA_RATIO: return image
+    return image.crop((int(x / scale), int(y / scale), int((x + w) / scale), int((y + h) / scale)))
+
+def prepare_image_for_model(
+    image: Image.Image,
+    original_bytes: Optional[int] = None,
+    max_long_edge: Optional[int] = VISION_MAX_LONG_EDGE,
+    jpeg_quality: int = VISION_JPEG_QUALITY,
+    grayscale: bool = VISION_GRAYSCALE,
+    crop: bool = True
+) -> Tuple[Image.Image, Dict[str, Any]]:
+    """
+    Shrinks a receipt image before it is uploaded to the vision model: EXIF auto-orient,
+    crop to the receipt, downsample to `max_long_edge`, then re-encode as (grayscale) JPEG.
+    Returns the prepared image and stats on the bytes saved. `original_bytes` is the size of
+    the uploaded file; when unknown (e.g. rasterized PDF pages) the raw pixel size is used.
+    JPEGs are decoded at reduced size only if `image` hasn't been loaded yet (fresh from Image.open).
+    """
+    original_size = image.size
+    if original_bytes is None:
+        original_bytes = image.width * image.height * len(image.getbands())
+
+    if max_long_edge and image.format == "JPEG":
+        # Let the JPEG decoder downscale by a power of two while decoding, far cheaper than resizing later.
+        # Keep 2x headroom so cropping to the receipt still leaves enough pixels.
+        ratio = min(1.0, 2 * max_long_edge / max(image.size))
+        image.draft(image.mode, (int(image.width * ratio), int(image.height * ratio)))
+
+    image = ImageOps.exif_transpose(image)
+    if crop: image = crop_to_receipt(image)
+    # Drop to one channel before resampling so the resize touches a third of the data.
+    image = image.convert("L" if grayscale else "RGB")
+    if max_long_edge and max(image.size) > max_long_edge:
+        scale = max_long_edge / max(image.size)
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+    prepared_bytes = buffer.tell()
+    buffer.seek(0)
+    prepared = Image.open(buffer)
+
+    return prepared, {
+        "original_size": original_size, "prepared_size": prepared.size,
+        "original_bytes": original_bytes, "prepared_bytes": prepared_bytes,
+        "bytes_saved": max(0, original_bytes - prepared_bytes)
+    }
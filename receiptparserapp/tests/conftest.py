@@ -0,0 +1,23 @@
+# tests/conftest.py (Shared pytest fixtures)
+# Run from the receiptparserapp directory:  python -m pytest
+import os
+import sys
+
+import pytest
+
+# The app's modules are imported by name (`import database`), as they are when running app.py or cli.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import currencies  # noqa: E402
+import database as db  # noqa: E402
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Points `database` at a fresh database, and `currencies` at an empty rates file, for one test."""
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "receipts.db"))
+    monkeypatch.setattr(currencies, "RATES_FILE", str(tmp_path / "exchange_rates.csv"))
+    currencies.reload()
+    db.init_db()
+    yield db.DB_NAME
+    db.close_all_connections()
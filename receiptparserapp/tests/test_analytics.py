@@ -0,0 +1,33 @@
+# tests/test_analytics.py (Vectorized analytics.py vs. the algorithms.py reference)
+import random
+
+import pytest
+
+import algorithms
+import analytics
+from benchmarks.bench_analytics import random_records
+
+
+def _columns(records):
+    keys = ("vendor", "transaction_date", "amount", "category", "currency")
+    return {key: [r[key] for r in records] for key in keys}
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_compute_analytics_matches_reference(seed):
+    records = random_records(random.Random(seed).randint(0, 500), seed=seed)
+    reference = algorithms.calculate_aggregates(records)
+    for data in (records, _columns(records)):
+        result = analytics.compute_analytics(data)
+        assert {k: result["overall"][k] for k in reference} == pytest.approx(reference)
+        assert result["by_vendor"] == pytest.approx(algorithms.get_vendor_frequency(records))
+        assert result["by_month"] == pytest.approx(algorithms.get_monthly_spend(records))
+
+
+@pytest.mark.parametrize("amounts, mode", [([4.5], 4.5), ([1.0, 2.0, 2.0], 2.0), ([1.0, 2.0], "Multiple"), ([], "N/A")])
+def test_mode_matches_reference(amounts, mode):
+    records = [{"vendor": "Shop", "transaction_date": "2024-01-01", "amount": a, "category": None, "currency": "USD"}
+               for a in amounts]
+    assert analytics.compute_analytics(records)["overall"]["mode"] == mode
+    assert algorithms.calculate_aggregates(records)["mode"] == mode
+
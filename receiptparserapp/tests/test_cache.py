@@ -0,0 +1,33 @@
+# tests/test_cache.py (Parse cache eviction and lookups)
+import cache
+import database as db
+
+
+def cached_keys() -> set:
+    with db.get_db_connection() as conn:
+        return {row["cache_key"].split(":")[0] for row in conn.execute("SELECT cache_key FROM parse_cache")}
+
+
+def test_evicts_least_recently_used_in_bulk(temp_db, monkeypatch):
+    clock = iter(range(1_000_000))
+    monkeypatch.setattr(cache.time, "time", lambda: next(clock) * cache.LAST_USED_RESOLUTION)
+    parse_cache = cache.ParseCache(max_entries=10)
+    for i in range(parse_cache.high_water):
+        parse_cache.put(f"h{i}", "m", {"amount": i})
+    assert parse_cache.get("h0", "m") == {"amount": 0}  # now the most recently used
+    assert len(cached_keys()) == parse_cache.high_water
+
+    parse_cache.put("new", "m", {"amount": -1})
+    kept = {"h0", "new"} | {f"h{i}" for i in range(parse_cache.high_water - 8, parse_cache.high_water)}
+    assert cached_keys() == kept
+
+
+def test_recent_hits_do_not_write(temp_db):
+    parse_cache = cache.ParseCache()
+    parse_cache.put("h", "m", {"vendor": "Shop"})
+    with db.get_db_connection() as conn:
+        before = conn.total_changes
+    assert parse_cache.get("h", "m") == {"vendor": "Shop"}
+    with db.get_db_connection() as conn:
+        assert conn.total_changes == before
+    assert parse_cache.stats()["hits"] == 1
@@ -0,0 +1,37 @@
+# tests/test_metrics.py (Metrics snapshots published through the database)
+import time
+
+import database as db
+import metrics
+
+
+def snapshot(hits: int, ms: float, updated_at: float = None) -> dict:
+    registry = metrics.Registry()
+    registry.increment("cache.hits", hits)
+    registry.record_time("ingest.file", ms)
+    snap = registry.snapshot()
+    if updated_at is not None: snap["updated_at"] = updated_at
+    return snap
+
+
+def sources() -> list:
+    with db.get_db_connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT source FROM metrics"))
+
+
+def test_finished_and_stale_processes_fold_into_one_row(temp_db):
+    db.save_metrics("worker-a", snapshot(1, 10))
+    db.save_metrics("worker-b", snapshot(2, 20, updated_at=time.time() - db.WORKER_TIMEOUT - 1))
+    db.save_metrics("worker-c", snapshot(4, 40))
+    assert metrics.merge(db.get_metrics_snapshots(include_retired=False))["counters"] == {"cache.hits": 5}
+
+    db.retire_metrics("worker-a", snapshot(8, 80))  # the final snapshot replaces the last saved one
+    db.retire_metrics("cli:1", snapshot(16, 160))
+    assert db.retire_stale_metrics() == 1
+    assert db.retire_stale_metrics() == 0
+    assert sources() == [db.RETIRED_METRICS, "worker-c"]
+
+    merged = metrics.merge(db.get_metrics_snapshots())
+    assert merged["counters"] == {"cache.hits": 30}
+    assert merged["timers"]["ingest.file"]["count"] == 4
+    assert metrics.merge(db.get_metrics_snapshots(include_retired=False))["counters"] == {"cache.hits": 4}
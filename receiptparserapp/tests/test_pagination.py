@@ -0,0 +1,30 @@
+# tests/test_pagination.py (Keyset pagination vs. one fully sorted query)
+import random
+from datetime import date
+
+import pytest
+
+import database as db
+from test_summaries import random_receipt
+
+FILTERS = [None, {"amount_range": (50, None)}, {"amount_range": (None, 150)},
+           {"date_range": (date(2024, 2, 1), date(2024, 5, 31))}, {"vendor_keyword": "walmart", "amount_range": (10, 250)}]
+
+
+def all_pages(filters, sort_by, descending, page_size=7):
+    rows, after = [], None
+    while True:
+        page = db.get_receipts_page(filters, sort_by, descending, after, page_size)
+        rows += page
+        if len(page) < page_size: return rows
+        after = (page[-1][sort_by], page[-1]["id"])
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("sort_by", sorted(db.SORTABLE_COLUMNS))
+@pytest.mark.parametrize("descending", [True, False])
+def test_pages_match_full_sort(temp_db, filters, sort_by, descending):
+    rng = random.Random(0)
+    db.insert_receipts_bulk([random_receipt(rng) for _ in range(120)])
+    expected = db.get_receipts_page(filters, sort_by, descending, None, 10_000)
+    assert [r["id"] for r in all_pages(filters, sort_by, descending)] == [r["id"] for r in expected]
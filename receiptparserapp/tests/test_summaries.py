@@ -0,0 +1,90 @@
+# tests/test_summaries.py (Trigger-maintained summary tables vs. a full rebuild)
+import io
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import categories
+import currencies
+import database as db
+from models import Receipt
+
+VENDORS = ["Walmart", "WALMART #1234", "walmart supercenter", "Target", "Starbucks", "Starbucks Coffee", "Shell", None]
+CURRENCIES = ["USD", "EUR", "€", "GBP", "INR", None]
+CATEGORIES = ["Groceries", "Food & Drink", "Fuel", None]
+RATES = "date,currency,rate\n2024-01-01,EUR,0.9\n2024-04-01,EUR,0.95\n2024-01-01,GBP,0.8\n"  # no INR rates
+
+
+def random_receipt(rng: random.Random) -> Receipt:
+    return Receipt(
+        vendor=rng.choice(VENDORS),
+        transaction_date=rng.choice([None, date(2024, 1, 1) + timedelta(days=rng.randint(0, 200))]),
+        amount=rng.choice([None, round(rng.uniform(0.5, 300), 2)]),
+        category=rng.choice(CATEGORIES), currency=rng.choice(CURRENCIES), raw_text="test",
+    )
+
+
+def random_changes(rng: random.Random) -> dict:
+    receipt = random_receipt(rng)
+    columns = rng.sample(["vendor", "transaction_date", "amount", "category", "currency"], rng.randint(1, 3))
+    return {column: getattr(receipt, column) for column in columns}
+
+
+def derived_state() -> dict:
+    """Every summary row and vendor count, flattened to {(table, key, column): value}."""
+    state = {}
+    with db.get_db_connection() as conn:
+        for table in db.SUMMARY_TABLES:
+            for row in conn.execute(f"SELECT * FROM {table}"):
+                state.update({(table, row["key"], column): row[column] for column in row.keys() if column != "key"})
+        # Display names may differ (first spelling seen vs. MIN); the normalized names and counts may not.
+        for row in conn.execute("SELECT normalized, receipt_count FROM vendors"):
+            state[("vendors", row["normalized"], "receipt_count")] = row["receipt_count"]
+        conn.execute("INSERT INTO vendor_fts (vendor_fts) VALUES ('integrity-check')")
+    return state
+
+
+def receipt_ids() -> list:
+    return db.get_receipt_columns(columns=("id",))["id"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_triggers_match_rebuild_after_random_writes(temp_db, seed):
+    rng = random.Random(seed)
+    currencies.import_rates_file(io.StringIO(RATES))
+    for step in range(60):
+        ids = receipt_ids()
+        action = rng.random()
+        if action < 0.4 or not ids:
+            db.insert_receipts_bulk([random_receipt(rng) for _ in range(rng.randint(1, 20))])
+        elif action < 0.7:
+            db.update_receipts_bulk([(i, random_changes(rng)) for i in rng.sample(ids, min(len(ids), rng.randint(1, 10)))])
+        elif action < 0.8:
+            db.update_receipt(rng.choice(ids), random_changes(rng))
+        elif action < 0.95:
+            db.delete_receipts_by_ids(rng.sample(ids, min(len(ids), rng.randint(1, 8))))
+        else:
+            categories.recategorize_all()
+            db.renormalize_all()
+
+    maintained = derived_state()
+    db.rebuild_summaries()
+    assert maintained == pytest.approx(derived_state())
+    assert maintained, "the random writes should leave some receipts behind"
+
+
+def test_delete_all_receipts_clears_summaries_and_keeps_triggers(temp_db):
+    rng = random.Random(0)
+    db.insert_receipts_bulk([random_receipt(rng) for _ in range(50)])
+    db.delete_all_receipts()
+    assert derived_state() == {}
+    assert db.count_receipts() == 0
+
+    db.insert_receipts_bulk([Receipt(vendor="Walmart #12", transaction_date=date(2024, 2, 3), amount=5.0, raw_text="test")])
+    assert receipt_ids() == [1]
+    maintained = derived_state()
+    assert maintained[("summary_monthly", "2024-02", "total")] == 5.0
+    db.rebuild_summaries()
+    assert maintained == derived_state()
+    assert [v["normalized"] for v in db.search_vendors("walm")] == ["walmart"]
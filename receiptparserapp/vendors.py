@@ -0,0 +1,38 @@
+# vendors.py (Vendor Name Normalization)
+import re
+import unicodedata
+from typing import Optional, Set
+
+# Store/branch numbers: "#1234", "Store 12", "No. 7", "Unit 3", or a standalone 3+ digit code like "T-1234".
+STORE_NUMBER_RE = re.compile(r"#\s*\d+|\b(?:store|str|no|unit|loc|branch)\b\.?\s*#?\s*\d+\b|\b[a-z]{0,2}-?\d{3,}\b")
+NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+# Legal-form words that don't distinguish one vendor from another.
+CORPORATE_SUFFIXES = {"inc", "llc", "ltd", "co", "corp", "corporation", "company", "plc", "gmbh", "limited"}
+
+
+def _fold(name: str) -> str:
+    """Lowercase ASCII with accents removed, '&' spelled out and apostrophes dropped."""
+    decomposed = unicodedata.normalize("NFKD", name)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return folded.replace("&", " and ").replace("'", "").replace("’", "")
+
+
+def normalize_vendor(name: Optional[str]) -> Optional[str]:
+    """
+    Canonical form used to group and search vendors: "WAL-MART Store #1234" -> "wal mart",
+    "McDonald's Corp." -> "mcdonalds". Returns None for empty names.
+    """
+    if not name or not name.strip(): return None
+    folded = _fold(name)
+    tokens = NON_ALNUM_RE.sub(" ", STORE_NUMBER_RE.sub(" ", folded)).split()
+    # "& Co." leaves a dangling "and" once the suffix is gone.
+    while len(tokens) > 1 and (tokens[-1] in CORPORATE_SUFFIXES or tokens[-1] == "and"):
+        tokens.pop()
+    if len(tokens) > 1 and tokens[0] == "the":
+        tokens.pop(0)
+    # A name that is nothing but a number ("76") is kept rather than normalized away.
+    return " ".join(tokens) or " ".join(NON_ALNUM_RE.sub(" ", folded).split()) or None
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,166 @@
+# worker.py (Background Ingestion Worker)
+# Processes the files queued from the app in separate processes, so a Streamlit session never waits on
+# ingestion and queued work survives closing the tab. Usage, from the receiptparserapp directory:
+#   GEMINI_API_KEY=KEY python worker.py                 # one worker, runs until stopped
+#   python worker.py --processes 4 --idle-timeout 60    # four workers that exit once the queue stays empty
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import categories
+import currencies
+import data_extraction
+import database as db
+import ingestion
+import metrics
+
+DEFAULT_CLAIM_SIZE = 8
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 5.0
+MAX_JOB_ATTEMPTS = 3
+
+
+def _heartbeat(worker_id: str, stop: threading.Event):
+    # Runs beside long ingestion calls so a busy worker is never mistaken for a dead one,
+    # and publishes this process's circuit-breaker state and stage timings for the app's sidebar.
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        db.heartbeat_worker(worker_id, data_extraction.circuit_breaker.state)
+        db.save_metrics(worker_id, metrics.snapshot())
+
+
+def _rates_file_version() -> Optional[int]:
+    return os.stat(currencies.RATES_FILE).st_mtime_ns if os.path.exists(currencies.RATES_FILE) else None
+
+
+def _reload_if_changed(seen: Dict[str, Any]):
+    """
+    (Re)loads the category rules and exchange rates if they changed (e.g. imported in the app) since the last
+    check, so receipts aren't categorized or converted with what was current when the worker started.
+    """
+    versions = {"rules": db.get_category_rules_version(), "rates": _rates_file_version()}
+    if seen.get("rules") != versions["rules"]: categories.reload()
+    if seen.get("rates") != versions["rates"]: currencies.reload()
+    seen.update(versions)
+
+
+def process_jobs(worker_id: str, jobs: List[Dict[str, Any]], client: Any = None) -> int:
+    """Ingests one claimed group of jobs and records each job's outcome; returns how many failed."""
+    files = []
+    for job in jobs:
+        f = io.BytesIO(job["payload"])
+        f.name = job["name"]
+        files.append(f)
+    finished_at: Dict[int, float] = {}
+    try:
+        results = ingestion.ingest_files(
+            files, client=client, progress_callback=lambda done, total, result: finished_at.setdefault(id(result), time.time()),
+            **json.loads(jobs[0]["options"])
+        )
+    except Exception as e:
+        # Nothing was saved for these files; record why rather than leaving them running.
+        now = time.time()
+        db.finish_jobs(worker_id, [(job["id"], "failed", 0, "save", str(e), now) for job in jobs])
+        return len(jobs)
+    db.finish_jobs(worker_id, [
+        (job["id"], "done" if r.ok else "failed", len(r.receipts), r.stage, r.error, finished_at[id(r)])
+        for job, r in zip(jobs, results)
+    ])
+    return sum(1 for r in results if not r.ok)
+
+
+def run_worker(
+    db_name: str,
+    api_key: Optional[str] = None,
+    model_name: str = "gemini-1.5-flash",
+    claim_size: int = DEFAULT_CLAIM_SIZE,
+    idle_timeout: Optional[float] = None,
+    client: Any = None,
+    rates_file: Optional[str] = None
+):
+    """Claims and processes queued jobs until stopped, or until the queue has been empty for `idle_timeout` seconds."""
+    db.DB_NAME = db_name
+    if rates_file: currencies.RATES_FILE = rates_file
+    if api_key: data_extraction.configure_model(api_key, model_name)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    db.register_worker(worker_id, os.getpid())
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(worker_id, stop), daemon=True).start()
+    idle_since = time.monotonic()
+    seen_versions: Dict[str, Any] = {}
+    try:
+        while True:
+            db.requeue_orphaned_jobs(MAX_JOB_ATTEMPTS)
+            db.retire_stale_metrics()
+            jobs = db.claim_jobs(worker_id, claim_size)
+            if not jobs:
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout: return
+                time.sleep(POLL_INTERVAL)
+                continue
+            _reload_if_changed(seen_versions)
+            start = time.perf_counter()
+            failed = process_jobs(worker_id, jobs, client)
+            print(f"[{worker_id}] {len(jobs) - failed}/{len(jobs)} file(s) ok in {time.perf_counter() - start:.1f}s", flush=True)
+            idle_since = time.monotonic()
+    finally:
+        stop.set()
+        db.retire_metrics(worker_id, metrics.snapshot())
+        db.unregister_worker(worker_id)
+
+
+def spawn(processes: int, api_key: Optional[str], model_name: str, idle_timeout: Optional[float] = None) -> subprocess.Popen:
+    """Starts `python worker.py` detached from the caller (e.g. a Streamlit session), passing the API key via the environment."""
+    # Both paths are made absolute: the worker runs from this directory, not the caller's working directory.
+    command = [sys.executable, os.path.abspath(__file__), "--db", os.path.abspath(db.DB_NAME),
+               "--rates", os.path.abspath(currencies.RATES_FILE), "--processes", str(processes), "--model", model_name]
+    if idle_timeout is not None: command += ["--idle-timeout", str(idle_timeout)]
+    env = {**os.environ, "GEMINI_API_KEY": api_key} if api_key else None
+    return subprocess.Popen(
+        command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process receipts queued for background ingestion.")
+    parser.add_argument("--db", default=db.DB_NAME, help="Path to the SQLite database.")
+    parser.add_argument("--rates", default=currencies.RATES_FILE, help="Exchange-rates CSV used for currency conversion.")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"),
+                        help="Gemini API key (default: $GEMINI_API_KEY). Without one only local OCR is used.")
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to run (e.g. one per core).")
+    parser.add_argument("--claim-size", type=int, default=DEFAULT_CLAIM_SIZE, help="Files each worker takes at a time.")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="Exit after this many seconds without work.")
+    args = parser.parse_args(argv)
+
+    db.DB_NAME = args.db
+    currencies.RATES_FILE = args.rates
+    db.init_db()
+    worker_args = (args.db, args.api_key, args.model, args.claim_size, args.idle_timeout, None, args.rates)
+    if args.processes <= 1:
+        run_worker(*worker_args)
+        return 0
+
+    # "spawn" gives each worker its own interpreter, with no database connections inherited from this one.
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=worker_args) for _ in range(args.processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+    return 0 if all(process.exitcode == 0 for process in workers) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())